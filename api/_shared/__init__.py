@@ -0,0 +1,4 @@
+"""
+Code shared by the Vercel serverless functions in api/download/
+The leading underscore keeps Vercel from deploying it as a function itself.
+"""
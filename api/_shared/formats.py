@@ -0,0 +1,23 @@
+"""
+Audio quality and source format choices for the serverless functions
+Mirrors playlist_app/formats.py in the Django app (a test keeps the two in
+step): the smallest audio-only stream good enough for the MP3 bitrate, never
+a video.
+"""
+
+
+# MP3 bitrates (kbps) a download may ask for, as the strings clients send
+QUALITIES = ('128', '192', '320')
+
+# Bitrate a codec needs to match MP3 at the same quality, as a fraction of MP3's:
+# Opus needs half the bitrate, AAC about 1/1.3
+SOURCE_CODECS = (('opus', 2.0), ('mp4a', 1.3))
+
+
+def audio_format(quality):
+    """yt-dlp format spec for the MP3 bitrate ``quality``"""
+    specs = [
+        f"worstaudio[acodec^={codec}][abr>={int(int(quality) * 0.98 / efficiency)}][filesize<?50M]"
+        for codec, efficiency in SOURCE_CODECS
+    ]
+    return '/'.join(specs + ['bestaudio[filesize<?50M]'])
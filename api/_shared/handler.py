@@ -0,0 +1,210 @@
+"""
+Base request handler for the serverless functions
+Reads JSON bodies incrementally under a size cap and rejects malformed,
+oversized or rate-limited requests before any work is done; also owns the
+JSON/CORS response helpers both functions used to duplicate.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is the fallback
+    orjson = None
+
+
+# Largest request body accepted (bytes); the real payloads are well under 1 KiB
+MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 16 * 1024))
+READ_CHUNK_BYTES = 64 * 1024
+# Key clients on X-Forwarded-For only behind a proxy that sets it; on by
+# default on Vercel (which sets VERCEL=1), whose edge writes the header itself
+TRUST_X_FORWARDED_FOR = os.environ.get(
+    'TRUST_X_FORWARDED_FOR', '1' if os.environ.get('VERCEL') else ''
+).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def json_dumps(data):
+    """Compact UTF-8 JSON bytes, via orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class RequestError(Exception):
+    """Request rejected before handling; becomes a JSON error response"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class RateLimiter:
+    """Token bucket per client IP (mirrors playlist_app.admission.RateLimiter)
+
+    State lives in the warm function instance, so it limits bursts a client
+    sends to one instance rather than across all of them.
+    """
+
+    def __init__(self, rate_per_minute, burst, max_clients=10000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """Take a token; returns 0, or the seconds to wait when the bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = max(1, math.ceil((1 - tokens) / self.rate))
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """POST-with-JSON-body handler; subclasses implement handle_json(data)"""
+
+    # Socket timeout for slow clients (seconds), applied by StreamRequestHandler
+    timeout = 30
+    max_body_bytes = MAX_BODY_BYTES
+    trust_x_forwarded_for = TRUST_X_FORWARDED_FOR
+    # Optional RateLimiter checked before the body is read
+    rate_limiter = None
+
+    def do_POST(self):
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(self.client_ip())
+            if wait:
+                self.close_connection = True
+                self.send_error_response(429, "Too many requests, please retry shortly",
+                                         headers={'Retry-After': str(wait)})
+                return
+
+        try:
+            data = self.read_json_body()
+        except RequestError as e:
+            self.send_error_response(e.status_code, e.message)
+            return
+
+        try:
+            self.handle_json(data)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            self.send_error_response(500, f"Server error: {str(e)}")
+
+    def handle_json(self, data):
+        """Answer a request whose body parsed to the dict ``data``; subclasses must override this"""
+        raise NotImplementedError
+
+    def client_ip(self):
+        """Client address; the last X-Forwarded-For hop only behind a trusted proxy
+
+        The proxy appends the address it saw, so earlier hops are whatever the
+        client sent and can't be used to key the rate limiter.
+        """
+        if self.trust_x_forwarded_for:
+            forwarded = self.headers.get('X-Forwarded-For', '')
+            if forwarded.strip():
+                return forwarded.split(',')[-1].strip()
+        return self.client_address[0] if self.client_address else ''
+
+    def read_json_body(self):
+        """Parse the request body as a JSON object, enforcing max_body_bytes
+
+        Content-Length is validated before anything is read, and the body is
+        read in chunks so a short or stalled body fails instead of blocking
+        on one large read.
+        """
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            raise RequestError(411, "Chunked request bodies are not supported")
+
+        length_header = self.headers.get('Content-Length')
+        if length_header is None:
+            raise RequestError(411, "Missing Content-Length")
+        try:
+            content_length = int(length_header)
+        except ValueError:
+            raise RequestError(400, "Invalid Content-Length")
+        if content_length < 0:
+            raise RequestError(400, "Invalid Content-Length")
+        if content_length > self.max_body_bytes:
+            # Don't drain the body; the connection is closed after replying
+            self.close_connection = True
+            raise RequestError(413, f"Request body too large (limit {self.max_body_bytes} bytes)")
+
+        chunks = []
+        remaining = content_length
+        while remaining:
+            try:
+                chunk = self.rfile.read(min(remaining, READ_CHUNK_BYTES))
+            except OSError:  # includes socket timeouts
+                chunk = b''
+            if not chunk:
+                self.close_connection = True
+                raise RequestError(400, "Incomplete request body")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        try:
+            data = json.loads(b''.join(chunks))
+        except ValueError:
+            raise RequestError(400, "Request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise RequestError(400, "Request body must be a JSON object")
+        return data
+
+    def send_json_response(self, data, status_code=200, headers=None):
+        """Send JSON response
+
+        If the handler has a StageTimer as self.timer, encoding and writing are
+        timed as the 'respond' stage and the timings go out as Server-Timing.
+        """
+        timer = getattr(self, 'timer', None)
+        if timer:
+            timer.start('respond')
+        response_json = json_dumps(data)
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_json)))
+        self.send_cors_headers()
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if timer:
+            self.send_header('Server-Timing', timer.server_timing())
+        self.end_headers()
+
+        self.wfile.write(response_json)
+        if timer:
+            timer.stop('respond', len(response_json))
+
+    def send_error_response(self, status_code, message, headers=None):
+        """Send error response"""
+        error_data = {'success': False, 'error': message}
+        self.send_json_response(error_data, status_code, headers)
+
+    def send_cors_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Expose-Headers', 'Retry-After')
+
+    def do_OPTIONS(self):
+        """Handle preflight requests"""
+        self.send_response(200)
+        self.send_cors_headers()
+        self.end_headers()
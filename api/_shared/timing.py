@@ -0,0 +1,47 @@
+"""
+Per-request pipeline stage timings for the serverless functions
+Each stage's duration and byte count go out in the Server-Timing header and
+as one JSON log line per request, which Vercel collects from stdout.
+"""
+import json
+import logging
+import sys
+import time
+
+
+logger = logging.getLogger('api.pipeline')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class StageTimer:
+    """Per-request stage timings (seconds, bytes), logged and sent as Server-Timing"""
+
+    def __init__(self):
+        self.stages = {}
+        self._started = {}
+
+    def start(self, stage):
+        self._started[stage] = time.perf_counter()
+
+    def stop(self, stage, bytes_moved=0):
+        started = self._started.pop(stage, None)
+        if started is not None:
+            self.stages[stage] = {
+                'seconds': time.perf_counter() - started,
+                'bytes': bytes_moved,
+            }
+
+    def server_timing(self):
+        return ', '.join(
+            f"{stage};dur={entry['seconds'] * 1000:.1f}"
+            for stage, entry in self.stages.items()
+        )
+
+    def log(self, **fields):
+        """Log the stages (and ``fields``) as one 'pipeline_timing' JSON line"""
+        logger.info(json.dumps({'event': 'pipeline_timing', 'stages': self.stages, **fields}))
@@ -2,59 +2,135 @@
 Vercel Serverless Function for YouTube Audio Download
 Handles the audio download and conversion process
 """
-import json
 import tempfile
 import os
-from http.server import BaseHTTPRequestHandler
-import yt_dlp
 import base64
+from api._shared.formats import QUALITIES, audio_format
+from api._shared.handler import JSONHandler, RateLimiter
+from api._shared.timing import StageTimer
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        try:
-            # Parse request
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+
+# yt-dlp is imported on first use so OPTIONS and bad requests don't pay for
+# it; the search client is then kept for warm invocations
+_search_ydl = None
+
+
+def get_search_client():
+    """YoutubeDL used only for searches, shared by every request this instance serves"""
+    global _search_ydl
+    if _search_ydl is None:
+        import yt_dlp
+        _search_ydl = yt_dlp.YoutubeDL({
+            'quiet': True,
+            'no_warnings': True,
+            'noplaylist': True,
+            'socket_timeout': 30,
+            'retries': 1,
+        })
+    return _search_ydl
+
+
+# Single-pass EBU R128 normalization, applied when a request sends "normalize": true
+LOUDNORM_FILTER = os.environ.get('AUDIO_LOUDNORM_FILTER', 'loudnorm=I=-16:TP=-1.5:LRA=11')
+NORMALIZE_BY_DEFAULT = os.environ.get('AUDIO_NORMALIZE', '').lower() in ('1', 'true', 'yes')
+
+
+def extract_audio_args(data):
+    """Extra FFmpeg output args for loudness normalization and ID3 tags
+    
+    They are handed to yt-dlp's ExtractAudio postprocessor, so both happen in
+    the one FFmpeg pass that already encodes the MP3.
+    """
+    args = []
+    if data.get('normalize', NORMALIZE_BY_DEFAULT):
+        # loudnorm resamples internally; pin the output back to 44.1 kHz
+        args += ['-af', LOUDNORM_FILTER, '-ar', '44100']
+    if data.get('tags', True):
+        tags = {key: str(data[key])[:200] for key in ('title', 'artist', 'album') if data.get(key)}
+        if tags:
+            args += ['-id3v2_version', '3']
+            for key, value in tags.items():
+                args += ['-metadata', f'{key}={value}']
+    return args
+
+
+class handler(JSONHandler):
+    # Each instance runs one transcode at a time; this caps how fast one
+    # client can keep an instance busy
+    rate_limiter = RateLimiter(
+        rate_per_minute=float(os.environ.get('AUDIO_RATE_PER_MINUTE', 30)),
+        burst=int(os.environ.get('AUDIO_RATE_BURST', 5)),
+    )
+    
+    def handle_json(self, data):
+        search_query = data.get('query', '')
+        quality = str(data.get('quality', '192'))
+        
+        if not search_query:
+            self.send_error_response(400, "Missing search query")
+            return
+        if quality not in QUALITIES:
+            self.send_error_response(400, f"Quality must be one of {', '.join(QUALITIES)}")
+            return
+        
+        # Download and process audio
+        self.timer = StageTimer()
+        audio_data = self.download_audio(search_query, quality, extract_audio_args(data))
+        
+        if audio_data:
+            # Return base64 encoded audio data
+            self.timer.start('encode')
+            encoded_audio = base64.b64encode(audio_data).decode('utf-8')
+            self.timer.stop('encode', len(encoded_audio))
             
-            search_query = data.get('query', '')
-            quality = data.get('quality', '192')
+            response = {
+                'success': True,
+                'audio_data': encoded_audio,
+                'content_type': 'audio/mpeg',
+                'filename': f"{search_query[:50]}.mp3"
+            }
             
-            if not search_query:
-                self.send_error_response(400, "Missing search query")
+            self.send_json_response(response)
+            self.timer.log(query=search_query, quality=quality)
+        else:
+            self.send_error_response(404, "Audio not found")
+    
+    def download_audio(self, search_query, quality='192', ffmpeg_args=None):
+        """Download and convert audio using yt-dlp
+        
+        ``ffmpeg_args`` are appended to the MP3 encode's output options.
+        """
+        timer = self.timer
+        
+        def on_progress(d):
+            if d['status'] == 'finished':
+                timer.stop('yt_download', d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+        
+        def on_postprocess(d):
+            if d['postprocessor'] != 'ExtractAudio':
                 return
+            if d['status'] == 'started':
+                timer.start('transcode')
+            elif d['status'] == 'finished':
+                timer.stop('transcode')
+        
+        try:
+            # Search first, then download the resolved entry
+            timer.start('yt_search')
+            results = get_search_client().extract_info(f"ytsearch1:{search_query}", download=False, process=False)
+            entries = list(results.get('entries') or [])
+            timer.stop('yt_search')
+            if not entries:
+                return None
             
-            # Download and process audio
-            audio_data = self.download_audio(search_query, quality)
+            import yt_dlp
             
-            if audio_data:
-                # Return base64 encoded audio data
-                encoded_audio = base64.b64encode(audio_data).decode('utf-8')
-                
-                response = {
-                    'success': True,
-                    'audio_data': encoded_audio,
-                    'content_type': 'audio/mpeg',
-                    'filename': f"{search_query[:50]}.mp3"
-                }
-                
-                self.send_json_response(response)
-            else:
-                self.send_error_response(404, "Audio not found")
-                
-        except Exception as e:
-            print(f"Error: {str(e)}")
-            self.send_error_response(500, f"Server error: {str(e)}")
-    
-    def download_audio(self, search_query, quality='192'):
-        """Download and convert audio using yt-dlp"""
-        try:
             with tempfile.TemporaryDirectory() as temp_dir:
                 output_path = os.path.join(temp_dir, 'audio.%(ext)s')
                 
                 # yt-dlp configuration for Vercel environment
                 ydl_opts = {
-                    'format': 'bestaudio[filesize<50M]/best[filesize<50M]',  # Limit file size
+                    'format': audio_format(quality),
                     'outtmpl': output_path,
                     'noplaylist': True,
                     'quiet': True,
@@ -66,14 +142,17 @@ class handler(BaseHTTPRequestHandler):
                         'preferredcodec': 'mp3',
                         'preferredquality': quality,
                     }],
+                    'progress_hooks': [on_progress],
+                    'postprocessor_hooks': [on_postprocess],
+                    'postprocessor_args': {'extractaudio+ffmpeg_o': ffmpeg_args or []},
                     # Optimize for serverless environment
                     'socket_timeout': 30,
                     'retries': 1,
                 }
                 
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    # Search and download
-                    ydl.download([f"ytsearch1:{search_query}"])
+                    timer.start('yt_download')
+                    ydl.extract_info(entries[0]['url'], download=True)
                     
                     # Find the downloaded file
                     for file in os.listdir(temp_dir):
@@ -87,28 +166,3 @@ class handler(BaseHTTPRequestHandler):
         except Exception as e:
             print(f"Download error: {str(e)}")
             return None
-    
-    def send_json_response(self, data, status_code=200):
-        """Send JSON response"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        
-        response_json = json.dumps(data)
-        self.wfile.write(response_json.encode('utf-8'))
-    
-    def send_error_response(self, status_code, message):
-        """Send error response"""
-        error_data = {'success': False, 'error': message}
-        self.send_json_response(error_data, status_code)
-    
-    def do_OPTIONS(self):
-        """Handle preflight requests"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
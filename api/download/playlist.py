@@ -1,100 +1,156 @@
 """
 Vercel Serverless Function for Spotify Playlist Processing
-Handles playlist metadata extraction
+Handles playlist metadata extraction; album, track and artist links are
+answered in the same shape as a playlist
 """
-import json
 import os
-from http.server import BaseHTTPRequestHandler
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import re
+from api._shared.handler import JSONHandler
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        try:
-            # Parse request
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
-            playlist_url = data.get('playlist_url', '')
-            
-            if not playlist_url:
-                self.send_error_response(400, "Missing playlist URL")
-                return
-            
-            # Get playlist data
-            playlist_data = self.get_playlist_data(playlist_url)
-            
-            if playlist_data:
-                self.send_json_response(playlist_data)
-            else:
-                self.send_error_response(404, "Playlist not found or not accessible")
-                
-        except Exception as e:
-            print(f"Error: {str(e)}")
-            self.send_error_response(500, f"Server error: {str(e)}")
+
+# spotipy (and requests under it) is imported on first use so OPTIONS and
+# bad requests don't pay for it; the client is then kept for warm invocations
+_spotify = None
+
+
+def get_spotify_client():
+    """Spotify client shared by every request this instance serves
     
-    def get_playlist_data(self, playlist_url):
-        """Extract playlist data using Spotify API"""
+    Its client-credentials token is kept in memory, so warm invocations skip
+    the token request as well as the imports.
+    """
+    global _spotify
+    if _spotify is None:
+        client_id = os.environ.get('SPOTIFY_CLIENT_ID')
+        client_secret = os.environ.get('SPOTIFY_CLIENT_SECRET')
+        
+        if not client_id or not client_secret:
+            raise ValueError("Spotify API credentials not configured")
+        
+        import spotipy
+        from spotipy.cache_handler import MemoryCacheHandler
+        from spotipy.oauth2 import SpotifyClientCredentials
+        
+        credentials = SpotifyClientCredentials(
+            client_id=client_id,
+            client_secret=client_secret,
+            cache_handler=MemoryCacheHandler()
+        )
+        _spotify = spotipy.Spotify(client_credentials_manager=credentials)
+    return _spotify
+
+
+# Spotify links and URIs (mirrors playlist_app.sources)
+LINK_PATTERN = re.compile(
+    r'(?:open\.spotify\.com/(?:intl-[\w-]+/)?(?:embed/)?|spotify:(?:user:[^:]+:)?)'
+    r'(playlist|album|track|artist)[/:]([A-Za-z0-9]+)'
+)
+ID_PATTERN = re.compile(r'^[A-Za-z0-9]+$')
+# Canonical ISRC: country, registrant, year, designation (mirrors playlist_app.enrichment)
+ISRC_PATTERN = re.compile(r'^[A-Z]{2}[A-Z0-9]{3}[0-9]{7}$')
+ALBUM_TRACKS_PAGE = 50
+
+
+def parse_spotify_url(url):
+    """(kind, spotify_id) for a Spotify link or URI, or None; a bare id is a playlist"""
+    url = (url or '').strip()
+    match = LINK_PATTERN.search(url)
+    if match:
+        return match.group(1), match.group(2)
+    if ID_PATTERN.match(url):
+        return 'playlist', url
+    return None
+
+
+def clean_isrc(value):
+    """Canonical ISRC (uppercase, no hyphens or spaces), or None if it isn't one"""
+    isrc = re.sub(r'[\s-]', '', str(value or '')).upper()
+    return isrc if ISRC_PATTERN.match(isrc) else None
+
+
+# Fields sent in the columnar response, in order
+TRACK_COLUMNS = ('id', 'name', 'artist', 'album', 'duration_ms', 'preview_url', 'popularity', 'isrc')
+
+
+class TrackRecord:
+    """Playlist track with only the fields the client uses (mirrors playlist_app.records)"""
+
+    __slots__ = ('id', 'name', 'artists', 'album', 'duration_ms', 'preview_url', 'popularity', 'isrc')
+
+    def __init__(self, track):
+        self.id = track['id']
+        self.name = track['name']
+        self.artists = tuple(artist['name'] for artist in track['artists'])
+        self.album = (track.get('album') or {}).get('name')
+        self.duration_ms = track['duration_ms']
+        self.preview_url = track.get('preview_url')
+        self.popularity = track.get('popularity')
+        self.isrc = clean_isrc((track.get('external_ids') or {}).get('isrc'))
+
+    @property
+    def artist(self):
+        return ', '.join(self.artists)
+
+    def as_dict(self):
+        """Legacy per-track response shape"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'artists': list(self.artists),
+            'artist': self.artist,
+            'album': self.album,
+            'duration_ms': self.duration_ms,
+            'preview_url': self.preview_url,
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{self.id}"} if self.id else {},
+            'popularity': self.popularity,
+            'isrc': self.isrc,
+        }
+
+
+class handler(JSONHandler):
+    def handle_json(self, data):
+        playlist_url = data.get('playlist_url', '')
+        columnar = data.get('format') == 'columnar'
+        
+        if not playlist_url:
+            self.send_error_response(400, "Missing playlist URL")
+            return
+        
+        # Get playlist data
+        playlist_data = self.get_playlist_data(playlist_url, columnar)
+        
+        if playlist_data:
+            self.send_json_response(playlist_data)
+        else:
+            self.send_error_response(404, "Playlist not found or not accessible")
+    
+    def get_playlist_data(self, playlist_url, columnar=False):
+        """Extract playlist data using Spotify API
+        
+        With ``columnar`` the tracks are sent as parallel arrays (TRACK_COLUMNS)
+        instead of one object per track.
+        """
         try:
-            # Get Spotify credentials from environment
-            client_id = os.environ.get('SPOTIFY_CLIENT_ID')
-            client_secret = os.environ.get('SPOTIFY_CLIENT_SECRET')
+            sp = get_spotify_client()
             
-            if not client_id or not client_secret:
-                raise ValueError("Spotify API credentials not configured")
-            
-            # Initialize Spotify client
-            credentials = SpotifyClientCredentials(
-                client_id=client_id,
-                client_secret=client_secret
-            )
-            sp = spotipy.Spotify(client_credentials_manager=credentials)
-            
-            # Extract playlist ID
-            playlist_id = self.extract_playlist_id(playlist_url)
-            if not playlist_id:
+            source = parse_spotify_url(playlist_url)
+            if not source:
                 return None
             
-            # Get playlist info
-            playlist_info = sp.playlist(playlist_id)
-            
-            # Get all tracks (handle pagination)
-            tracks = []
-            results = sp.playlist_tracks(playlist_id)
-            
-            while results:
-                for item in results['items']:
-                    if item['track'] and item['track']['type'] == 'track':
-                        track = item['track']
-                        
-                        # Get artist names
-                        artists = [artist['name'] for artist in track['artists']]
-                        
-                        track_data = {
-                            'id': track['id'],
-                            'name': track['name'],
-                            'artists': artists,
-                            'artist': ', '.join(artists),
-                            'duration_ms': track['duration_ms'],
-                            'preview_url': track['preview_url'],
-                            'external_urls': track['external_urls'],
-                            'popularity': track['popularity']
-                        }
-                        tracks.append(track_data)
-                
-                # Get next page if available
-                results = sp.next(results) if results['next'] else None
+            kind, spotify_id = source
+            if kind == 'playlist':
+                playlist_data, tracks = self.fetch_playlist(sp, spotify_id)
+            else:
+                playlist_data, tracks = self.fetch_release(sp, kind, spotify_id)
             
-            playlist_data = {
-                'id': playlist_info['id'],
-                'name': playlist_info['name'],
-                'description': playlist_info['description'],
-                'total_tracks': len(tracks),
-                'owner': playlist_info['owner']['display_name'],
-                'public': playlist_info['public'],
-                'tracks': tracks
-            }
+            if columnar:
+                playlist_data['track_format'] = 'columnar'
+                playlist_data['tracks'] = {
+                    column: [getattr(track, column) for track in tracks]
+                    for column in TRACK_COLUMNS
+                }
+            else:
+                playlist_data['tracks'] = [track.as_dict() for track in tracks]
             
             return playlist_data
             
@@ -102,38 +158,58 @@ class handler(BaseHTTPRequestHandler):
             print(f"Spotify API error: {str(e)}")
             return None
     
-    def extract_playlist_id(self, url):
-        """Extract playlist ID from Spotify URL"""
-        try:
-            if 'playlist/' in url:
-                return url.split('playlist/')[1].split('?')[0]
-            elif len(url) == 22 and url.isalnum():
-                return url
-            return None
-        except:
-            return None
-    
-    def send_json_response(self, data, status_code=200):
-        """Send JSON response"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    def fetch_playlist(self, sp, playlist_id):
+        """(playlist fields, TrackRecords) for a playlist"""
+        # Get playlist info
+        playlist_info = sp.playlist(playlist_id)
         
-        response_json = json.dumps(data)
-        self.wfile.write(response_json.encode('utf-8'))
-    
-    def send_error_response(self, status_code, message):
-        """Send error response"""
-        error_data = {'success': False, 'error': message}
-        self.send_json_response(error_data, status_code)
+        # Get all tracks (handle pagination)
+        tracks = []
+        results = sp.playlist_tracks(playlist_id)
+        
+        while results:
+            for item in results['items']:
+                if item['track'] and item['track']['type'] == 'track':
+                    tracks.append(TrackRecord(item['track']))
+            
+            # Get next page if available
+            results = sp.next(results) if results['next'] else None
+        
+        return {
+            'id': playlist_info['id'],
+            'name': playlist_info['name'],
+            'description': playlist_info['description'],
+            'total_tracks': len(tracks),
+            'owner': playlist_info['owner']['display_name'],
+            'public': playlist_info['public'],
+        }, tracks
     
-    def do_OPTIONS(self):
-        """Handle preflight requests"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    def fetch_release(self, sp, kind, spotify_id):
+        """(playlist-shaped fields, TrackRecords) for an album, track or artist's top tracks"""
+        if kind == 'album':
+            album = sp.album(spotify_id)
+            items = album['tracks']['items']
+            # Simplified album tracks carry no album; the rest come 50 per page
+            for offset in range(len(items), album['tracks']['total'], ALBUM_TRACKS_PAGE):
+                items.extend(sp.album_tracks(spotify_id, limit=ALBUM_TRACKS_PAGE, offset=offset)['items'])
+            summary = {'id': album['id'], 'name': album['name']}
+            track_infos = [dict(item, album=summary) for item in items if item]
+            name, owner = album['name'], album['artists']
+        elif kind == 'track':
+            track = sp.track(spotify_id)
+            track_infos = [track]
+            name, owner = track['name'], track['artists']
+        else:
+            artist = sp.artist(spotify_id)
+            track_infos = sp.artist_top_tracks(spotify_id)['tracks']
+            name, owner = f"{artist['name']}: top tracks", [artist]
+        
+        tracks = [TrackRecord(track_info) for track_info in track_infos]
+        return {
+            'id': spotify_id,
+            'name': name,
+            'description': '',
+            'total_tracks': len(tracks),
+            'owner': ', '.join(artist['name'] for artist in owner),
+            'public': True,
+        }, tracks
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cold-start import cost of the serverless functions and the Django app
+Each target is loaded in a fresh interpreter under ``python -X importtime``.
+"module load" is what every cold start pays; "first request" adds the
+imports deferred until a request actually needs them (yt-dlp, spotipy).
+
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --top 15 --runs 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOAD_FUNCTION = (
+    "import importlib.util; "
+    "spec = importlib.util.spec_from_file_location('function', {path!r}); "
+    "module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)"
+)
+
+TARGETS = {
+    'api/download/audio.py': (
+        LOAD_FUNCTION.format(path=os.path.join(ROOT, 'api', 'download', 'audio.py')),
+        'import yt_dlp',
+    ),
+    'api/download/playlist.py': (
+        LOAD_FUNCTION.format(path=os.path.join(ROOT, 'api', 'download', 'playlist.py')),
+        'import spotipy',
+    ),
+    'spotify_downloader/wsgi.py': (
+        'import spotify_downloader.wsgi; from django.urls import get_resolver; get_resolver().url_patterns',
+        'import yt_dlp',
+    ),
+}
+
+
+def run(code, importtime=False):
+    """Run code in a fresh interpreter; returns (wall seconds, stderr)"""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='spotify_downloader.settings',
+               SPOTIFY_CLIENT_ID='bench', SPOTIFY_CLIENT_SECRET='bench')
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, result.stderr
+
+
+def parse_importtime(stderr, ignore=()):
+    """{package: cumulative microseconds} for each top-level package imported
+
+    Times are inclusive, so a package imported by another (requests under
+    spotipy) counts towards both. Packages in ``ignore`` are skipped.
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if '.' not in name and not name.startswith('_') and name not in ignore:
+            packages[name] = packages.get(name, 0) + int(cumulative)
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per measurement (best is reported)')
+    parser.add_argument('--top', type=int, default=8, help='heaviest packages to list per target')
+    args = parser.parse_args()
+
+    baseline = min(run('pass')[0] for _ in range(args.runs))
+    startup_packages = parse_importtime(run('pass', importtime=True)[1])
+    print(f"bare interpreter: {baseline * 1000:.0f} ms (subtracted below)\n")
+
+    for label, (load, first_request) in TARGETS.items():
+        module_load = min(run(load)[0] for _ in range(args.runs)) - baseline
+        with_request = min(run(f"{load}; {first_request}")[0] for _ in range(args.runs)) - baseline
+        packages = parse_importtime(run(load, importtime=True)[1], ignore=startup_packages)
+
+        print(label)
+        print(f"  module load    {module_load * 1000:7.0f} ms")
+        print(f"  first request  {with_request * 1000:7.0f} ms (module load + deferred imports)")
+        print('  heaviest packages at module load (cumulative):')
+        for name, micros in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {name:<24} {micros / 1000:7.1f} ms")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Source format selection: bytes downloaded per output quality
+For each upload in fixtures/youtube_formats.json, compares the stream the old
+'bestaudio[filesize<50M]/best[filesize<50M]' selector fetched with the one
+select_audio_format picks for 128, 192 and 320 kbps MP3s (and the Vercel
+function's format spec, run through yt-dlp's own selector).
+
+    python benchmarks/bench_formats.py
+    python benchmarks/bench_formats.py --fixture my_formats.json
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from playlist_app.formats import select_audio_format  # noqa: E402  (no Django setup needed)
+from api.download.audio import audio_format  # noqa: E402
+
+OLD_FORMAT = 'bestaudio[filesize<50M]/best[filesize<50M]'
+QUALITIES = ('128', '192', '320')
+
+
+def yt_dlp_select(ydl, spec, formats):
+    """The format yt-dlp itself picks for spec, after its usual sorting"""
+    info = {'formats': [dict(fmt) for fmt in formats]}
+    ydl.sort_formats(info)
+    selected = list(ydl.build_format_selector(spec)({
+        'formats': info['formats'], 'has_merged_format': True, 'incomplete_formats': False,
+    }))
+    return selected[-1] if selected else None
+
+
+def size(fmt):
+    return (fmt.get('filesize') or fmt.get('filesize_approx') or 0) if fmt else 0
+
+
+def describe(fmt):
+    if not fmt:
+        return 'none'
+    kind = 'audio' if fmt['vcodec'] == 'none' else 'VIDEO'
+    return f"{fmt['format_id']:>4} {kind} {fmt['acodec'].split('.')[0]:<5} {size(fmt) / 1e6:6.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixture', default=os.path.join(ROOT, 'benchmarks', 'fixtures', 'youtube_formats.json'))
+    args = parser.parse_args()
+
+    import yt_dlp
+    with open(args.fixture, encoding='utf-8') as f:
+        videos = json.load(f)['videos']
+
+    totals = {'old': 0, **{quality: 0 for quality in QUALITIES}}
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        for video in videos:
+            old = yt_dlp_select(ydl, OLD_FORMAT, video['formats'])
+            totals['old'] += size(old)
+            print(f"{video['title']}\n  before      {describe(old)}")
+            for quality in QUALITIES:
+                new = select_audio_format(video['formats'], quality)
+                vercel = yt_dlp_select(ydl, audio_format(quality), video['formats'])
+                totals[quality] += size(new)
+                print(f"  {quality} kbps    {describe(new)}   (Vercel: {describe(vercel)})")
+
+    print(f"\nTotal over {len(videos)} uploads: before {totals['old'] / 1e6:.1f} MB")
+    for quality in QUALITIES:
+        saved = 1 - totals[quality] / totals['old']
+        print(f"  {quality} kbps: {totals[quality] / 1e6:6.1f} MB ({saved:.0%} less)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Peak memory of importing and returning a playlist, by playlist length
+Runs views.load_playlist against a fake Spotify client that generates pages
+lazily, then drains the streamed response. The batched import itself stays
+flat as the playlist grows; the import peak also covers the ISRC enrichment
+pass that follows it, which holds a small entry per track.
+
+    python benchmarks/bench_import_memory.py --sizes 1000 5000 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeSpotify:
+    """Minimal spotipy stand-in serving synthetic 100-item pages"""
+
+    PAGE_SIZE = 100
+
+    def __init__(self, total):
+        self.total = total
+
+    def playlist(self, playlist_id):
+        return {
+            'name': f'Bench {playlist_id}',
+            'owner': {'display_name': 'bench'},
+            'tracks': {'total': self.total},
+            'public': True,
+        }
+
+    def playlist_tracks(self, playlist_id, offset=0):
+        items = [
+            {'track': {
+                'type': 'track',
+                'id': f'{playlist_id}-{i}',
+                'name': f'Track {i} ' + 'x' * 40,
+                'artists': [{'name': f'Artist {i % 97}'}, {'name': 'Featured Artist'}],
+                'album': {'name': f'Album {i % 13}'},
+                'duration_ms': 180000 + i,
+                'preview_url': f'https://p.scdn.co/mp3-preview/{i:040d}',
+                'external_urls': {'spotify': f'https://open.spotify.com/track/{i:022d}'},
+            }}
+            for i in range(offset, min(offset + self.PAGE_SIZE, self.total))
+        ]
+        next_offset = offset + self.PAGE_SIZE
+        return {
+            'items': items,
+            'next': next_offset if next_offset < self.total else None,
+            'playlist_id': playlist_id,
+        }
+
+    def next(self, results):
+        return self.playlist_tracks(results['playlist_id'], offset=results['next'])
+
+    def tracks(self, track_ids):
+        # Enrichment fetches ISRCs for the imported tracks
+        return {'tracks': [
+            {'id': track_id, 'external_ids': {'isrc': f'QZBENCH{int(track_id.rsplit("-", 1)[1]):05d}'}}
+            for track_id in track_ids
+        ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000])
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(temp_dir, 'bench.sqlite3')}"
+    os.environ['DEBUG'] = 'False'  # DEBUG keeps every query in memory
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_downloader.settings')
+    os.environ.setdefault('SPOTIFY_CLIENT_ID', 'bench')
+    os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'bench')
+    import django
+    django.setup()
+
+    from unittest.mock import patch
+    from django.core.management import call_command
+    from playlist_app import views
+
+    call_command('migrate', verbosity=0)
+
+    for size in args.sizes:
+        playlist_id = f'mem{size}'
+        with patch.object(views, 'create_spotify_client', return_value=FakeSpotify(size)):
+            tracemalloc.start()
+            playlist = views.load_playlist(f'https://open.spotify.com/playlist/{playlist_id}', ('playlist', playlist_id))
+            _, import_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+
+            response_bytes = 0
+            for chunk in views.stream_playlist_response(playlist).streaming_content:
+                response_bytes += len(chunk)
+            _, respond_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        print(f"{size:>7} tracks: import peak {import_peak / 1024 / 1024:6.2f} MiB, "
+              f"response peak {respond_peak / 1024 / 1024:6.2f} MiB, "
+              f"response {response_bytes / 1024 / 1024:6.2f} MiB")
+
+
+if __name__ == '__main__':
+    main()
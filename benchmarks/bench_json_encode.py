@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+JSON encode time for API response payloads
+Compares the previous encoders (stdlib json, Django's JsonResponse encoder,
+DRF's JSONRenderer) with playlist_app.renderers.dumps on a 5k-track playlist
+in both response shapes and on a base64 audio response.
+
+    python benchmarks/bench_json_encode.py
+    python benchmarks/bench_json_encode.py --tracks 20000 --audio-mb 10
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def spotify_track(i):
+    return {
+        'id': f'{i:022d}',
+        'name': f'Track {i} ' + 'x' * 20,
+        'artists': [{'name': f'Artist {i % 97}'}, {'name': 'Featured Artist'}],
+        'album': {'name': f'Album {i % 13}'},
+        'duration_ms': 180000 + i,
+        'preview_url': f'https://p.scdn.co/mp3-preview/{i:040d}',
+        'popularity': i % 100,
+    }
+
+
+def payloads(track_count, audio_mb):
+    from playlist_app.api_views import playlist_response
+    from playlist_app.records import TrackRecord
+
+    playlist = {
+        'id': 'bench', 'name': 'Bench', 'description': '', 'owner': 'bench', 'public': True,
+        'total_tracks': track_count,
+        'tracks': [TrackRecord.from_spotify(spotify_track(i)) for i in range(track_count)],
+    }
+    audio = base64.b64encode(os.urandom(audio_mb * 1024 * 1024)).decode('ascii')
+    return {
+        f'playlist rows ({track_count})': playlist_response(playlist),
+        f'playlist columnar ({track_count})': playlist_response(playlist, columnar=True),
+        f'audio base64 ({audio_mb} MiB)': {
+            'success': True, 'audio_data': audio, 'content_type': 'audio/mpeg', 'filename': 'bench.mp3',
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=5000)
+    parser.add_argument('--audio-mb', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_downloader.settings')
+    os.environ.setdefault('SPOTIFY_CLIENT_ID', 'bench')
+    os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'bench')
+    import django
+    django.setup()
+
+    from django.core.serializers.json import DjangoJSONEncoder
+    from rest_framework.renderers import JSONRenderer
+    from playlist_app import renderers
+
+    encoders = {
+        'json.dumps': lambda data: json.dumps(data).encode('utf-8'),
+        'JsonResponse': lambda data: json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8'),
+        'DRF JSONRenderer': JSONRenderer().render,
+        'renderers.dumps': renderers.dumps,
+    }
+    print(f"renderers.dumps backend: {'orjson' if renderers.orjson else 'stdlib json'}")
+
+    for label, data in payloads(args.tracks, args.audio_mb).items():
+        print(f"\n{label}")
+        for name, encode in encoders.items():
+            size = len(encode(data))
+            seconds = min(timeit.repeat(lambda: encode(data), number=1, repeat=args.repeat))
+            print(f"  {name:<18} {seconds * 1000:8.2f} ms  {size / 1024:9.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
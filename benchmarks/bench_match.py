@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+YouTube candidate selection: accuracy and speed
+Accuracy is measured on a labeled fixture of real-world-shaped search results
+(fixtures/youtube_candidates.json), against taking the top hit as before.
+Speed scores the fixture repeated up to --tracks tracks.
+
+    python benchmarks/bench_match.py
+    python benchmarks/bench_match.py --tracks 50000 --fixture my_labels.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from playlist_app import matching  # noqa: E402  (no Django setup needed)
+
+
+def timed(runs, fn):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixture', default=os.path.join(ROOT, 'benchmarks', 'fixtures', 'youtube_candidates.json'))
+    parser.add_argument('--tracks', type=int, default=10000, help='batch size for the speed test')
+    parser.add_argument('--runs', type=int, default=3, help='repetitions per measurement (best is reported)')
+    parser.add_argument('--show-misses', action='store_true', help='print every track the scorer gets wrong')
+    args = parser.parse_args()
+
+    with open(args.fixture, encoding='utf-8') as f:
+        labeled = json.load(f)['tracks']
+    batch = [(entry['track'], entry['candidates']) for entry in labeled]
+
+    picks = matching.best_indexes(batch)
+    top_hit = sum(0 in entry['correct'] for entry in labeled)
+    scored = sum(pick in entry['correct'] for pick, entry in zip(picks, labeled))
+    print(f"accuracy on {len(labeled)} labeled tracks ({matching.SEARCH_CANDIDATES} candidates each):")
+    print(f"  top search hit   {top_hit / len(labeled):6.1%}")
+    print(f"  scored           {scored / len(labeled):6.1%}")
+    if args.show_misses:
+        for pick, entry in zip(picks, labeled):
+            if pick not in entry['correct']:
+                print(f"    {entry['track']['artist']} - {entry['track']['title']}: picked {entry['candidates'][pick]['title']!r}")
+
+    large = (batch * (args.tracks // len(batch) + 1))[:args.tracks]
+    print(f"\nscoring {len(large):,} tracks:")
+    seconds = timed(args.runs, lambda: matching.best_indexes(large))
+    print(f"  {seconds * 1e6 / len(large):7.1f} us/track")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Parallel range downloads against a throttled local server
+The server adds --rtt-ms before each response and caps every connection at
+--per-connection-mbps, the way distant or per-connection-throttled media
+servers behave. A --size-mb file is fetched with 1, 2, 4 and 8 connections
+and the reassembled bytes are compared with the original.
+
+    python benchmarks/bench_ranged.py
+    python benchmarks/bench_ranged.py --size-mb 60 --rtt-ms 150 --per-connection-mbps 8
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_downloader.settings')
+    os.environ.setdefault('SPOTIFY_CLIENT_ID', 'bench')
+    os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'bench')
+    import django
+    django.setup()
+
+
+def make_handler(payload, rtt, bytes_per_second):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(rtt)
+            first, last = 0, len(payload) - 1
+            match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+            if match:
+                first, last = int(match.group(1)), min(int(match.group(2)), len(payload) - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {first}-{last}/{len(payload)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(last - first + 1))
+            self.send_header('ETag', '"bench"')
+            self.end_headers()
+            chunk = 64 * 1024
+            for offset in range(first, last + 1, chunk):
+                block = payload[offset:min(offset + chunk, last + 1)]
+                self.wfile.write(block)
+                time.sleep(len(block) / bytes_per_second)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=20, help='file size (a 320 kbps hour is ~144 MB)')
+    parser.add_argument('--rtt-ms', type=float, default=100)
+    parser.add_argument('--per-connection-mbps', type=float, default=16, help='throughput cap per connection')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from playlist_app.ranged import download_ranges
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    expected = hashlib.sha256(payload).hexdigest()
+    handler = make_handler(payload, args.rtt_ms / 1000, args.per_connection_mbps * 1e6 / 8)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/audio.webm'
+
+    print(f"{args.size_mb:g} MB, {args.rtt_ms:g} ms RTT, {args.per_connection_mbps:g} Mbit/s per connection, "
+          f"{settings.DOWNLOAD_RANGE_MIN_BYTES // 1024} KiB minimum range")
+    baseline = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'audio.webm')
+        for connections in (1, 2, 4, 8):
+            started = time.perf_counter()
+            download_ranges(url, path, len(payload), connections=connections)
+            elapsed = time.perf_counter() - started
+            with open(path, 'rb') as f:
+                intact = hashlib.sha256(f.read()).hexdigest() == expected
+            baseline = baseline or elapsed
+            print(f"  {connections} connection(s): {elapsed:6.2f}s  {baseline / elapsed:4.1f}x  "
+                  f"{'intact' if intact else 'CORRUPT'}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
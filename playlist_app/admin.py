@@ -1,24 +1,39 @@
 from django.contrib import admin
+from .admin_helpers import AutocompleteFilter, LargeTableAdmin
 from .models import Playlist, Track, DownloadSession
+from .search import PLAYLIST_INDEX, TRACK_INDEX, filter_queryset
 
 
 @admin.register(Playlist)
-class PlaylistAdmin(admin.ModelAdmin):
+class PlaylistAdmin(LargeTableAdmin):
     list_display = ['title', 'owner', 'total_tracks', 'is_public', 'created_at']
     list_filter = ['is_public', 'created_at']
+    # Also what the playlist autocomplete filter on tracks searches
     search_fields = ['title', 'owner']
     readonly_fields = ['spotify_id', 'created_at', 'updated_at']
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index instead of a LIKE scan over search_fields
+        return filter_queryset(queryset, PLAYLIST_INDEX, search_term), False
 
 
 @admin.register(Track)
-class TrackAdmin(admin.ModelAdmin):
+class TrackAdmin(LargeTableAdmin):
     list_display = ['title', 'artist', 'album', 'playlist', 'duration_formatted']
-    list_filter = ['playlist', 'created_at']
+    list_select_related = ['playlist']
+    list_filter = [('playlist', AutocompleteFilter), 'created_at']
     search_fields = ['title', 'artist', 'album']
+    raw_id_fields = ['playlist']
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index instead of a LIKE scan over search_fields
+        return filter_queryset(queryset, TRACK_INDEX, search_term), False
 
 
 @admin.register(DownloadSession)
-class DownloadSessionAdmin(admin.ModelAdmin):
+class DownloadSessionAdmin(LargeTableAdmin):
     list_display = ['playlist', 'session_id', 'status', 'tracks_successful', 'tracks_failed', 'created_at']
+    list_select_related = ['playlist']
     list_filter = ['status', 'created_at']
     readonly_fields = ['session_id', 'created_at']
+    raw_id_fields = ['playlist']
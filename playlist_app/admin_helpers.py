@@ -0,0 +1,170 @@
+"""
+Admin changelists for very large tables
+Keyset ("older/newer") pagination instead of OFFSET pages, counts that stop
+at a cap or come from planner statistics instead of a full COUNT(*), and an
+autocomplete filter for foreign keys instead of a link per related row.
+"""
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import ShowFacets
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
+
+CURSOR_VAR = 'after'
+# Filtered changelists count at most this many rows and show "10,000+"
+COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset):
+    """(count, exact) without scanning a whole large table
+
+    Unfiltered PostgreSQL tables use the planner's row estimate; anything
+    else is counted up to COUNT_LIMIT + 1 rows.
+    """
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been vacuumed or analyzed
+        if row and row[0] > COUNT_LIMIT:
+            return row[0], False
+    count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+    if count > COUNT_LIMIT:
+        return COUNT_LIMIT, False
+    return count, True
+
+
+def count_display(count, exact):
+    if exact:
+        return f"{count:,}"
+    if count == COUNT_LIMIT:
+        return f"{count:,}+"
+    return f"about {count:,}"
+
+
+class EstimatedCountPaginator(Paginator):
+    """Page-number paginator (used when sorting by a column) with a capped count"""
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)[0]
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist that pages by primary key in the default (newest first) order
+
+    Each page is ``WHERE pk < <last pk of previous page> ORDER BY pk DESC
+    LIMIT n``, an index range scan however deep the page. Sorting by a column
+    falls back to page numbers with an estimated count.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        if self.cursor is not None:
+            # Keep the cursor out of filter lookups and generated links
+            request.GET = request.GET.copy()
+            del request.GET[CURSOR_VAR]
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    @property
+    def keyset(self):
+        return ORDER_VAR not in self.params and not self.show_all
+
+    def get_results(self, request):
+        if not self.keyset:
+            super().get_results(request)
+            self.result_count_display = count_display(self.result_count, self.result_count < COUNT_LIMIT)
+            return
+
+        queryset = self.queryset.order_by('-pk')
+        if self.cursor:
+            try:
+                queryset = queryset.filter(pk__lt=int(self.cursor))
+            except ValueError:
+                self.cursor = None
+        rows = list(queryset[:self.list_per_page + 1])
+        if len(rows) > self.list_per_page:
+            rows = rows[:self.list_per_page]
+            self.next_cursor = rows[-1].pk
+
+        self.result_count, exact = estimated_count(self.queryset)
+        self.result_count_display = count_display(self.result_count, exact)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = bool(self.cursor or self.next_cursor)
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}) if self.next_cursor else None
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string()
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """Foreign key filter rendered as an admin autocomplete box
+
+    The related model's admin must define search_fields. Use as
+    ``list_filter = [('playlist', AutocompleteFilter)]``.
+    """
+    template = 'admin/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f"{field_path}__{field.target_field.name}__exact"
+        value = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        if isinstance(value, list):
+            value = value[-1]
+        widget = AutocompleteSelect(field, model_admin.admin_site, attrs={
+            'data-filter-param': self.lookup_kwarg,
+            'data-placeholder': f"Search {field.related_model._meta.verbose_name_plural}",
+            'data-allow-clear': 'true',
+            'style': 'width: 100%',
+        })
+        # The form field gives the widget its choices; only the selected one is queried
+        form_field = forms.ModelChoiceField(field.related_model._default_manager.all(), widget=widget)
+        self.rendered_widget = form_field.widget.render(f"{self.lookup_kwarg}_filter", value)
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        yield {
+            'selected': not self.used_parameters,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': 'All',
+        }
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """ModelAdmin for tables too big to count or OFFSET through"""
+    change_list_template = 'admin/keyset_change_list.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Facets would count every filter option on each page load
+    show_facets = ShowFacets.NEVER
+    ordering = ['-pk']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, (list, tuple)) and list_filter[1] is AutocompleteFilter:
+                field = self.model._meta.get_field(list_filter[0])
+                media += AutocompleteSelect(field, self.admin_site).media
+                media += forms.Media(js=['js/admin_filters.js'])
+        return media
@@ -0,0 +1,164 @@
+"""
+Admission control for audio transcodes
+Per-client token buckets cap how fast one client can submit downloads, and
+a gate caps concurrent FFmpeg encodes per process (TRANSCODE_WORKERS) with
+a short bounded queue. Requests that cannot be admitted are rejected with a
+Retry-After hint instead of piling up behind FFmpeg.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .metrics import REGISTRY
+
+
+class AdmissionRejected(Exception):
+    """Request not admitted; retry_after is a whole number of seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Rejected ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per client key
+
+    Each client may burst up to ``burst`` requests, refilled at ``rate``
+    tokens per second. Only the most recently seen ``max_clients`` buckets
+    are kept. Buckets are per process, like the transcode gate they guard,
+    and keyed by client IP: session ids and cookies are minted by the client,
+    so a bucket keyed on them could be shed by starting a new session.
+    """
+
+    def __init__(self, name, rate, burst, max_clients=10000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """Take a token; raises AdmissionRejected if the client's bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        if not allowed:
+            REGISTRY.inc('admission_rejected_total', gate=self.name, reason='rate_limited')
+            raise AdmissionRejected('rate_limited', max(1, math.ceil((1 - tokens) / self.rate)))
+
+
+class AdmissionGate:
+    """At most ``slots`` concurrent calls; up to ``max_queue`` more may wait
+
+    A caller that finds the queue full, or waits longer than
+    ``queue_timeout`` seconds, gets AdmissionRejected. Retry-After is
+    estimated from the recent average call duration.
+    """
+
+    def __init__(self, name, slots, max_queue, queue_timeout, initial_estimate=10.0):
+        self.name = name
+        self.slots = slots
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._average = initial_estimate
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a new caller"""
+        return max(1, math.ceil(self._average * (self.waiting + 1) / self.slots))
+
+    def _reject(self, reason):
+        REGISTRY.inc('admission_rejected_total', gate=self.name, reason=reason)
+        raise AdmissionRejected(reason, self.retry_after())
+
+    def run(self, fn):
+        queued_at = time.monotonic()
+        with self._cond:
+            if self.active >= self.slots:
+                if self.waiting >= self.max_queue:
+                    self._reject('queue_full')
+                self.waiting += 1
+                deadline = queued_at + self.queue_timeout
+                try:
+                    while self.active >= self.slots:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('queue_timeout')
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+
+        started = time.monotonic()
+        REGISTRY.observe('admission_wait_seconds', started - queued_at, gate=self.name)
+        try:
+            return fn()
+        finally:
+            with self._cond:
+                self.active -= 1
+                # Moving average of how long a slot stays taken
+                self._average = 0.8 * self._average + 0.2 * (time.monotonic() - started)
+                self._cond.notify()
+
+
+_lock = threading.Lock()
+_transcode_gate = None
+_audio_limiter = None
+
+
+def get_transcode_gate():
+    """Process-wide gate for FFmpeg encodes, built from settings on first use
+
+    It has TRANSCODE_WORKERS slots, one single-threaded FFmpeg each, so
+    encodes never oversubscribe the cores and callers beyond the queue are
+    turned away instead of piling up.
+    """
+    global _transcode_gate
+    with _lock:
+        if _transcode_gate is None:
+            slots = getattr(settings, 'TRANSCODE_WORKERS', None) or os.cpu_count() or 1
+            _transcode_gate = AdmissionGate(
+                'transcode',
+                slots=slots,
+                max_queue=getattr(settings, 'TRANSCODE_MAX_QUEUE', None) or slots * 2,
+                queue_timeout=getattr(settings, 'TRANSCODE_QUEUE_TIMEOUT', 30),
+            )
+        return _transcode_gate
+
+
+def get_audio_rate_limiter():
+    global _audio_limiter
+    with _lock:
+        if _audio_limiter is None:
+            _audio_limiter = RateLimiter(
+                'audio',
+                rate=getattr(settings, 'AUDIO_RATE_PER_MINUTE', 30) / 60,
+                burst=getattr(settings, 'AUDIO_RATE_BURST', 5),
+            )
+        return _audio_limiter
+
+
+def client_ip(request):
+    """Client address; the last X-Forwarded-For hop only behind a trusted proxy
+
+    The proxy appends the address it saw; earlier hops come from the client.
+    """
+    if getattr(settings, 'TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
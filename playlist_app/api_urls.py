@@ -11,4 +11,6 @@ urlpatterns = [
     # Mirror Vercel serverless function endpoints
     path('download/playlist/', api_views.playlist_api, name='playlist_api'),
     path('download/audio/', api_views.audio_api, name='audio_api'),
+    # Cached audio files (local server only), served with Range support
+    path('download/audio/<str:key>/', api_views.audio_file_api, name='audio_file'),
 ]
@@ -3,16 +3,35 @@ Django API views for local development
 These handle the same functionality as Vercel serverless functions
 """
 import json
+import hashlib
 import tempfile
 import os
 import base64
+from django.conf import settings
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from decouple import config
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-import yt_dlp
+from .admission import AdmissionRejected, client_ip, get_audio_rate_limiter
+from .audio_files import (audio_key, audio_path, cached_audio, cached_source, file_etag, ranged_file_response,
+                          source_id, source_root, store_audio, store_source)
+from .cache import SpotifyTokenCache, get_playlist_metadata, resolve_youtube
+from .coalesce import coalesce
+from .enrichment import clean_isrc, fetch_tracks
+from .formats import QUALITIES, audio_format_selector, best_audio_format, covers, mp3_equivalent
+from .matching import SEARCH_CANDIDATES, pick_candidate
+from .metrics import StageTimer
+from .models import DownloadSession, Track
+from .ranged import (IntegrityError, RangeNotSupported, download_ranges, get_connection_budget,
+                     get_connections_per_file, ranged_format)
+from .records import TrackRecord, to_columns, to_rows
+from .sources import fetch_source, parse_spotify_url, source_key
+from .renderers import FastJsonResponse
+from .transcode import DEFAULT_LOUDNORM_FILTER, transcode
 
 @csrf_exempt
 @require_http_methods(["POST", "OPTIONS"])
@@ -28,16 +47,22 @@ def playlist_api(request):
     try:
         data = json.loads(request.body.decode('utf-8'))
         playlist_url = data.get('playlist_url', '')
+        columnar = data.get('format') == 'columnar'
+        discography = bool(data.get('discography', False))
         
         if not playlist_url:
             return JsonResponse({'success': False, 'error': 'Missing playlist URL'}, status=400)
         
         # Get playlist data
-        playlist_data = get_playlist_data(playlist_url)
+        timer = StageTimer()
+        playlist_data = get_playlist_data(playlist_url, timer=timer, discography=discography)
         
         if playlist_data:
-            response = JsonResponse(playlist_data)
+            with timer.stage('respond') as span:
+                response = FastJsonResponse(playlist_response(playlist_data, columnar))
+                span.bytes = len(response.content)
             response["Access-Control-Allow-Origin"] = "*"
+            response["Server-Timing"] = timer.server_timing()
             return response
         else:
             return JsonResponse({'success': False, 'error': 'Playlist not found or not accessible'}, status=404)
@@ -59,28 +84,75 @@ def audio_api(request):
     
     try:
         data = json.loads(request.body.decode('utf-8'))
-        search_query = data.get('query', '')
-        quality = data.get('quality', '192')
+        track = stored_track(data)
+        # A stored track's ISRC keys the shared match and file caches, so its
+        # search is built here and the client's query is ignored
+        search_query = track_search_query(track) if track else data.get('query', '')
+        # One spelling per bitrate, so "192" and 192 share a cache key
+        quality = str(data.get('quality', '192'))
+        session_id = data.get('session_id')
+        normalize = bool(data.get('normalize', getattr(settings, 'AUDIO_NORMALIZE', False)))
+        loudnorm = getattr(settings, 'AUDIO_LOUDNORM_FILTER', DEFAULT_LOUDNORM_FILTER) if normalize else None
         
         if not search_query:
             return JsonResponse({'success': False, 'error': 'Missing search query'}, status=400)
+        if quality not in QUALITIES:
+            return JsonResponse({'success': False, 'error': f"Quality must be one of {', '.join(QUALITIES)}"},
+                                status=400)
         
-        # Download and process audio
-        audio_data = download_audio(search_query, quality)
+        tags = audio_tags(data, track)
+        target = match_target(data, track)
+        key = rendition_key(search_query, quality, tags, loudnorm, target)
+        filename = f"{search_query[:50]}.mp3"
         
-        if audio_data:
-            # Return base64 encoded audio data
-            encoded_audio = base64.b64encode(audio_data).decode('utf-8')
-            
-            response_data = {
-                'success': True,
-                'audio_data': encoded_audio,
-                'content_type': 'audio/mpeg',
-                'filename': f"{search_query[:50]}.mp3"
-            }
+        # Serve the cached file when this exact rendition was made before;
+        # otherwise identical concurrent requests share one job, and each job
+        # waits for a transcode slot only while it encodes
+        timer = StageTimer()
+        try:
+            get_audio_rate_limiter().take(client_ip(request))
+            audio_file = cached_audio(key) or coalesce(
+                f"audio:{key}",
+                lambda: produce_audio(key, search_query, quality, timer=timer, tags=tags,
+                                      loudnorm=loudnorm, target=target)
+            )
+        except AdmissionRejected as e:
+            return too_many_requests(e)
+        
+        if audio_file:
+            if data.get('delivery') == 'file':
+                # Let the client fetch the file itself, with Range requests to resume
+                stat = os.stat(audio_file)
+                response_data = {
+                    'success': True,
+                    'url': reverse('api:audio_file', args=[key]),
+                    'size': stat.st_size,
+                    'etag': file_etag(stat),
+                    'content_type': 'audio/mpeg',
+                    'filename': filename
+                }
+            else:
+                # Return base64 encoded audio data
+                with timer.stage('encode') as span:
+                    with open(audio_file, 'rb') as f:
+                        encoded_audio = base64.b64encode(f.read()).decode('utf-8')
+                    span.bytes = len(encoded_audio)
+                
+                response_data = {
+                    'success': True,
+                    'audio_data': encoded_audio,
+                    'content_type': 'audio/mpeg',
+                    'filename': filename
+                }
             
-            response = JsonResponse(response_data)
+            with timer.stage('respond') as span:
+                response = FastJsonResponse(response_data)
+                span.bytes = len(response.content)
             response["Access-Control-Allow-Origin"] = "*"
+            response["Server-Timing"] = timer.server_timing()
+            
+            if session_id:
+                DownloadSession.record_stage_timings(session_id, timer.summary())
             return response
         else:
             return JsonResponse({'success': False, 'error': 'Audio not found'}, status=404)
@@ -89,125 +161,320 @@ def audio_api(request):
         print(f"Error: {str(e)}")
         return JsonResponse({'success': False, 'error': f'Server error: {str(e)}'}, status=500)
 
-def get_playlist_data(playlist_url):
-    """Extract playlist data using Spotify API"""
+@require_http_methods(["GET", "HEAD"])
+def audio_file_api(request, key):
+    """Serve a cached audio file, with byte ranges for resumed downloads"""
     try:
-        # Get Spotify credentials using decouple (same as Django settings)
-        client_id = config('SPOTIFY_CLIENT_ID', default='')
-        client_secret = config('SPOTIFY_CLIENT_SECRET', default='')
-        
-        if not client_id or not client_secret:
-            raise ValueError("Spotify API credentials not configured. Please set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET in your .env file")
-        
-        print(f"Using Spotify credentials: {client_id[:8]}... (Client ID)")
-        
-        # Initialize Spotify client
-        credentials = SpotifyClientCredentials(
-            client_id=client_id,
-            client_secret=client_secret
-        )
-        sp = spotipy.Spotify(client_credentials_manager=credentials)
-        
-        # Extract playlist ID
-        playlist_id = extract_playlist_id(playlist_url)
-        if not playlist_id:
+        path = cached_audio(key)
+    except ValueError:
+        path = None
+    if not path:
+        return JsonResponse({'success': False, 'error': 'Audio not found'}, status=404)
+    
+    response = ranged_file_response(request, path, 'audio/mpeg', f"{key}.mp3")
+    response["Access-Control-Allow-Origin"] = "*"
+    response["Access-Control-Expose-Headers"] = "Content-Range, Content-Length, ETag"
+    return response
+
+def rendition_key(search_query, quality, tags=None, loudnorm=None, target=None):
+    """Audio cache key for one rendition: the recording plus everything baked into the file"""
+    variant = hashlib.sha1(json.dumps([loudnorm, tags], sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    # The same recording under another query (or playlist) shares one file
+    recording = f"isrc:{target['isrc']}" if target and target.get('isrc') else search_query
+    return audio_key(quality, variant, recording)
+
+def produce_audio(key, search_query, quality='192', timer=None, tags=None, loudnorm=None, target=None):
+    """Download and transcode one rendition into the audio cache; returns its path"""
+    # A worker in another process may have produced it while we waited on its lock
+    path = audio_path(key)
+    if os.path.isfile(path):
+        return path
+    audio_data = download_audio(search_query, quality, timer=timer, tags=tags, loudnorm=loudnorm, target=target)
+    if not audio_data:
+        return None
+    return store_audio(key, audio_data)
+
+def stored_track(data):
+    """title/artist/album/duration_ms/isrc/youtube_search_query of the stored Track named by ``track_id``, or None"""
+    track_id = data.get('track_id')
+    if not track_id:
+        return None
+    return Track.objects.filter(spotify_id=track_id).values(
+        'title', 'artist', 'album', 'duration_ms', 'isrc', 'youtube_search_query'
+    ).first()
+
+def track_search_query(track):
+    """YouTube search query for a stored track, as Track.search_query builds it"""
+    return track.get('youtube_search_query') or f"{track['artist']} {track['title']}"
+
+def audio_tags(data, track=None):
+    """ID3 tags for an audio request, or None when the client turned tagging off
+    
+    The stored Track is used when ``track_id`` matches one; otherwise the
+    title/artist/album sent with the request.
+    """
+    if not data.get('tags', True):
+        return None
+    track = track or stored_track(data)
+    if track:
+        return {key: track[key] for key in ('title', 'artist', 'album')}
+    tags = {key: str(data[key])[:200] for key in ('title', 'artist', 'album') if data.get(key)}
+    return tags or None
+
+def match_target(data, track=None):
+    """What the YouTube candidates are scored against: the stored Track, else the request's fields
+
+    Only a stored Track carries an ISRC. One sent by the client is ignored:
+    the ISRC keys caches shared by every user, and the client also picks
+    the query that gets searched.
+    """
+    if track:
+        return track
+    target = {key: str(data[key])[:200] for key in ('title', 'artist') if data.get(key)}
+    try:
+        target['duration_ms'] = int(data.get('duration_ms') or 0) or None
+    except (TypeError, ValueError):
+        pass
+    target['isrc'] = None
+    return target if target.get('title') else None
+
+def too_many_requests(rejection):
+    """429 response telling the client when to retry"""
+    response = JsonResponse({
+        'success': False,
+        'error': 'Too many downloads in progress, please retry shortly',
+        'reason': rejection.reason,
+        'retry_after': rejection.retry_after,
+    }, status=429)
+    response["Retry-After"] = str(rejection.retry_after)
+    response["Access-Control-Allow-Origin"] = "*"
+    response["Access-Control-Expose-Headers"] = "Retry-After"
+    return response
+
+def playlist_response(playlist_data, columnar=False):
+    """Response body for cached playlist data
+    
+    ``columnar`` sends tracks as parallel arrays (see records.TRACK_COLUMNS)
+    instead of one object per track.
+    """
+    records = playlist_data['tracks']
+    response_data = dict(playlist_data)
+    if columnar:
+        response_data['track_format'] = 'columnar'
+        response_data['tracks'] = to_columns(records)
+    else:
+        response_data['tracks'] = to_rows(records)
+    return response_data
+
+def get_playlist_data(playlist_url, timer=None, discography=False):
+    """Extract playlist data using Spotify API (cached per playlist ID)
+    
+    Album, track and artist links are returned in the same shape as a
+    playlist; ``discography`` turns an artist link into all their releases.
+    """
+    timer = timer or StageTimer()
+    try:
+        source = parse_spotify_url(playlist_url)
+        if not source:
             return None
+        if source[0] == 'artist' and discography:
+            source = ('discography', source[1])
         
-        # Get playlist info
-        playlist_info = sp.playlist(playlist_id)
-        
-        # Get all tracks (handle pagination)
-        tracks = []
-        results = sp.playlist_tracks(playlist_id)
-        
-        while results:
-            for item in results['items']:
-                if item['track'] and item['track']['type'] == 'track':
-                    track = item['track']
-                    
-                    # Get artist names
-                    artists = [artist['name'] for artist in track['artists']]
-                    
-                    track_data = {
-                        'id': track['id'],
-                        'name': track['name'],
-                        'artists': artists,
-                        'artist': ', '.join(artists),
-                        'duration_ms': track['duration_ms'],
-                        'preview_url': track['preview_url'],
-                        'external_urls': track['external_urls'],
-                        'popularity': track['popularity']
-                    }
-                    tracks.append(track_data)
-            
-            # Get next page if available
-            results = sp.next(results) if results['next'] else None
-        
-        playlist_data = {
-            'id': playlist_info['id'],
-            'name': playlist_info['name'],
-            'description': playlist_info['description'],
-            'total_tracks': len(tracks),
-            'owner': playlist_info['owner']['display_name'],
-            'public': playlist_info['public'],
-            'tracks': tracks
-        }
-        
-        return playlist_data
+        # Cached under a new key since the cached track shape changed to TrackRecord
+        return get_playlist_metadata(f"{source_key(*source)}:records", lambda: fetch_playlist_data(source, timer))
         
     except Exception as e:
         print(f"Spotify API error: {str(e)}")
         return None
 
-def download_audio(search_query, quality='192'):
-    """Download and convert audio using yt-dlp"""
+def fetch_playlist_data(source, timer):
+    """Fetch playlist (or album, track, artist) info and all tracks from Spotify"""
+    # Get Spotify credentials using decouple (same as Django settings)
+    client_id = config('SPOTIFY_CLIENT_ID', default='')
+    client_secret = config('SPOTIFY_CLIENT_SECRET', default='')
+    
+    if not client_id or not client_secret:
+        raise ValueError("Spotify API credentials not configured. Please set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET in your .env file")
+    
+    print(f"Using Spotify credentials: {client_id[:8]}... (Client ID)")
+    
+    # Initialize Spotify client; the token is shared between workers via the cache
+    credentials = SpotifyClientCredentials(
+        client_id=client_id,
+        client_secret=client_secret,
+        cache_handler=SpotifyTokenCache(client_id)
+    )
+    sp = spotipy.Spotify(client_credentials_manager=credentials)
+    
+    # Playlist info, then every track (pages, or batched album requests)
+    info, track_infos = fetch_source(sp, *source, timer=timer)
+    tracks = [TrackRecord.from_spotify(track_info) for track_info in track_infos]
+    
+    with timer.stage('spotify_fetch'):
+        # Batch-fill ISRCs the pages left out (50 ids per request)
+        missing = {record.id: record for record in tracks if not record.isrc and record.id}
+        for spotify_id, track_info in fetch_tracks(sp, missing).items():
+            missing[spotify_id].isrc = clean_isrc((track_info.get('external_ids') or {}).get('isrc'))
+    
+    playlist_data = {
+        'id': source[1],
+        'name': info['name'],
+        'description': info['description'],
+        'total_tracks': len(tracks),
+        'owner': info['owner'],
+        'public': info['public'],
+        'tracks': tracks
+    }
+    
+    return playlist_data
+
+def download_audio(search_query, quality='192', timer=None, tags=None, loudnorm=None, target=None):
+    """Download audio using yt-dlp and convert it with FFmpeg (see transcode)
+    
+    ``target`` (title/artist/duration_ms of the Spotify track) picks the
+    best of several search results; without it the top result is used.
+    ``tags`` (ID3 title/artist/album) and ``loudnorm`` (a loudnorm filter spec)
+    are applied in the same FFmpeg pass as the MP3 encode. Search, download,
+    waiting for a transcode slot and the transcode itself are timed as
+    separate stages on ``timer``. The video's source stream is cached (see
+    source_audio), so another bitrate of it is only a local transcode.
+    """
+    # Imported here so workers that never transcode don't load yt-dlp
+    import yt_dlp
+    
+    timer = timer or StageTimer()
+    
+    def on_progress(d):
+        if d['status'] == 'finished':
+            timer.stop('yt_download', d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+    
     try:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            output_path = os.path.join(temp_dir, 'audio.%(ext)s')
+        # Under the source cache, so a finished download is renamed into it
+        os.makedirs(source_root(), exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=source_root()) as temp_dir:
+            source_dir = os.path.join(temp_dir, 'source')
             
-            # yt-dlp configuration
+            # yt-dlp configuration; conversion happens in transcode() instead
+            # of yt-dlp's FFmpeg postprocessor
             ydl_opts = {
-                'format': 'bestaudio[filesize<50M]/best[filesize<50M]',  # Limit file size
-                'outtmpl': output_path,
+                # Smallest audio-only stream that still covers the output bitrate
+                'format': audio_format_selector(source_quality(quality)),
+                'outtmpl': os.path.join(source_dir, 'audio.%(ext)s'),
                 'noplaylist': True,
                 'quiet': True,
                 'no_warnings': True,
-                'extractaudio': True,
-                'audioformat': 'mp3',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': quality,
-                }],
+                'progress_hooks': [on_progress],
                 # Optimize for local development
                 'socket_timeout': 30,
                 'retries': 1,
             }
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Search and download
-                ydl.download([f"ytsearch1:{search_query}"])
+                # Search first (cached per query), then download the resolved video
+                with timer.stage('yt_search'):
+                    video_url = resolve_youtube(search_query, lambda: search_youtube(ydl, search_query, target),
+                                              scored=bool(target), isrc=(target or {}).get('isrc'))
+                if not video_url:
+                    return None
                 
-                # Find the downloaded file
-                for file in os.listdir(temp_dir):
-                    if file.endswith('.mp3'):
-                        file_path = os.path.join(temp_dir, file)
-                        with open(file_path, 'rb') as f:
-                            return f.read()
+                source_path = source_audio(ydl, video_url, source_dir, quality, timer)
+            if not source_path:
+                return None
             
-            return None
+            output_path = os.path.join(temp_dir, 'audio.mp3')
+            # Only the encode takes a transcode slot: search and download wait on the
+            # network, and a rejected request finds its source cached on retry
+            transcode(source_path, output_path, quality, metadata=tags, loudnorm=loudnorm, timer=timer)
+            with open(output_path, 'rb') as f:
+                return f.read()
             
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Download error: {str(e)}")
         return None
 
-def extract_playlist_id(url):
-    """Extract playlist ID from Spotify URL"""
-    try:
-        if 'playlist/' in url:
-            return url.split('playlist/')[1].split('?')[0]
-        elif len(url) == 22 and url.isalnum():
-            return url
-        return None
-    except:
+def source_quality(quality):
+    """Bitrate the source stream must cover for a ``quality`` kbps MP3
+
+    At least AUDIO_SOURCE_MIN_QUALITY (by default the highest of QUALITIES),
+    so the one cached source also serves the higher bitrates requested later.
+    """
+    floor = getattr(settings, 'AUDIO_SOURCE_MIN_QUALITY', None)
+    return max(int(quality), int(max(QUALITIES, key=int) if floor is None else floor))
+
+def source_audio(ydl, video_url, source_dir, quality, timer):
+    """Path of video_url's source stream in the source cache, downloading it if needed
+
+    A cached stream is used when it covers source_quality(quality) or was the
+    best audio the video had; otherwise it is downloaded (through
+    download_source) and replaces the cached one. Returns None if nothing
+    could be downloaded.
+    """
+    video_id = source_id(video_url)
+    needed = source_quality(quality)
+    
+    def good_enough(meta):
+        return meta.get('best') or covers(meta.get('mp3_kbps'), needed)
+    
+    def fetch():
+        # Another caller may have stored it while we waited
+        path = cached_source(video_id, good_enough)
+        if path:
+            return path
+        timer.start('yt_download')
+        info = download_source(ydl, video_url, source_dir, timer)
+        downloaded = os.listdir(source_dir) if os.path.isdir(source_dir) else []
+        if not downloaded:
+            return None
+        best = best_audio_format(info.get('formats') or [])
+        return store_source(video_id, os.path.join(source_dir, downloaded[0]), {
+            'format_id': info.get('format_id'),
+            'acodec': info.get('acodec'),
+            'abr': info.get('abr'),
+            'mp3_kbps': mp3_equivalent(info),
+            'best': bool(best) and best.get('format_id') == info.get('format_id'),
+        })
+    
+    return cached_source(video_id, good_enough) or coalesce(f"source:{video_id}:{needed}", fetch)
+
+def download_source(ydl, video_url, source_dir, timer):
+    """Download the selected format of video_url into source_dir; returns yt-dlp's info
+
+    A single HTTP file of known size is fetched as parallel byte ranges;
+    fragmented streams use yt-dlp's concurrent fragment downloads. Either way
+    the connections come from the process-wide budget. If the server won't
+    serve ranges, a range fails its integrity checks or a connection keeps
+    failing, yt-dlp downloads the file itself.
+    """
+    info = ydl.extract_info(video_url, download=False)
+    with get_connection_budget().connections(get_connections_per_file()) as connections:
+        source = ranged_format(info)
+        if source and connections > 1:
+            url, headers, size = source
+            os.makedirs(source_dir, exist_ok=True)
+            try:
+                download_ranges(url, os.path.join(source_dir, f"audio.{info.get('ext') or 'webm'}"),
+                                size, headers, connections=connections)
+                timer.stop('yt_download', size)
+                return info
+            except (RangeNotSupported, IntegrityError, requests.RequestException, OSError) as e:
+                print(f"Parallel download failed, retrying on one connection: {e}")
+        ydl.params['concurrent_fragment_downloads'] = connections
+        ydl.process_ie_result(info, download=True)
+    return info
+
+def search_youtube(ydl, search_query, target=None):
+    """Resolve a search query to a YouTube URL
+    
+    With a ``target`` track the first SEARCH_CANDIDATES results are scored
+    against it (duration, title/artist words, channel); otherwise the top
+    result is taken.
+    """
+    count = SEARCH_CANDIDATES if target else 1
+    results = ydl.extract_info(f"ytsearch{count}:{search_query}", download=False, process=False)
+    entries = [entry for entry in results.get('entries') or [] if entry and entry.get('url')]
+    if not entries:
         return None
+    best = pick_candidate(target, entries) if target else entries[0]
+    return best['url']
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PlaylistAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'playlist_app'
+
+    def ready(self):
+        from .search import reset_index_backend
+        post_migrate.connect(reset_index_backend, sender=self)
@@ -0,0 +1,301 @@
+"""
+Cached audio files and byte-range serving
+Two levels live under AUDIO_CACHE_DIR. The source stream of each YouTube
+video is kept once under sources/, so every bitrate, tag set or loudness
+filter is derived from it with a local transcode. Finished MP3s (variants)
+are keyed by everything that shaped them (recording, bitrate, tags, loudness
+filter); a repeated request is served from disk, and an interrupted transfer
+resumes with Range/If-Range instead of re-running yt-dlp and FFmpeg. Each
+level has its own byte budget, evicted least recently used first.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date
+from .metrics import REGISTRY
+
+
+READ_CHUNK_BYTES = 64 * 1024
+KEY_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+SOURCE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{6,64}$')
+VIDEO_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([A-Za-z0-9_-]{11})')
+# Subdirectories sharded by key prefix; anything else (sources/, staging) is skipped by eviction
+SHARD_PATTERN = re.compile(r'^[0-9A-Za-z_-]{2}$')
+SOURCES_DIR = 'sources'
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Range header that selects no bytes of the file"""
+
+
+def audio_key(quality, variant, search_query):
+    """Cache key for one rendition of a search query"""
+    raw = f"{quality}:{variant}:{search_query.strip().lower()}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def audio_path(key):
+    """Path of the cached file for key; raises ValueError for malformed keys"""
+    if not KEY_PATTERN.match(key):
+        raise ValueError(f"Invalid audio key: {key!r}")
+    return os.path.join(settings.AUDIO_CACHE_DIR, key[:2], f"{key}.mp3")
+
+
+def touch(path):
+    """Mark path as just used for LRU eviction
+
+    Only the access time moves; the modification time feeds the ETag, which
+    must stay put for resumed downloads.
+    """
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except OSError:
+        pass
+
+
+def cached_audio(key):
+    """Path of the cached file for key, or None if it isn't cached"""
+    path = audio_path(key)
+    found = os.path.isfile(path)
+    REGISTRY.inc('cache_requests_total', namespace='audio_file', result='hit' if found else 'miss')
+    if found:
+        touch(path)
+    return path if found else None
+
+
+def store_audio(key, audio_data):
+    """Write audio_data as the cached file for key; returns its path
+
+    Written to a temporary name and renamed into place, so readers never see
+    a partial file.
+    """
+    path = audio_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(audio_data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    evict_lru(variant_files(), getattr(settings, 'AUDIO_CACHE_MAX_BYTES', 0), 'variant', keep=path)
+    return path
+
+
+def source_root():
+    return os.path.join(settings.AUDIO_CACHE_DIR, SOURCES_DIR)
+
+
+def source_id(video_url):
+    """Source cache id of a YouTube URL: its video id, or a hash of any other URL"""
+    match = VIDEO_ID_PATTERN.search(video_url or '')
+    if match:
+        return match.group(1)
+    return hashlib.sha1((video_url or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _source_meta_path(video_id):
+    if not SOURCE_ID_PATTERN.match(video_id):
+        raise ValueError(f"Invalid source id: {video_id!r}")
+    return os.path.join(source_root(), video_id[:2], f"{video_id}.json")
+
+
+def _read_source_meta(video_id):
+    try:
+        with open(_source_meta_path(video_id), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = os.path.join(os.path.dirname(_source_meta_path(video_id)), meta.get('file', ''))
+    return (path, meta) if meta.get('file') and os.path.isfile(path) else None
+
+
+def cached_source(video_id, covers):
+    """Path of the stored source stream for video_id, or None
+
+    ``covers(meta)`` decides whether the stored stream is good enough for the
+    request (see store_source for what meta holds); a stream that isn't
+    counts as a miss and is replaced by the next store_source.
+    """
+    found = _read_source_meta(video_id)
+    hit = bool(found) and covers(found[1])
+    REGISTRY.inc('cache_requests_total', namespace='audio_source', result='hit' if hit else 'miss')
+    if not hit:
+        return None
+    touch(found[0])
+    return found[0]
+
+
+def store_source(video_id, downloaded_path, meta):
+    """Move a downloaded source stream into the cache; returns its new path
+
+    ``meta`` (format id, codec, bitrate, ...) is stored beside it as JSON.
+    downloaded_path should be on the same filesystem (e.g. a temporary
+    directory under source_root()) so the move is a rename.
+    """
+    meta_path = _source_meta_path(video_id)
+    folder = os.path.dirname(meta_path)
+    os.makedirs(folder, exist_ok=True)
+    previous = _read_source_meta(video_id)
+    name = f"{video_id}{os.path.splitext(downloaded_path)[1]}"
+    path = os.path.join(folder, name)
+    os.replace(downloaded_path, path)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(dict(meta, file=name), f)
+    os.replace(temp_path, meta_path)
+    # An upgraded stream may have another extension
+    if previous and previous[0] != path:
+        _remove(previous[0])
+    evict_lru(source_files(), getattr(settings, 'AUDIO_SOURCE_CACHE_MAX_BYTES', 0), 'source', keep=path)
+    return path
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _sharded_entries(root):
+    try:
+        shards = [entry for entry in os.scandir(root) if entry.is_dir() and SHARD_PATTERN.match(entry.name)]
+    except FileNotFoundError:
+        return
+    for shard in shards:
+        yield from os.scandir(shard.path)
+
+
+def variant_files():
+    """(path, stat, companion paths) of every finished MP3"""
+    for entry in _sharded_entries(settings.AUDIO_CACHE_DIR):
+        if entry.name.endswith('.mp3'):
+            yield entry.path, entry.stat(), ()
+
+
+def source_files():
+    """(path, stat, companion paths) of every stored source stream"""
+    for entry in _sharded_entries(source_root()):
+        if entry.name.endswith('.json'):
+            found = _read_source_meta(entry.name[:-len('.json')])
+            if found:
+                yield found[0], os.stat(found[0]), (entry.path,)
+
+
+def evict_lru(files, max_bytes, tier, keep=None):
+    """Delete least recently used files until they fit in max_bytes (0: no limit)
+
+    ``files`` yields (path, stat, companion paths); companions (e.g. a
+    source's metadata) go with their file. ``keep`` is never evicted.
+    Returns the number of bytes freed.
+    """
+    if not max_bytes:
+        return 0
+    files = sorted(files, key=lambda item: item[1].st_atime_ns)
+    total = sum(stat.st_size for _, stat, _ in files)
+    freed = 0
+    for path, stat, companions in files:
+        if total - freed <= max_bytes:
+            break
+        if path == keep:
+            continue
+        _remove(*companions, path)
+        freed += stat.st_size
+        REGISTRY.inc('audio_cache_evictions_total', tier=tier)
+    return freed
+
+
+def file_etag(stat):
+    """Strong validator: changes whenever the file is regenerated"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """(first, last) byte positions for a single ``bytes=`` range, inclusive
+
+    Returns None when the whole file should be sent instead: no header, a
+    header we don't understand, or several ranges. Raises RangeNotSatisfiable
+    when the range starts past the end of the file.
+    """
+    match = RANGE_PATTERN.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if not length or not size:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable()
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def read_file(path, first, length):
+    """Yield length bytes of path starting at first"""
+    with open(path, 'rb') as f:
+        f.seek(first)
+        while length > 0:
+            chunk = f.read(min(length, READ_CHUNK_BYTES))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def ranged_file_response(request, path, content_type, filename):
+    """Serve path honouring Range, If-Range and If-None-Match
+
+    Responds 200 with the whole file, 206 with one byte range, 304 when the
+    client's copy is current, or 416 for a range past the end of the file.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    # Resume only if the client's partial copy is of this exact file
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    if byte_range:
+        first, last = byte_range
+        response = StreamingHttpResponse(read_file(path, first, last - first + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = str(last - first + 1)
+    else:
+        response = StreamingHttpResponse(read_file(path, 0, size), content_type=content_type)
+        response['Content-Length'] = str(size)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'private, max-age=3600'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
@@ -0,0 +1,251 @@
+"""
+Headless batch mirroring of many playlists
+Tracks repeated within or across playlists are pooled (see dedup.py) so each
+distinct song is resolved, downloaded and transcoded once; every playlist's
+output is then written from that pool: one file per song under tracks/, an
+.m3u8 per playlist pointing at them and, with folders=True, a folder per
+playlist whose files are hardlinks (or copy-on-write clones) of the pool.
+Used by the mirror_playlists command.
+"""
+import errno
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.utils import timezone
+from .admission import AdmissionRejected
+from .api_views import produce_audio, rendition_key
+from .audio_files import cached_audio
+from .coalesce import coalesce
+from .dedup import dedup_tracks
+from .models import DownloadSession
+
+
+TRACKS_DIR = 'tracks'
+# Give up on a track after this many admission rejections in a row
+MAX_ADMISSION_RETRIES = 20
+
+# Linux FICLONE ioctl: share the source's blocks (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+_UNSAFE = re.compile(r'[\x00-\x1f\\/:*?"<>|]+')
+
+
+def safe_filename(name, max_length=150):
+    """name with characters Windows, macOS or Linux reject replaced"""
+    name = _UNSAFE.sub('_', name).strip(' .')
+    return name[:max_length].rstrip(' .') or 'untitled'
+
+
+def track_pool(playlists):
+    """(pool, members): one Track per distinct song, and each playlist's songs in order
+
+    ``pool`` maps a group key to the Track downloaded for the group;
+    ``members`` maps each playlist to the group keys of its tracks,
+    duplicates kept.
+    """
+    tracks = {playlist: list(playlist.tracks.order_by('position')) for playlist in playlists}
+    pool, assignments = dedup_tracks(track for rows in tracks.values() for track in rows)
+    members = {
+        playlist: [assignments[track.spotify_id] for track in rows]
+        for playlist, rows in tracks.items()
+    }
+    return pool, members
+
+
+def dedup_savings(members, paths):
+    """{playlist: (duplicate entries, bytes not downloaded again)}
+
+    Each appearance of a song after its first, later in the same playlist or
+    in a later one, is counted against the playlist it appears in.
+    """
+    seen = set()
+    savings = {}
+    for playlist, keys in members.items():
+        duplicates = saved = 0
+        for key in keys:
+            if key not in seen:
+                seen.add(key)
+            elif paths.get(key):
+                duplicates += 1
+                saved += os.path.getsize(paths[key])
+        savings[playlist] = (duplicates, saved)
+    return savings
+
+
+def record_sessions(members, paths, savings):
+    """A completed DownloadSession per playlist with its download counts and dedup savings"""
+    now = timezone.now()
+    sessions = []
+    for playlist, keys in members.items():
+        successful = sum(1 for key in keys if paths.get(key))
+        duplicates, saved = savings[playlist]
+        sessions.append(DownloadSession(
+            playlist=playlist,
+            session_id=str(uuid.uuid4()),
+            tracks_processed=len(keys),
+            tracks_successful=successful,
+            tracks_failed=len(keys) - successful,
+            tracks_deduplicated=duplicates,
+            bytes_saved=saved,
+            status='completed',
+            completed_at=now,
+        ))
+    return DownloadSession.objects.bulk_create(sessions)
+
+
+def link_or_copy(source, destination):
+    """Place source at destination sharing its data where the filesystem can
+
+    Tries a hardlink, then a copy-on-write clone, then a plain copy (keeping
+    the source's mtime, see _same_file); returns 'linked', 'cloned' or 'copied'.
+    """
+    try:
+        os.link(source, destination)
+        return 'linked'
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            raise
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, destination)
+        return 'cloned'
+    except (ImportError, OSError):
+        shutil.copy2(source, destination)
+        return 'copied'
+
+
+def track_audio(track, quality='192', loudnorm=None):
+    """Cached audio path for a stored track, downloading it if needed; None on failure"""
+    tags = {'title': track.title, 'artist': track.artist, 'album': track.album}
+    target = dict(tags, duration_ms=track.duration_ms, isrc=track.isrc)
+    query = track.youtube_search_query or track.search_query
+    key = rendition_key(query, quality, tags, loudnorm, target)
+    for _ in range(MAX_ADMISSION_RETRIES):
+        try:
+            return cached_audio(key) or coalesce(
+                f"audio:{key}",
+                lambda: produce_audio(key, query, quality, tags=tags, loudnorm=loudnorm, target=target)
+            )
+        except AdmissionRejected as e:
+            time.sleep(e.retry_after)
+    return None
+
+
+def download_pool(pool, quality='192', loudnorm=None, workers=4, on_done=None):
+    """{spotify_id: audio path or None} for every pooled track, ``workers`` at a time"""
+    def run(item):
+        spotify_id, track = item
+        try:
+            path = track_audio(track, quality, loudnorm)
+        finally:
+            connection.close()
+        if on_done:
+            on_done(track, path)
+        return spotify_id, path
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return dict(executor.map(run, pool.items()))
+
+
+def track_filenames(pool):
+    """{spotify_id: file name under tracks/}; same-named songs get their id appended"""
+    names = {}
+    taken = set()
+    for spotify_id, track in pool.items():
+        name = safe_filename(f"{track.artist} - {track.title}")
+        if name.lower() in taken:
+            name = safe_filename(f"{track.artist} - {track.title} [{spotify_id}]")
+        taken.add(name.lower())
+        names[spotify_id] = f"{name}.mp3"
+    return names
+
+
+def _same_file(path, other):
+    """Whether path is other (a hardlink) or a copy of it made with its size and mtime"""
+    try:
+        if os.path.samefile(path, other):
+            return True
+        stat, other_stat = os.stat(path), os.stat(other)
+    except OSError:
+        return False
+    return stat.st_size == other_stat.st_size and stat.st_mtime_ns == other_stat.st_mtime_ns
+
+
+def write_outputs(output_dir, pool, members, paths, folders=False):
+    """Write the pooled songs and every playlist into output_dir
+
+    Songs are copied once into output_dir/tracks, and each playlist gets an
+    .m3u8 listing them. With ``folders`` each playlist also gets a folder of
+    numbered files, hardlinked (or cloned) from tracks/ so the data is stored
+    once; a playlist named like tracks/ gets its id appended. Files already
+    in place (see _same_file) are left alone, so nightly runs only write new
+    songs. Returns counts of files 'written' into tracks/ and fanned out
+    'linked', 'cloned' or 'copied'.
+    """
+    tracks_dir = os.path.join(output_dir, TRACKS_DIR)
+    os.makedirs(tracks_dir, exist_ok=True)
+    names = track_filenames(pool)
+    stats = {'written': 0, 'linked': 0, 'cloned': 0, 'copied': 0}
+
+    for key, path in paths.items():
+        if not path:
+            continue
+        destination = os.path.join(tracks_dir, names[key])
+        if _same_file(destination, path):
+            continue
+        shutil.copy2(path, destination)
+        stats['written'] += 1
+
+    # A playlist folder named tracks would be the shared song folder
+    playlist_names = {TRACKS_DIR}
+    for playlist, keys in members.items():
+        name = safe_filename(playlist.title)
+        if name.lower() in playlist_names:
+            name = safe_filename(f"{playlist.title} [{playlist.spotify_id}]")
+        playlist_names.add(name.lower())
+        available = [key for key in dict.fromkeys(keys) if paths.get(key)]
+
+        lines = ['#EXTM3U', f"#PLAYLIST:{playlist.title}"]
+        for key in available:
+            track = pool[key]
+            seconds = track.duration_ms // 1000 if track.duration_ms else -1
+            lines.append(f"#EXTINF:{seconds},{track.artist} - {track.title}")
+            lines.append(f"{TRACKS_DIR}/{names[key]}")
+        with open(os.path.join(output_dir, f"{name}.m3u8"), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        if folders:
+            folder = os.path.join(output_dir, name)
+            os.makedirs(folder, exist_ok=True)
+            for number, key in enumerate(available, 1):
+                source = os.path.join(tracks_dir, names[key])
+                destination = os.path.join(folder, f"{number:03d} - {names[key]}")
+                if _same_file(destination, source):
+                    continue
+                if os.path.lexists(destination):
+                    os.remove(destination)
+                stats[link_or_copy(source, destination)] += 1
+    return stats
+
+
+def read_url_file(path):
+    """Playlist links from a file (or '-' for stdin): one per line, # comments"""
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
@@ -0,0 +1,220 @@
+"""
+Two-tier caching for Spotify and YouTube lookups
+A per-process LRU sits in front of the shared cache backend (Redis when
+REDIS_URL is set, a file cache otherwise). Helpers below cache playlist
+metadata, Spotify tokens and YouTube search results with per-namespace TTLs
+and single-flight stampede protection.
+"""
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from spotipy.cache_handler import CacheHandler
+from .metrics import REGISTRY
+from .singleflight import SingleFlight
+
+
+# Fallback TTLs (seconds); override per namespace with settings.CACHE_TTLS
+DEFAULT_TTLS = {
+    'playlist': 15 * 60,
+    'spotify_token': 55 * 60,
+    'youtube': 24 * 60 * 60,
+    'youtube_match': 24 * 60 * 60,
+}
+
+_MISSING = object()
+
+
+class LocalLRU:
+    """Bounded, thread-safe LRU of pickled values with per-entry expiry"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            pickled, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, expires):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (pickled, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache(BaseCache):
+    """Cache backend: in-process LRU in front of another configured cache
+
+    OPTIONS:
+        SHARED_ALIAS       alias of the shared backend in CACHES (default 'shared')
+        LOCAL_MAX_ENTRIES  LRU size (default 1024)
+        LOCAL_TIMEOUT      upper bound on how long the local copy may be served,
+                           which bounds staleness across processes (default 60)
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        self.local = LocalLRU(options.get('LOCAL_MAX_ENTRIES', 1024))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_expiry(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        local_expires = time.time() + self.local_timeout
+        return local_expires if expires is None else min(expires, local_expires)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            REGISTRY.inc('cache_tier_hits_total', tier='local')
+            return value
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        REGISTRY.inc('cache_tier_hits_total', tier='shared')
+        self.local.set(local_key, value, time.time() + self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout=self._shared_timeout(timeout), version=version)
+        self.local.set(local_key, value, self._local_expiry(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        added = self.shared.add(key, value, timeout=self._shared_timeout(timeout), version=version)
+        if added:
+            self.local.set(local_key, value, self._local_expiry(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=self._shared_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def _shared_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+
+_flights = SingleFlight('cache')
+
+
+def get_ttl(namespace):
+    return getattr(settings, 'CACHE_TTLS', {}).get(namespace, DEFAULT_TTLS[namespace])
+
+
+def make_key(namespace, key):
+    """Namespaced cache key; long or free-text keys are hashed to stay memcached-safe"""
+    key = str(key)
+    if len(key) > 100 or not key.replace('-', '').replace('_', '').isalnum():
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return f"{namespace}:{key}"
+
+
+def get_or_compute(namespace, key, compute, timeout=None):
+    """Return the cached value, computing it at most once per key across threads
+
+    ``None`` results are not cached, so failures are retried on the next call.
+    """
+    cache_key = make_key(namespace, key)
+    value = cache.get(cache_key, _MISSING)
+    if value is not _MISSING:
+        REGISTRY.inc('cache_requests_total', namespace=namespace, result='hit')
+        return value
+
+    REGISTRY.inc('cache_requests_total', namespace=namespace, result='miss')
+
+    def fill():
+        # The previous leader may have just stored it
+        value = cache.get(cache_key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = compute()
+        if value is not None:
+            cache.set(cache_key, value, timeout or get_ttl(namespace))
+        return value
+
+    return _flights.do(cache_key, fill)
+
+
+def get_playlist_metadata(playlist_id, fetch):
+    """Cached playlist metadata + track list, fetched with ``fetch()`` on a miss"""
+    return get_or_compute('playlist', playlist_id, fetch)
+
+
+def resolve_youtube(search_query, resolve, scored=False, isrc=None):
+    """Cached YouTube resolution (search query -> video URL)
+
+    Scored resolutions (best of several candidates for a known track) are
+    cached apart from top-hit ones so neither is served for the other. A
+    track's ISRC names the recording exactly, so when given it is the key:
+    every playlist and query spelling of that recording shares one entry.
+    """
+    if isrc:
+        return get_or_compute('youtube_match', f"isrc:{isrc}", resolve)
+    namespace = 'youtube_match' if scored else 'youtube'
+    return get_or_compute(namespace, search_query.strip().lower(), resolve)
+
+
+def invalidate(namespace, key):
+    cache.delete(make_key(namespace, key))
+
+
+class SpotifyTokenCache(CacheHandler):
+    """spotipy cache handler that shares client-credential tokens via the Django cache
+
+    Every worker reuses one token instead of requesting its own per client.
+    """
+
+    def __init__(self, client_id):
+        self.cache_key = make_key('spotify_token', client_id)
+
+    def get_cached_token(self):
+        token_info = cache.get(self.cache_key)
+        result = 'miss' if token_info is None else 'hit'
+        REGISTRY.inc('cache_requests_total', namespace='spotify_token', result=result)
+        return token_info
+
+    def save_token_to_cache(self, token_info):
+        timeout = min(token_info.get('expires_in', get_ttl('spotify_token')), get_ttl('spotify_token'))
+        cache.set(self.cache_key, token_info, timeout)
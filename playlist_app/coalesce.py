@@ -0,0 +1,73 @@
+"""
+Request coalescing for identical concurrent requests
+Within a process, concurrent callers share one execution (single-flight).
+With COALESCE_ACROSS_PROCESSES, the leader also takes a row in the
+RequestLock table so leaders in other workers wait for it to finish.
+"""
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import RequestLock
+from .singleflight import SingleFlight
+
+
+_flights = SingleFlight('requests')
+
+# Poll interval bounds (seconds) while waiting on another process's lock
+POLL_INITIAL = 0.05
+POLL_MAX = 1.0
+
+
+def coalesce(key, fn):
+    """Run ``fn`` once for all concurrent callers with the same key
+
+    ``fn`` must be safe to re-run after another process finished the same work
+    (e.g. check the database first), since cross-process waiters call it once
+    the lock is released instead of receiving the other process's result.
+    """
+    if getattr(settings, 'COALESCE_ACROSS_PROCESSES', False):
+        return _flights.do(key, lambda: run_with_lock(key, fn))
+    return _flights.do(key, fn)
+
+
+def run_with_lock(key, fn):
+    owner = acquire_lock(key)
+    try:
+        return fn()
+    finally:
+        if owner:
+            release_lock(key, owner)
+
+
+def acquire_lock(key):
+    """Take the lock row for key, waiting while another live process holds it
+
+    Returns the owner token, or None if the wait timed out (the caller then
+    proceeds without the lock rather than failing the request).
+    """
+    ttl = getattr(settings, 'COALESCE_LOCK_TTL', 300)
+    deadline = time.monotonic() + getattr(settings, 'COALESCE_WAIT_TIMEOUT', 120)
+    owner = uuid.uuid4().hex
+    delay = POLL_INITIAL
+
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                RequestLock.objects.create(key=key, owner=owner, expires_at=now + timedelta(seconds=ttl))
+            return owner
+        except IntegrityError:
+            # Held by someone else; reclaim it if the holder died
+            RequestLock.objects.filter(key=key, expires_at__lt=now).delete()
+
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX)
+
+
+def release_lock(key, owner):
+    RequestLock.objects.filter(key=key, owner=owner).delete()
@@ -0,0 +1,64 @@
+"""
+Duplicate track elimination before downloading
+Compilations and merged playlists list the same song several times, often
+under different Spotify ids (the single and the album release). Tracks are
+grouped by spotify_id, then ISRC, then normalized primary artist + title
+with a duration check, and each group is downloaded once.
+"""
+import re
+import unicodedata
+
+
+# Same-named tracks further apart than this are different recordings
+# (e.g. two songs called "Intro" by one artist)
+DURATION_TOLERANCE_MS = 3000
+
+# "(feat. X)", "[with X]", "- feat. X" credits, which vary between releases
+_FEATURING = re.compile(r'[\(\[]\s*(?:feat|ft|featuring|with)\b[^\)\]]*[\)\]]|\s-\s(?:feat|ft)\b.*$', re.IGNORECASE)
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', text or '').casefold()
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def normalized_name(artist, title):
+    """'primary artist|title' with case, accents, punctuation and featuring credits removed"""
+    primary = (artist or '').split(',')[0]
+    title = _FEATURING.sub(' ', title or '')
+    return f"{_NON_WORD.sub(' ', _fold(primary)).strip()}|{_NON_WORD.sub(' ', _fold(title)).strip()}"
+
+
+def _close(a, b):
+    return not a or not b or abs(a - b) <= DURATION_TOLERANCE_MS
+
+
+def dedup_tracks(tracks):
+    """(pool, assignments) for objects with spotify_id, isrc, artist, title and duration_ms
+
+    ``pool`` maps a group key (the spotify_id of its first track) to that
+    track, in first-seen order; ``assignments`` maps every spotify_id seen to
+    its group key.
+    """
+    pool = {}
+    assignments = {}
+    by_isrc = {}
+    by_name = {}
+    for track in tracks:
+        if track.spotify_id in assignments:
+            continue
+        isrc = getattr(track, 'isrc', None)
+        name = normalized_name(track.artist, track.title)
+        group = by_isrc.get(isrc) if isrc else None
+        if group is None:
+            group = next((key for key in by_name.get(name, ())
+                          if _close(pool[key].duration_ms, track.duration_ms)), None)
+        if group is None:
+            group = track.spotify_id
+            pool[group] = track
+            by_name.setdefault(name, []).append(group)
+        if isrc:
+            by_isrc.setdefault(isrc, group)
+        assignments[track.spotify_id] = group
+    return pool, assignments
@@ -0,0 +1,75 @@
+"""
+Source format selection
+Every download is transcoded to an MP3 at the requested bitrate, so fetching
+the largest stream on offer wastes bytes: the smallest audio-only stream whose
+bitrate still covers the output quality is enough. Codecs are weighed by how
+much more efficient they are than MP3 (Opus at 64 kbps already holds what a
+128 kbps MP3 can), and video formats are never chosen.
+"""
+
+
+# Bitrate a codec needs to match MP3 at the same quality, as a fraction of MP3's
+CODEC_EFFICIENCY = {
+    'opus': 2.0,
+    'vorbis': 1.4,
+    'mp4a': 1.3,
+    'aac': 1.3,
+    'mp3': 1.0,
+}
+# MP3 bitrates (kbps) a download may ask for, as the strings clients send
+QUALITIES = ('128', '192', '320')
+# Sources are capped as the old 'bestaudio[filesize<50M]' selector did
+MAX_SOURCE_BYTES = 50 * 1000 * 1000
+
+
+def audio_only(fmt):
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')
+
+
+def mp3_equivalent(fmt):
+    """Bitrate (kbps) of an MP3 that sounds as good as fmt, or None if its bitrate is unknown"""
+    bitrate = fmt.get('abr') or fmt.get('tbr')
+    if not bitrate:
+        return None
+    codec = (fmt.get('acodec') or '').split('.')[0].lower()
+    return bitrate * CODEC_EFFICIENCY.get(codec, 1.0)
+
+
+def covers(mp3_kbps, quality):
+    """Whether a source worth mp3_kbps is good enough for a ``quality`` kbps MP3"""
+    # Short of 2% still counts: "128k" streams often report 126-127 kbps
+    return (mp3_kbps or 0) >= int(quality) * 0.98
+
+
+def audio_candidates(formats):
+    return [
+        fmt for fmt in formats
+        if audio_only(fmt) and (fmt.get('filesize') or fmt.get('filesize_approx') or 0) < MAX_SOURCE_BYTES
+    ]
+
+
+def best_audio_format(formats):
+    """Audio-only format with the highest MP3-equivalent bitrate, or None"""
+    candidates = audio_candidates(formats)
+    return max(candidates, key=lambda fmt: mp3_equivalent(fmt) or 0) if candidates else None
+
+
+def select_audio_format(formats, quality):
+    """Smallest audio-only format good enough for a ``quality`` kbps MP3, or None
+
+    When none is good enough the best audio-only format is taken instead.
+    Formats over MAX_SOURCE_BYTES are skipped.
+    """
+    good_enough = [fmt for fmt in audio_candidates(formats) if covers(mp3_equivalent(fmt), quality)]
+    if good_enough:
+        return min(good_enough, key=lambda fmt: (fmt.get('abr') or fmt.get('tbr'), -mp3_equivalent(fmt)))
+    return best_audio_format(formats)
+
+
+def audio_format_selector(quality):
+    """yt-dlp ``format`` option choosing with select_audio_format"""
+    def select(ctx):
+        fmt = select_audio_format(ctx['formats'], quality)
+        if fmt:
+            yield fmt
+    return select
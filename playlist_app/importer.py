@@ -0,0 +1,227 @@
+"""
+Playlist import helpers
+Turns Spotify track payloads into Track rows and writes them with bulk upserts.
+Imports stream page by page so memory stays flat regardless of playlist length.
+Refreshes diff Spotify's current list against stored rows and write only
+the differences.
+"""
+from bisect import bisect_left
+from collections import defaultdict, deque
+from django.conf import settings
+from django.db import transaction
+from .enrichment import track_metadata
+from .models import Track
+
+
+# Columns refreshed when a (playlist, position) row already exists
+TRACK_UPDATE_FIELDS = [
+    'title', 'artist', 'album', 'duration_ms', 'spotify_id',
+    'preview_url', 'youtube_search_query', 'isrc', 'album_id', 'release_date',
+]
+
+UPSERT_BATCH_SIZE = 500
+
+# Imported positions are spaced this far apart (starting one step in, so
+# there is room in front too) so a refresh can slot tracks in between
+# without renumbering the rest of the playlist
+POSITION_STEP = 1024
+
+
+def get_import_batch_size():
+    return getattr(settings, 'PLAYLIST_IMPORT_BATCH_SIZE', UPSERT_BATCH_SIZE)
+
+
+def iter_playlist_tracks(sp, playlist_id, timer=None):
+    """Yield Spotify track objects one page at a time
+
+    Only the current page (100 items) is held; each Spotify call is timed as
+    a spotify_fetch span when a timer is given.
+    """
+    if timer:
+        timer.start('spotify_fetch')
+    results = sp.playlist_tracks(playlist_id)
+    if timer:
+        timer.stop('spotify_fetch')
+
+    while results:
+        for item in results['items']:
+            track_info = item.get('track')
+            if track_info and track_info['type'] == 'track':
+                yield track_info
+
+        if not results['next']:
+            break
+        if timer:
+            timer.start('spotify_fetch')
+        results = sp.next(results)
+        if timer:
+            timer.stop('spotify_fetch')
+
+
+def import_tracks(playlist, track_infos, batch_size=None):
+    """Upsert tracks from an iterable in fixed-size batches
+
+    Each batch is written and dropped before the next is built, so peak
+    memory is one batch. Outside a transaction every batch commits on its
+    own, so no lock is held while the next page is fetched. Returns the
+    number of tracks imported.
+    """
+    batch_size = batch_size or get_import_batch_size()
+    batch = []
+    count = 0
+    for track_info in track_infos:
+        batch.append(build_track(track_info, position=(count + 1) * POSITION_STEP))
+        count += 1
+        if len(batch) >= batch_size:
+            upsert_tracks(playlist, batch, batch_size)
+            batch = []
+    if batch:
+        upsert_tracks(playlist, batch, batch_size)
+    return count
+
+
+def build_track(track_info, position, playlist=None):
+    """Unsaved Track from a Spotify track object"""
+    artist = ', '.join([artist['name'] for artist in track_info['artists']])
+    return Track(
+        playlist=playlist,
+        position=position,
+        title=track_info['name'],
+        artist=artist,
+        duration_ms=track_info.get('duration_ms'),
+        spotify_id=track_info['id'],
+        preview_url=track_info.get('preview_url'),
+        youtube_search_query=f"{artist} {track_info['name']}",
+        **track_metadata(track_info)
+    )
+
+
+def upsert_tracks(playlist, tracks, batch_size=UPSERT_BATCH_SIZE):
+    """Insert or update tracks keyed on (playlist, position)
+
+    One INSERT ... ON CONFLICT DO UPDATE per batch, so re-importing a
+    playlist (or two workers importing it at once) never hits the unique
+    constraint and never takes more than one round trip per batch.
+    """
+    for track in tracks:
+        track.playlist = playlist
+    return Track.objects.bulk_create(
+        tracks,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['playlist', 'position'],
+        update_fields=TRACK_UPDATE_FIELDS,
+    )
+
+
+def _longest_increasing_subsequence(values):
+    """Indexes of one longest strictly increasing subsequence of values"""
+    tails = []          # tails[k]: smallest tail value of an increasing run of length k+1
+    tail_indexes = []
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        k = bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_indexes.append(i)
+        else:
+            tails[k] = value
+            tail_indexes[k] = i
+        previous[i] = tail_indexes[k - 1] if k else None
+
+    result = []
+    i = tail_indexes[-1] if tail_indexes else None
+    while i is not None:
+        result.append(i)
+        i = previous[i]
+    return result[::-1]
+
+
+def _fill_positions(positions):
+    """Give every None slot a position between its kept neighbours, in place
+
+    Returns False if some gap is too small, in which case the caller renumbers.
+    """
+    i = 0
+    while i < len(positions):
+        if positions[i] is not None:
+            i += 1
+            continue
+        end = i
+        while end < len(positions) and positions[end] is None:
+            end += 1
+        count = end - i
+        low = positions[i - 1] if i else -1
+        high = positions[end] if end < len(positions) else low + POSITION_STEP * (count + 1)
+        if high - low <= count:
+            return False
+        for j in range(count):
+            positions[i + j] = low + (high - low) * (j + 1) // (count + 1)
+        i = end
+    return True
+
+
+def refresh_tracks(playlist, track_infos):
+    """Apply Spotify's current track list to a stored playlist as a diff
+
+    Stored rows are matched to the new list by spotify_id. Rows whose
+    relative order survived (a longest increasing run of old positions) are
+    left alone; only removed rows are deleted, moved rows get a new position
+    and new tracks are inserted into the gaps. Returns the change counts.
+    """
+    desired = [build_track(track_info, position=None, playlist=playlist) for track_info in track_infos]
+    stored = list(playlist.tracks.order_by('position').values_list('pk', 'position', 'spotify_id'))
+
+    # Pair each wanted track with the earliest unused stored row of the same track
+    available = defaultdict(deque)
+    for pk, position, spotify_id in stored:
+        available[spotify_id].append((pk, position))
+    matches = [
+        available[track.spotify_id].popleft() if available[track.spotify_id] else None
+        for track in desired
+    ]
+    deleted = [pk for rows in available.values() for pk, _ in rows]
+
+    matched = [i for i, match in enumerate(matches) if match]
+    kept = {matched[k] for k in _longest_increasing_subsequence([matches[i][1] for i in matched])}
+    positions = [matches[i][1] if i in kept else None for i in range(len(desired))]
+    if not _fill_positions(positions):
+        positions = [(i + 1) * POSITION_STEP for i in range(len(desired))]
+
+    moved = [
+        (matches[i][0], positions[i]) for i in matched
+        if matches[i][1] != positions[i]
+    ]
+    inserted = []
+    for i, track in enumerate(desired):
+        if matches[i] is None:
+            track.position = positions[i]
+            inserted.append(track)
+
+    with transaction.atomic():
+        if deleted:
+            Track.objects.filter(pk__in=deleted).delete()
+        if moved:
+            # Park moved rows above every old and new position first, so the
+            # unique (playlist, position) constraint never sees a transient clash
+            ceiling = max([row[1] for row in stored] + positions) + 1
+            Track.objects.bulk_update(
+                [Track(pk=pk, position=ceiling + j) for j, (pk, _) in enumerate(moved)],
+                ['position'], batch_size=UPSERT_BATCH_SIZE
+            )
+            Track.objects.bulk_update(
+                [Track(pk=pk, position=position) for pk, position in moved],
+                ['position'], batch_size=UPSERT_BATCH_SIZE
+            )
+        if inserted:
+            Track.objects.bulk_create(inserted, batch_size=UPSERT_BATCH_SIZE)
+
+        playlist.total_tracks = len(desired)
+        playlist.save(update_fields=['total_tracks', 'updated_at'])
+
+    return {
+        'inserted': len(inserted),
+        'deleted': len(deleted),
+        'moved': len(moved),
+        'unchanged': len(desired) - len(inserted) - len(moved),
+    }
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from playlist_app.enrichment import enrich_tracks
+from playlist_app.models import Track
+from playlist_app.views import create_spotify_client
+
+
+class Command(BaseCommand):
+    help = 'Fill in ISRCs and album metadata for stored tracks, 50 Spotify ids per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--playlist', help='only tracks of this Spotify playlist id')
+
+    def handle(self, *args, **options):
+        queryset = Track.objects.all()
+        if options['playlist']:
+            queryset = queryset.filter(playlist__spotify_id=options['playlist'])
+        pending = queryset.filter(isrc__isnull=True).count()
+        updated = enrich_tracks(create_spotify_client(), queryset)
+        self.stdout.write(self.style.SUCCESS(f"Enriched {updated} of {pending} tracks missing an ISRC"))
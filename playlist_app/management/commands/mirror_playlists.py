@@ -0,0 +1,81 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from playlist_app.batch import (dedup_savings, download_pool, read_url_file, record_sessions, track_pool,
+                                write_outputs)
+from playlist_app.formats import QUALITIES
+from playlist_app.transcode import DEFAULT_LOUDNORM_FILTER
+from playlist_app.views import import_playlists
+
+
+class Command(BaseCommand):
+    help = ('Import many Spotify playlists (or album, track, artist links) without prompts, '
+            'optionally downloading each distinct song once and writing every playlist as an .m3u8')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='playlist links or ids')
+        parser.add_argument('--file', action='append', default=[],
+                            help="file with one link per line ('-' for stdin); may be repeated")
+        parser.add_argument('--refresh', action='store_true', help='resync playlists imported before')
+        parser.add_argument('--discography', action='store_true', help='artist links import every release')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='concurrent imports (default: SPOTIFY_BATCH_WORKERS)')
+        parser.add_argument('--output', help='download the songs and write the playlists here')
+        parser.add_argument('--folders', action='store_true',
+                            help='also write a folder per playlist, hardlinked to the shared songs')
+        parser.add_argument('--quality', default='192', choices=QUALITIES)
+        parser.add_argument('--normalize', action='store_true', help='loudness-normalize the audio')
+        parser.add_argument('--download-workers', type=int, default=4, help='concurrent song downloads')
+
+    def handle(self, *args, **options):
+        urls = list(options['urls'])
+        for path in options['file']:
+            try:
+                urls.extend(read_url_file(path))
+            except OSError as e:
+                raise CommandError(f"Can't read {path}: {e}")
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            raise CommandError('Give playlist links as arguments or with --file')
+
+        results = import_playlists(urls, refresh=options['refresh'], discography=options['discography'],
+                                   workers=options['workers'])
+        playlists = []
+        for url, playlist, error in results:
+            if playlist:
+                playlists.append(playlist)
+                self.stdout.write(f"imported  {playlist.title} ({playlist.total_tracks} tracks)")
+            else:
+                self.stderr.write(f"failed    {url}: {error}")
+
+        pool, members = track_pool(playlists)
+        total = sum(len(keys) for keys in members.values())
+        self.stdout.write(f"{len(playlists)} of {len(urls)} playlists imported: "
+                          f"{total} tracks, {len(pool)} distinct songs")
+
+        if options['output']:
+            loudnorm = None
+            if options['normalize']:
+                loudnorm = getattr(settings, 'AUDIO_LOUDNORM_FILTER', DEFAULT_LOUDNORM_FILTER)
+
+            def on_done(track, path):
+                self.stdout.write(f"{'ok' if path else 'failed':<9} {track.artist} - {track.title}")
+
+            paths = download_pool(pool, options['quality'], loudnorm, options['download_workers'], on_done)
+            output = os.path.abspath(options['output'])
+            stats = write_outputs(output, pool, members, paths, folders=options['folders'])
+            downloaded = sum(1 for path in paths.values() if path)
+            savings = dedup_savings(members, paths)
+            record_sessions(members, paths, savings)
+            duplicates = sum(count for count, _ in savings.values())
+            saved = sum(size for _, size in savings.values())
+            self.stdout.write(f"{downloaded} of {len(pool)} songs available, {stats['written']} new files written to {output}")
+            self.stdout.write(f"duplicates skipped: {duplicates} ({saved / 1e6:.1f} MB not downloaded again)")
+            if options['folders']:
+                self.stdout.write(f"playlist folders: {stats['linked']} hardlinked, "
+                                  f"{stats['cloned']} cloned, {stats['copied']} copied")
+
+        failed = len(urls) - len(playlists)
+        if failed:
+            raise CommandError(f"{failed} playlist(s) could not be imported")
+        self.stdout.write(self.style.SUCCESS('Done'))
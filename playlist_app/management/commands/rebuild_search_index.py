@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from playlist_app.search import index_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text search index over tracks and playlists'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        backend = index_backend()
+        if backend:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the {backend} search index"))
+        else:
+            self.stdout.write(self.style.WARNING("No search index on this database; search uses LIKE"))
@@ -0,0 +1,179 @@
+"""
+In-process metrics for the download pipeline
+Stage timings are kept as Prometheus-style histograms and rendered at /metrics
+"""
+import threading
+import time
+
+
+# Stages a track goes through, in pipeline order
+PIPELINE_STAGES = ['spotify_fetch', 'yt_search', 'yt_download', 'transcode_queue', 'transcode', 'encode', 'respond']
+
+# Histogram buckets (seconds), wide enough for multi-minute downloads
+DURATION_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+METRIC_HELP = {
+    'pipeline_stage_seconds': ('histogram', 'Time spent in each download pipeline stage'),
+    'pipeline_stage_bytes_total': ('counter', 'Bytes moved by each download pipeline stage'),
+    'pipeline_stage_errors_total': ('counter', 'Pipeline stages that raised an exception'),
+    'cache_requests_total': ('counter', 'Cache lookups by namespace and result (hit/miss)'),
+    'cache_tier_hits_total': ('counter', 'Cache hits served by each tier (local/shared)'),
+    'singleflight_coalesced_total': ('counter', 'Calls that waited on an identical in-flight call'),
+    'admission_rejected_total': ('counter', 'Requests turned away by admission control, by gate and reason'),
+    'admission_wait_seconds': ('histogram', 'Time admitted requests spent queued for a slot'),
+    'spotify_requests_total': ('counter', 'Spotify Web API requests made, by endpoint'),
+    'download_segments_total': ('counter', 'Byte ranges of parallel downloads, by result (ok/retried/failed)'),
+    'audio_cache_evictions_total': ('counter', 'Audio files evicted from the disk cache, by tier (source/variant)'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    pairs = list(label_key) + (extra or [])
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{str(value)}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe store of counters and histograms keyed by name and labels"""
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or DURATION_BUCKETS
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            bucket_counts, total, count = series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            series[key] = (bucket_counts, total + value, count + 1)
+
+    def get(self, name, **labels):
+        """Current value of a counter (0 if never incremented)"""
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                kind, help_text = METRIC_HELP.get(name, ('counter', name))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f'{name}{_format_labels(key)} {value}')
+
+            for name in sorted(self._histograms):
+                _, help_text = METRIC_HELP.get(name, ('histogram', name))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, (bucket_counts, total, count) in sorted(self._histograms[name].items()):
+                    for bound, in_bucket in zip(self.buckets, bucket_counts):
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {in_bucket}')
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {total:.6f}')
+                    lines.append(f'{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry; each worker process exposes its own numbers
+REGISTRY = MetricsRegistry()
+
+
+class Span:
+    """A single timed stage: how long it took and how many bytes it moved"""
+    __slots__ = ('stage', 'seconds', 'bytes')
+
+    def __init__(self, stage, seconds=0.0, bytes_moved=0):
+        self.stage = stage
+        self.seconds = seconds
+        self.bytes = bytes_moved
+
+
+class _StageContext:
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.span = Span(stage)
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.seconds = time.perf_counter() - self.started
+        self.timer.add(self.span, failed=exc_type is not None)
+        return False
+
+
+class StageTimer:
+    """Collects the stage spans of one request and reports them to the registry
+
+    Use ``with timer.stage('encode') as span:`` and set ``span.bytes`` inside the
+    block, or ``start()``/``stop()`` when the boundaries live in callbacks
+    (e.g. yt-dlp progress hooks).
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or REGISTRY
+        self.spans = []
+        self._started = {}
+
+    def stage(self, stage):
+        return _StageContext(self, stage)
+
+    def start(self, stage):
+        self._started[stage] = time.perf_counter()
+
+    def stop(self, stage, bytes_moved=0):
+        started = self._started.pop(stage, None)
+        if started is not None:
+            self.add(Span(stage, time.perf_counter() - started, bytes_moved))
+
+    def add(self, span, failed=False):
+        self.spans.append(span)
+        self.registry.observe('pipeline_stage_seconds', span.seconds, stage=span.stage)
+        if span.bytes:
+            self.registry.inc('pipeline_stage_bytes_total', span.bytes, stage=span.stage)
+        if failed:
+            self.registry.inc('pipeline_stage_errors_total', stage=span.stage)
+
+    def summary(self):
+        """Per-stage totals: {stage: {'seconds': float, 'bytes': int}}"""
+        totals = {}
+        for span in self.spans:
+            entry = totals.setdefault(span.stage, {'seconds': 0.0, 'bytes': 0})
+            entry['seconds'] += span.seconds
+            entry['bytes'] += span.bytes
+        return totals
+
+    def server_timing(self):
+        """Value for a Server-Timing header, so browsers' devtools show the stages"""
+        return ', '.join(
+            f"{stage};dur={entry['seconds'] * 1000:.1f}"
+            for stage, entry in self.summary().items()
+        )
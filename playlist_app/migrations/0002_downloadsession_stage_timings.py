@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadsession',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:43
+
+from django.db import migrations, models
+
+
+def number_existing_tracks(apps, schema_editor):
+    """Give tracks imported before this migration their order within each playlist"""
+    Track = apps.get_model('playlist_app', 'Track')
+    updated = []
+    current_playlist, position = None, 0
+    for track in Track.objects.order_by('playlist_id', 'id').only('id', 'playlist_id').iterator():
+        if track.playlist_id != current_playlist:
+            current_playlist, position = track.playlist_id, 0
+        track.position = position
+        position += 1
+        updated.append(track)
+        if len(updated) >= 1000:
+            Track.objects.bulk_update(updated, ['position'])
+            updated = []
+    if updated:
+        Track.objects.bulk_update(updated, ['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_app', '0003_requestlock'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='track',
+            options={'ordering': ['playlist_id', 'position']},
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_existing_tracks, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='track',
+            constraint=models.UniqueConstraint(fields=('playlist', 'position'), name='unique_track_position'),
+        ),
+    ]
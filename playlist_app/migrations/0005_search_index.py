@@ -0,0 +1,126 @@
+"""
+Full-text search index over tracks and playlists (see playlist_app/search.py)
+
+SQLite gets FTS5 external-content tables kept in sync by triggers; PostgreSQL
+gets GIN indexes on weighted tsvector expressions, which stay in sync by
+themselves. Other backends get nothing and search falls back to LIKE.
+
+On SQLite, a later migration that makes Django rebuild the track or playlist
+table drops these triggers; run ``manage.py rebuild_search_index`` after it.
+"""
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    # Tracks: title weighs most, then artist, then album (see search.TRACK_INDEX)
+    """CREATE VIRTUAL TABLE playlist_app_track_fts USING fts5(
+        title, artist, album,
+        content='playlist_app_track', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER playlist_app_track_fts_insert AFTER INSERT ON playlist_app_track BEGIN
+        INSERT INTO playlist_app_track_fts(rowid, title, artist, album)
+        VALUES (new.id, new.title, new.artist, new.album);
+    END""",
+    """CREATE TRIGGER playlist_app_track_fts_delete AFTER DELETE ON playlist_app_track BEGIN
+        INSERT INTO playlist_app_track_fts(playlist_app_track_fts, rowid, title, artist, album)
+        VALUES ('delete', old.id, old.title, old.artist, old.album);
+    END""",
+    # Only text changes touch the index; refreshes that just move positions don't
+    """CREATE TRIGGER playlist_app_track_fts_update AFTER UPDATE OF title, artist, album ON playlist_app_track BEGIN
+        INSERT INTO playlist_app_track_fts(playlist_app_track_fts, rowid, title, artist, album)
+        VALUES ('delete', old.id, old.title, old.artist, old.album);
+        INSERT INTO playlist_app_track_fts(rowid, title, artist, album)
+        VALUES (new.id, new.title, new.artist, new.album);
+    END""",
+    "INSERT INTO playlist_app_track_fts(playlist_app_track_fts) VALUES ('rebuild')",
+
+    """CREATE VIRTUAL TABLE playlist_app_playlist_fts USING fts5(
+        title, owner,
+        content='playlist_app_playlist', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER playlist_app_playlist_fts_insert AFTER INSERT ON playlist_app_playlist BEGIN
+        INSERT INTO playlist_app_playlist_fts(rowid, title, owner) VALUES (new.id, new.title, new.owner);
+    END""",
+    """CREATE TRIGGER playlist_app_playlist_fts_delete AFTER DELETE ON playlist_app_playlist BEGIN
+        INSERT INTO playlist_app_playlist_fts(playlist_app_playlist_fts, rowid, title, owner)
+        VALUES ('delete', old.id, old.title, old.owner);
+    END""",
+    """CREATE TRIGGER playlist_app_playlist_fts_update AFTER UPDATE OF title, owner ON playlist_app_playlist BEGIN
+        INSERT INTO playlist_app_playlist_fts(playlist_app_playlist_fts, rowid, title, owner)
+        VALUES ('delete', old.id, old.title, old.owner);
+        INSERT INTO playlist_app_playlist_fts(rowid, title, owner) VALUES (new.id, new.title, new.owner);
+    END""",
+    "INSERT INTO playlist_app_playlist_fts(playlist_app_playlist_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS playlist_app_track_fts_insert',
+    'DROP TRIGGER IF EXISTS playlist_app_track_fts_delete',
+    'DROP TRIGGER IF EXISTS playlist_app_track_fts_update',
+    'DROP TABLE IF EXISTS playlist_app_track_fts',
+    'DROP TRIGGER IF EXISTS playlist_app_playlist_fts_insert',
+    'DROP TRIGGER IF EXISTS playlist_app_playlist_fts_delete',
+    'DROP TRIGGER IF EXISTS playlist_app_playlist_fts_update',
+    'DROP TABLE IF EXISTS playlist_app_playlist_fts',
+]
+
+# The expressions must match search.TRACK_INDEX / PLAYLIST_INDEX exactly for
+# the planner to use the indexes
+POSTGRES_FORWARD = [
+    """CREATE INDEX playlist_app_track_search ON playlist_app_track USING GIN ((
+        setweight(to_tsvector('simple', title), 'A') ||
+        setweight(to_tsvector('simple', artist), 'B') ||
+        setweight(to_tsvector('simple', album), 'C')
+    ))""",
+    """CREATE INDEX playlist_app_playlist_search ON playlist_app_playlist USING GIN ((
+        setweight(to_tsvector('simple', title), 'A') ||
+        setweight(to_tsvector('simple', owner), 'B')
+    ))""",
+]
+
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS playlist_app_track_search',
+    'DROP INDEX IF EXISTS playlist_app_playlist_search',
+]
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def run_statements(schema_editor, sqlite, postgres):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        if not sqlite_has_fts5(connection):
+            print("SQLite was built without FTS5; search will fall back to LIKE")
+            return
+        statements = sqlite
+    elif connection.vendor == 'postgresql':
+        statements = postgres
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    run_statements(schema_editor, SQLITE_FORWARD, POSTGRES_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    run_statements(schema_editor, SQLITE_REVERSE, POSTGRES_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_app', '0004_track_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
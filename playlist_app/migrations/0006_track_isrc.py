@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_app', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='album_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='isrc',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='release_date',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+    ]
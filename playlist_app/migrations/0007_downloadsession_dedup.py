@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_app', '0006_track_isrc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadsession',
+            name='bytes_saved',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='downloadsession',
+            name='tracks_deduplicated',
+            field=models.IntegerField(default=0),
+        ),
+    ]
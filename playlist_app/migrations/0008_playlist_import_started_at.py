@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_app', '0007_downloadsession_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='import_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 
 class Playlist(models.Model):
@@ -11,6 +11,10 @@ class Playlist(models.Model):
     is_public = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set while an import is still writing track batches, each committed on
+    # its own; NULL once the last one is in. Nullable with no default so the
+    # column is a plain ALTER TABLE on SQLite, keeping the search triggers.
+    import_started_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -28,6 +32,16 @@ class Track(models.Model):
     duration_ms = models.IntegerField(null=True, blank=True)
     spotify_id = models.CharField(max_length=100)
     preview_url = models.URLField(blank=True, null=True)
+    # Filled from Spotify's track objects (see enrichment.py). Nullable so
+    # adding them is a plain ALTER TABLE on SQLite, which keeps the search
+    # index triggers; NULL isrc also marks rows still to be enriched.
+    isrc = models.CharField(max_length=12, null=True, blank=True, db_index=True)
+    album_id = models.CharField(max_length=100, null=True, blank=True)
+    release_date = models.CharField(max_length=10, null=True, blank=True)
+    # Sort key within the playlist and the upsert key together with it. Imports
+    # space positions apart (importer.POSITION_STEP) so refreshes can insert
+    # or move tracks without renumbering the rest.
+    position = models.PositiveIntegerField(default=0)
     
     # Fields for YouTube data (populated client-side)
     youtube_search_query = models.CharField(max_length=500, blank=True)
@@ -35,7 +49,10 @@ class Track(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        ordering = ['id']
+        ordering = ['playlist_id', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['playlist', 'position'], name='unique_track_position'),
+        ]
     
     def __str__(self):
         return f"{self.title} by {self.artist}"
@@ -63,14 +80,52 @@ class DownloadSession(models.Model):
     tracks_processed = models.IntegerField(default=0)
     tracks_successful = models.IntegerField(default=0)
     tracks_failed = models.IntegerField(default=0)
+    # Duplicate tracks skipped (same song already downloaded in the run) and
+    # the bytes they would have cost. mirror_playlists records them; the web
+    # page keeps no sessions, so other sessions hold 0 unless their client
+    # sends them to update_download_progress
+    tracks_deduplicated = models.IntegerField(default=0)
+    bytes_saved = models.BigIntegerField(default=0)
     status = models.CharField(max_length=20, choices=[
         ('pending', 'Pending'),
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ], default='pending')
+    # Per-stage aggregates: {stage: {'count': n, 'seconds': s, 'bytes': b}}
+    stage_timings = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
     def __str__(self):
         return f"Download session for {self.playlist.title}"
+    
+    @classmethod
+    def record_stage_timings(cls, session_id, timings):
+        """Fold one track's stage timings into the session aggregates"""
+        with transaction.atomic():
+            session = cls.objects.select_for_update().filter(session_id=session_id).first()
+            if session is None:
+                return None
+            
+            totals = session.stage_timings or {}
+            for stage, span in timings.items():
+                entry = totals.setdefault(stage, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+                entry['count'] += 1
+                entry['seconds'] += span['seconds']
+                entry['bytes'] += span['bytes']
+            
+            session.stage_timings = totals
+            session.save(update_fields=['stage_timings'])
+            return session
+
+
+class RequestLock(models.Model):
+    """Cross-process lock row used to coalesce identical in-flight requests"""
+    key = models.CharField(max_length=255, unique=True)
+    owner = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Lock {self.key} held by {self.owner}"
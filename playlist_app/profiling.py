@@ -0,0 +1,130 @@
+"""
+On-demand request profiling
+Captures a cProfile trace for requests that ask for it (X-Profile header) or
+are picked by sampling, and keeps the newest PROFILING_MAX_FILES on disk.
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_SUFFIX = '.pstats'
+
+# cProfile can't run two profilers at once, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def get_profile_dir():
+    return str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def list_profiles():
+    """Stored profiles, newest first"""
+    profile_dir = get_profile_dir()
+    if not os.path.isdir(profile_dir):
+        return []
+
+    profiles = []
+    for name in os.listdir(profile_dir):
+        if not name.endswith(PROFILE_SUFFIX):
+            continue
+        stat = os.stat(os.path.join(profile_dir, name))
+        profiles.append({'name': name, 'size': stat.st_size, 'modified': stat.st_mtime})
+    profiles.sort(key=lambda p: p['modified'], reverse=True)
+    return profiles
+
+
+def get_profile_path(name):
+    """Resolve a stored profile by name, refusing anything outside the profile dir"""
+    if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIX):
+        return None
+    path = os.path.join(get_profile_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+def render_profile_text(path, limit=50):
+    """Top functions by cumulative time, as pstats prints them"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def rotate_profiles(max_files):
+    """Delete the oldest profiles beyond max_files"""
+    for stale in list_profiles()[max_files:]:
+        try:
+            os.remove(os.path.join(get_profile_dir(), stale['name']))
+        except OSError:
+            pass
+
+
+class ProfilingMiddleware:
+    """Profile a request when triggered by header or sampling
+
+    Disabled unless PROFILING_ENABLED is set, in which case Django drops the
+    middleware at startup. When enabled, an untriggered request costs one
+    header lookup (plus a random() call if sampling is on).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.token = getattr(settings, 'PROFILING_TOKEN', '')
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.max_files = getattr(settings, 'PROFILING_MAX_FILES', 50)
+
+    def __call__(self, request):
+        if not self.should_profile(request) or not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) already owns the hook
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            name = self.save_profile(profiler, request, elapsed_ms)
+            if name:
+                response['X-Profile-Id'] = name
+            return response
+        finally:
+            _profile_lock.release()
+
+    def should_profile(self, request):
+        header = request.META.get(PROFILE_HEADER)
+        if header is not None:
+            if self.token:
+                return header == self.token
+            user = getattr(request, 'user', None)
+            return bool(user and user.is_staff)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def save_profile(self, profiler, request, elapsed_ms):
+        profile_dir = get_profile_dir()
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_')[:60] or 'root'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{request.method}-{slug}-{elapsed_ms:.0f}ms{PROFILE_SUFFIX}"
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, name))
+            rotate_profiles(self.max_files)
+        except OSError as e:
+            print(f"Profile save error: {str(e)}")
+            return None
+        return name
@@ -0,0 +1,194 @@
+"""
+Parallel HTTP range downloads
+A large audio stream fetched over one connection leaves most of a
+high-latency link idle. The file is split into byte ranges fetched on
+several connections at once and written in place; each range is checked
+against the server's Content-Range and validator, and the reassembled file
+against the expected size. A process-wide budget caps connections across
+all files, so many concurrent downloads share it instead of multiplying it.
+"""
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import requests
+from django.conf import settings
+from .metrics import REGISTRY
+
+
+READ_CHUNK_BYTES = 64 * 1024
+# Attempts per range; a retry resumes from the last byte received
+SEGMENT_RETRIES = 3
+# Ranges per connection, so a connection that finishes early takes more work
+SEGMENTS_PER_CONNECTION = 2
+
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class RangeNotSupported(Exception):
+    """Server answered a range request with the whole file"""
+
+
+class IntegrityError(Exception):
+    """A range or the reassembled file doesn't match what the server promised"""
+
+
+def get_connections_per_file():
+    return max(1, getattr(settings, 'DOWNLOAD_CONNECTIONS_PER_FILE', 4))
+
+
+def get_min_segment_bytes():
+    return getattr(settings, 'DOWNLOAD_RANGE_MIN_BYTES', 1024 * 1024)
+
+
+class ConnectionBudget:
+    """At most ``limit`` download connections open at once across all files
+
+    A download asks for as many connections as it would like and gets what
+    is free (waiting only until at least one is), so a busy process degrades
+    to one connection per file rather than queueing.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, wanted):
+        with self._cond:
+            while self.in_use >= self.limit:
+                self._cond.wait()
+            granted = max(1, min(wanted, self.limit - self.in_use))
+            self.in_use += granted
+            return granted
+
+    def release(self, count):
+        with self._cond:
+            self.in_use -= count
+            self._cond.notify_all()
+
+    @contextmanager
+    def connections(self, wanted):
+        granted = self.acquire(wanted)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_connection_budget():
+    """Process-wide budget of DOWNLOAD_MAX_CONNECTIONS"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = ConnectionBudget(getattr(settings, 'DOWNLOAD_MAX_CONNECTIONS', 16))
+        return _budget
+
+
+def plan_segments(size, connections, min_segment_bytes):
+    """(first, last) inclusive byte ranges covering size bytes
+
+    Never more than SEGMENTS_PER_CONNECTION per connection, and none smaller
+    than min_segment_bytes (except the last), so small files stay whole.
+    """
+    count = min(connections * SEGMENTS_PER_CONNECTION, max(1, size // max(min_segment_bytes, 1)))
+    step = math.ceil(size / count)
+    return [(first, min(first + step, size) - 1) for first in range(0, size, step)]
+
+
+def ranged_format(info):
+    """(url, headers, size) when a yt-dlp info dict is one plain HTTP file of known size, else None
+
+    Merged formats, fragmented (DASH/HLS) streams and estimated sizes are
+    left to yt-dlp.
+    """
+    if info.get('requested_formats') or info.get('fragments'):
+        return None
+    if info.get('protocol') not in ('http', 'https') or not info.get('filesize') or not info.get('url'):
+        return None
+    return info['url'], dict(info.get('http_headers') or {}), int(info['filesize'])
+
+
+def _check_response(response, first, last, size):
+    if response.status_code == 200:
+        raise RangeNotSupported(f"Server ignored Range for bytes {first}-{last}")
+    response.raise_for_status()
+    match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+    if not match or (int(match.group(1)), int(match.group(2))) != (first, last):
+        raise IntegrityError(f"Asked for bytes {first}-{last}, got {response.headers.get('Content-Range')!r}")
+    if match.group(3) != '*' and int(match.group(3)) != size:
+        raise IntegrityError(f"Expected {size} bytes, server says {match.group(3)}")
+
+
+def _fetch_segment(session, url, headers, path, first, last, size, validator, timeout):
+    """Write bytes first..last of url into path at the same offset"""
+    position = first
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            range_headers = dict(headers, Range=f'bytes={position}-{last}')
+            with session.get(url, headers=range_headers, stream=True, timeout=timeout) as response:
+                _check_response(response, position, last, size)
+                # Every range must come from the same version of the file
+                tag = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                with validator['lock']:
+                    validator.setdefault('value', tag)
+                if tag != validator['value']:
+                    raise IntegrityError(f"File changed during download ({validator['value']} -> {tag})")
+                with open(path, 'r+b') as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(READ_CHUNK_BYTES):
+                        if position + len(chunk) > last + 1:
+                            raise IntegrityError(f"Server sent more than bytes {first}-{last}")
+                        f.write(chunk)
+                        position += len(chunk)
+            if position != last + 1:
+                raise IOError(f"Connection closed at byte {position} of {first}-{last}")
+            REGISTRY.inc('download_segments_total', result='ok')
+            return last - first + 1
+        except (RangeNotSupported, IntegrityError):
+            REGISTRY.inc('download_segments_total', result='failed')
+            raise
+        except Exception:
+            if attempt == SEGMENT_RETRIES - 1:
+                REGISTRY.inc('download_segments_total', result='failed')
+                raise
+            REGISTRY.inc('download_segments_total', result='retried')
+
+
+def download_ranges(url, path, size, headers=None, connections=None, timeout=30):
+    """Download url (size bytes) to path over up to ``connections`` parallel range requests
+
+    The caller takes the connections from the budget (see
+    get_connection_budget). Raises RangeNotSupported if the server doesn't
+    honour Range (the caller can fall back to a single stream) and
+    IntegrityError if any range, or the result, is off; path is removed on
+    failure. Returns the number of bytes written.
+    """
+    connections = connections or get_connections_per_file()
+    segments = plan_segments(size, connections, get_min_segment_bytes())
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    validator = {'lock': threading.Lock()}
+    try:
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            with ThreadPoolExecutor(max_workers=min(connections, len(segments))) as pool:
+                written = sum(pool.map(
+                    lambda segment: _fetch_segment(session, url, headers or {}, path, *segment,
+                                                   size, validator, timeout),
+                    segments,
+                ))
+        if written != size or os.path.getsize(path) != size:
+            raise IntegrityError(f"Reassembled {os.path.getsize(path)} bytes, expected {size}")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return written
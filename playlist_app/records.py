@@ -0,0 +1,76 @@
+"""
+Compact track records for the playlist API
+One __slots__ object per track instead of a dict, and a columnar response
+shape (one array per field) so large playlists cost less memory and fewer
+bytes on the wire. The serverless playlist function keeps its own copy.
+"""
+from .enrichment import clean_isrc
+
+
+# Fields sent in the columnar response, in order
+TRACK_COLUMNS = ('id', 'name', 'artist', 'album', 'duration_ms', 'preview_url', 'popularity', 'isrc')
+
+SPOTIFY_TRACK_URL = 'https://open.spotify.com/track/'
+
+
+class TrackRecord:
+    """Playlist track with only the fields the client uses"""
+
+    __slots__ = ('id', 'name', 'artists', 'album', 'duration_ms', 'preview_url', 'popularity', 'isrc')
+
+    def __init__(self, id, name, artists, duration_ms, preview_url=None, popularity=None, album=None, isrc=None):
+        self.id = id
+        self.name = name
+        self.artists = artists
+        self.duration_ms = duration_ms
+        self.preview_url = preview_url
+        self.popularity = popularity
+        self.album = album
+        self.isrc = isrc
+
+    @classmethod
+    def from_spotify(cls, track):
+        return cls(
+            track['id'],
+            track['name'],
+            tuple(artist['name'] for artist in track['artists']),
+            track['duration_ms'],
+            track.get('preview_url'),
+            track.get('popularity'),
+            (track.get('album') or {}).get('name'),
+            clean_isrc((track.get('external_ids') or {}).get('isrc')),
+        )
+
+    @property
+    def artist(self):
+        return ', '.join(self.artists)
+
+    def as_dict(self):
+        """Legacy per-track response shape"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'artists': list(self.artists),
+            'artist': self.artist,
+            'album': self.album,
+            'duration_ms': self.duration_ms,
+            'preview_url': self.preview_url,
+            'external_urls': {'spotify': SPOTIFY_TRACK_URL + self.id} if self.id else {},
+            'popularity': self.popularity,
+            'isrc': self.isrc,
+        }
+
+    def __reduce__(self):
+        # Pickle as a plain tuple of values so cached playlists stay small;
+        # new fields go last so records cached before they existed still load
+        return (TrackRecord, (self.id, self.name, self.artists, self.duration_ms,
+                              self.preview_url, self.popularity, self.album, self.isrc))
+
+
+def to_columns(records):
+    """Columnar track payload: {"id": [...], "name": [...], ...}"""
+    return {column: [getattr(record, column) for record in records] for column in TRACK_COLUMNS}
+
+
+def to_rows(records):
+    return [record.as_dict() for record in records]
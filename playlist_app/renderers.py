@@ -0,0 +1,52 @@
+"""
+Fast JSON encoding for API responses
+Uses orjson when it is installed; without it everything falls back to the
+stdlib encoder, so behaviour only differs in speed.
+"""
+import json
+from django.http import HttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+_fallback_encoder = JSONEncoder()
+
+
+def dumps(data):
+    """Encode data as compact UTF-8 JSON bytes
+
+    Types orjson does not handle natively (Decimal, lazy strings, querysets)
+    go through DRF's encoder, as do datetimes so they keep DRF's format.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            data, default=_fallback_encoder.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+class FastJsonResponse(HttpResponse):
+    """JsonResponse counterpart encoded with dumps()"""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """DRF JSON renderer that encodes with orjson when available
+
+    Indented output (the browsable API, or ``; indent=`` in the Accept
+    header) and installs without orjson use DRF's own renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
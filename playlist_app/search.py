@@ -0,0 +1,147 @@
+"""
+Full-text search over stored tracks and playlists
+Backed by the index from migration 0005: FTS5 tables on SQLite and GIN
+tsvector indexes on PostgreSQL, both kept in sync by the database itself so
+bulk imports, refreshes and deletes need no extra work. Every word of a query
+must match as a prefix, and results are ranked with titles weighing most.
+Backends without an index fall back to LIKE.
+"""
+import re
+from functools import reduce
+from importlib import import_module
+from operator import or_
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Playlist, Track
+
+
+WORD_PATTERN = re.compile(r'\w+')
+# Words beyond this are ignored rather than making the query arbitrarily expensive
+MAX_TERMS = 8
+
+
+class SearchIndex:
+    """Searchable text columns of a model, most important first"""
+
+    def __init__(self, model, fields, weights):
+        self.model = model
+        self.fields = fields
+        # bm25 column weights on SQLite; PostgreSQL weighs the columns A, B, C
+        self.weights = weights
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def fts_table(self):
+        return f"{self.table}_fts"
+
+    @property
+    def vector(self):
+        """tsvector expression; must match the index in migration 0005"""
+        return ' || '.join(
+            f"setweight(to_tsvector('simple', {field}), '{label}')"
+            for field, label in zip(self.fields, 'ABCD')
+        )
+
+
+TRACK_INDEX = SearchIndex(Track, ('title', 'artist', 'album'), (10.0, 5.0, 1.0))
+PLAYLIST_INDEX = SearchIndex(Playlist, ('title', 'owner'), (10.0, 5.0))
+
+# Whether each SQLite database (by NAME) has the FTS5 tables; introspected once
+# and forgotten after every migrate, which may add or drop them
+_fts_databases = {}
+
+
+def index_backend():
+    """'fts5' or 'postgresql' when the search index exists, else None"""
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        name = connection.settings_dict['NAME']
+        if name not in _fts_databases:
+            _fts_databases[name] = TRACK_INDEX.fts_table in connection.introspection.table_names()
+        if _fts_databases[name]:
+            return 'fts5'
+    return None
+
+
+def reset_index_backend(**kwargs):
+    """post_migrate receiver: check for the FTS5 tables again on the next search"""
+    _fts_databases.clear()
+
+
+def search_terms(text):
+    return WORD_PATTERN.findall((text or '').lower())[:MAX_TERMS]
+
+
+def _match_sql(index, terms, backend):
+    """(SQL selecting matching primary keys, params, ORDER BY clause)"""
+    if backend == 'fts5':
+        # Quoted so words like AND/NOT/NEAR are never read as operators
+        query = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for weight in index.weights)
+        return (
+            f"SELECT rowid FROM {index.fts_table} WHERE {index.fts_table} MATCH %s",
+            [query],
+            f"bm25({index.fts_table}, {weights}), rowid",
+        )
+    query = ' & '.join(f"{term}:*" for term in terms)
+    return (
+        f"SELECT id FROM {index.table} WHERE {index.vector} @@ to_tsquery('simple', %s)",
+        [query],
+        f"ts_rank({index.vector}, to_tsquery('simple', %s)) DESC, id",
+    )
+
+
+def _like_filter(index, terms):
+    return reduce(lambda q, term: q & reduce(or_, (
+        Q(**{f"{field}__icontains": term}) for field in index.fields
+    )), terms, Q())
+
+
+def filter_queryset(queryset, index, text):
+    """queryset narrowed to rows matching text, unranked (used by the admin)"""
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+    backend = index_backend()
+    if backend is None:
+        return queryset.filter(_like_filter(index, terms))
+    sql, params, _ = _match_sql(index, terms, backend)
+    return queryset.filter(pk__in=RawSQL(sql, params))
+
+
+def search_objects(index, text, limit=20, queryset=None):
+    """Up to limit objects matching text, best match first"""
+    terms = search_terms(text)
+    if not terms:
+        return []
+    if queryset is None:
+        queryset = index.model.objects.all()
+    backend = index_backend()
+    if backend is None:
+        return list(queryset.filter(_like_filter(index, terms))[:limit])
+
+    sql, params, order_by = _match_sql(index, terms, backend)
+    if backend == 'postgresql':
+        params = params * 2  # the tsquery appears again in ts_rank
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} ORDER BY {order_by} LIMIT %s", params + [limit])
+        ids = [row[0] for row in cursor.fetchall()]
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def rebuild_index():
+    """Recreate the search index from the tables' current contents
+
+    Needed on SQLite after a migration that rebuilds the track or playlist
+    table, which drops the triggers that keep the index in sync.
+    """
+    migration = import_module('playlist_app.migrations.0005_search_index')
+    with connection.schema_editor() as schema_editor:
+        migration.drop_search_index(None, schema_editor)
+        migration.create_search_index(None, schema_editor)
@@ -11,10 +11,18 @@ class TrackSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'artist', 'album', 'duration_ms', 
             'duration_formatted', 'spotify_id', 'preview_url', 
-            'search_query', 'youtube_search_query'
+            'search_query', 'youtube_search_query', 'isrc', 'album_id', 'release_date'
         ]
 
 
+class TrackSearchSerializer(TrackSerializer):
+    """Track with the playlist it belongs to, for search results"""
+    playlist_title = serializers.CharField(source='playlist.title', read_only=True)
+    
+    class Meta(TrackSerializer.Meta):
+        fields = TrackSerializer.Meta.fields + ['playlist', 'playlist_title']
+
+
 class PlaylistSerializer(serializers.ModelSerializer):
     tracks = TrackSerializer(many=True, read_only=True)
     
@@ -27,6 +35,17 @@ class PlaylistSerializer(serializers.ModelSerializer):
         ]
 
 
+class PlaylistSummarySerializer(serializers.ModelSerializer):
+    """Playlist fields without the nested tracks, for streamed responses"""
+    
+    class Meta:
+        model = Playlist
+        fields = [
+            'id', 'spotify_url', 'spotify_id', 'title', 'owner', 
+            'total_tracks', 'is_public', 'created_at', 'updated_at'
+        ]
+
+
 class DownloadSessionSerializer(serializers.ModelSerializer):
     playlist_title = serializers.CharField(source='playlist.title', read_only=True)
     
@@ -35,5 +54,22 @@ class DownloadSessionSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'session_id', 'playlist', 'playlist_title',
             'tracks_processed', 'tracks_successful', 'tracks_failed',
-            'status', 'created_at', 'completed_at'
+            'tracks_deduplicated', 'bytes_saved',
+            'status', 'stage_timings', 'created_at', 'completed_at'
+        ]
+
+
+class DownloadProgressSerializer(serializers.ModelSerializer):
+    """Progress fields a client may send; counts are whole and non-negative, status one of the choices"""
+    
+    class Meta:
+        model = DownloadSession
+        fields = [
+            'tracks_processed', 'tracks_successful', 'tracks_failed',
+            'tracks_deduplicated', 'bytes_saved', 'status'
         ]
+        extra_kwargs = {
+            name: {'min_value': 0}
+            for name in ('tracks_processed', 'tracks_successful', 'tracks_failed',
+                         'tracks_deduplicated', 'bytes_saved')
+        }
@@ -0,0 +1,184 @@
+"""
+Spotify link routing
+Playlist, album, track and artist links (open.spotify.com URLs, with or
+without an intl-xx/ prefix, and spotify: URIs) all import as a Playlist of
+Tracks through the same import path. Albums come from the several-albums
+endpoint, 20 per request, and albums longer than the first page of tracks
+have the remaining pages fetched concurrently, so a whole discography is a
+handful of batched requests.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+from spotipy.exceptions import SpotifyException
+from .enrichment import get_batch_workers
+from .importer import iter_playlist_tracks
+from .metrics import REGISTRY, StageTimer
+
+
+# Most ids GET /v1/albums accepts per request
+SPOTIFY_ALBUMS_PER_REQUEST = 20
+# Largest page of GET /v1/albums/{id}/tracks and /v1/artists/{id}/albums
+ALBUM_TRACKS_PAGE = 50
+ARTIST_ALBUMS_PAGE = 50
+
+# Releases imported for an artist's discography
+DISCOGRAPHY_GROUPS = 'album,single'
+
+_LINK_PATTERN = re.compile(
+    r'(?:open\.spotify\.com/(?:intl-[\w-]+/)?(?:embed/)?|spotify:(?:user:[^:]+:)?)'
+    r'(playlist|album|track|artist)[/:]([A-Za-z0-9]+)'
+)
+_ID_PATTERN = re.compile(r'^[A-Za-z0-9]+$')
+
+
+def parse_spotify_url(url):
+    """(kind, spotify_id) for a Spotify link or URI, or None
+
+    ``kind`` is playlist, album, track or artist. A bare id is taken to be a
+    playlist id, as the playlist-only parser did.
+    """
+    url = (url or '').strip()
+    match = _LINK_PATTERN.search(url)
+    if match:
+        return match.group(1), match.group(2)
+    if _ID_PATTERN.match(url):
+        return 'playlist', url
+    return None
+
+
+def source_key(kind, spotify_id):
+    """Playlist.spotify_id for a source; playlists keep their bare id
+
+    ``kind`` may also be 'discography' (every album and single of an artist).
+    """
+    return spotify_id if kind == 'playlist' else f"{kind}:{spotify_id}"
+
+
+def _call(endpoint, method, *args, **kwargs):
+    REGISTRY.inc('spotify_requests_total', endpoint=endpoint)
+    return method(*args, **kwargs)
+
+
+def fetch_albums(sp, album_ids, workers=None):
+    """Album objects with every track, in the order given
+
+    Ids go to the several-albums endpoint 20 at a time; albums with more
+    tracks than the page embedded in that response get their other pages
+    from the album-tracks endpoint. Both rounds run concurrently. Unknown
+    ids are left out.
+    """
+    album_ids = list(dict.fromkeys(album_ids))
+    chunks = [
+        album_ids[i:i + SPOTIFY_ALBUMS_PER_REQUEST]
+        for i in range(0, len(album_ids), SPOTIFY_ALBUMS_PER_REQUEST)
+    ]
+    if not chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=workers or get_batch_workers()) as pool:
+        albums = [
+            album
+            for page in pool.map(lambda chunk: _call('albums', sp.albums, chunk)['albums'], chunks)
+            for album in page if album
+        ]
+        # Remaining track pages of long albums, e.g. compilations and box sets
+        pages = [
+            (album, offset)
+            for album in albums
+            for offset in range(len(album['tracks']['items']), album['tracks']['total'], ALBUM_TRACKS_PAGE)
+        ]
+        fetched = pool.map(lambda page: _call(
+            'album_tracks', sp.album_tracks, page[0]['id'], limit=ALBUM_TRACKS_PAGE, offset=page[1]
+        )['items'], pages)
+        for (album, _), items in zip(pages, fetched):
+            album['tracks']['items'].extend(items)
+    return albums
+
+
+def album_tracks(album):
+    """Track objects of a fetched album
+
+    Album pages hold simplified tracks without an album, so each gets one
+    (ISRCs are filled in afterwards by enrichment).
+    """
+    summary = {key: album.get(key) for key in ('id', 'name', 'release_date')}
+    return [
+        dict(track, album=summary)
+        for track in album['tracks']['items']
+        if track and track.get('type', 'track') == 'track'
+    ]
+
+
+def artist_album_ids(sp, artist_id):
+    """Ids of an artist's albums and singles, 50 per page"""
+    album_ids = []
+    results = _call('artist_albums', sp.artist_albums, artist_id,
+                    include_groups=DISCOGRAPHY_GROUPS, limit=ARTIST_ALBUMS_PAGE)
+    while results:
+        album_ids.extend(album['id'] for album in results['items'])
+        results = _call('next', sp.next, results) if results['next'] else None
+    return album_ids
+
+
+def _artists(item):
+    return ', '.join(artist['name'] for artist in item.get('artists') or [])
+
+
+def _not_found(kind, spotify_id):
+    return SpotifyException(404, -1, f"{kind} {spotify_id} not found")
+
+
+def fetch_source(sp, kind, spotify_id, timer=None):
+    """(info, track objects) for any supported source
+
+    ``info`` has name, description, owner, public and total_tracks, like a
+    playlist. Playlist tracks are yielded page by page; other sources are
+    fetched up front. Raises SpotifyException when Spotify doesn't know the id.
+    """
+    timer = timer or StageTimer()
+    if kind == 'playlist':
+        with timer.stage('spotify_fetch'):
+            playlist_info = sp.playlist(spotify_id)
+        info = {
+            'name': playlist_info['name'],
+            'description': playlist_info.get('description') or '',
+            'owner': playlist_info['owner']['display_name'],
+            'public': playlist_info.get('public', True),
+            'total_tracks': (playlist_info.get('tracks') or {}).get('total', 0),
+        }
+        return info, iter_playlist_tracks(sp, spotify_id, timer)
+
+    with timer.stage('spotify_fetch'):
+        if kind == 'album':
+            albums = fetch_albums(sp, [spotify_id])
+            if not albums:
+                raise _not_found(kind, spotify_id)
+            name, owner, description = albums[0]['name'], _artists(albums[0]), albums[0].get('label') or ''
+            tracks = album_tracks(albums[0])
+        elif kind == 'track':
+            track = _call('track', sp.track, spotify_id)
+            name, owner, description = track['name'], _artists(track), ''
+            tracks = [track]
+        elif kind == 'artist':
+            artist = _call('artist', sp.artist, spotify_id)
+            name, owner, description = f"{artist['name']}: top tracks", artist['name'], ''
+            tracks = _call('artist_top_tracks', sp.artist_top_tracks, spotify_id)['tracks']
+        elif kind == 'discography':
+            artist = _call('artist', sp.artist, spotify_id)
+            name, owner, description = f"{artist['name']}: discography", artist['name'], ''
+            tracks = [
+                track
+                for album in fetch_albums(sp, artist_album_ids(sp, spotify_id))
+                for track in album_tracks(album)
+            ]
+        else:
+            raise ValueError(f"Unsupported Spotify source: {kind}")
+
+    info = {
+        'name': name,
+        'description': description,
+        'owner': owner,
+        'public': True,
+        'total_tracks': len(tracks),
+    }
+    return info, tracks
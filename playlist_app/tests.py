@@ -1,8 +1,27 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
+from django.contrib.auth.models import User
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
+import hashlib
 import json
-from .models import Playlist, Track, DownloadSession
+import os
+import shutil
+import tempfile
+import threading
+import time
+from .models import Playlist, Track, DownloadSession, RequestLock
+from .metrics import REGISTRY, StageTimer
+from . import cache as playlist_cache
+from .coalesce import coalesce
+from .enrichment import SPOTIFY_TRACKS_PER_REQUEST, enrich_tracks, fetch_tracks
+from .importer import POSITION_STEP, build_track, upsert_tracks, import_tracks, refresh_tracks
+from .records import TrackRecord, to_columns
+from .search import TRACK_INDEX, search_objects
+from .sources import fetch_albums, parse_spotify_url
+from . import admission, matching, renderers
+from .audio_files import RangeNotSatisfiable, parse_range
+from .transcode import ffmpeg_command, transcode
 
 
 class PlaylistAppTestCase(TestCase):
@@ -151,6 +170,27 @@ class PlaylistAppTestCase(TestCase):
         self.assertEqual(session.tracks_processed, 1)
         self.assertEqual(session.tracks_successful, 1)
         self.assertEqual(session.status, 'processing')
+        
+    def test_update_download_progress_rejects_bad_values(self):
+        """Test that bad counts, unknown statuses and non-object bodies get 400 and change nothing"""
+        playlist = Playlist.objects.create(**self.playlist_data)
+        session = DownloadSession.objects.create(playlist=playlist, session_id='test-session-456')
+        url = reverse('update_download_progress', kwargs={'session_id': session.session_id})
+        
+        for body in ({'tracks_processed': 'many'}, {'tracks_failed': -1}, {'status': 'exploded'},
+                     {'bytes_saved': 1.5}, [1, 2]):
+            with self.subTest(body=body):
+                response = self.client.post(url, data=json.dumps(body), content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        
+        session.refresh_from_db()
+        self.assertEqual((session.tracks_processed, session.tracks_failed, session.status), (0, 0, 'pending'))
+        response = self.client.post(url, data=json.dumps({'tracks_processed': '3', 'status': 'completed'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        session.refresh_from_db()
+        self.assertEqual(session.tracks_processed, 3)
+        self.assertIsNotNone(session.completed_at)
 
 
 class ModelTestCase(TestCase):
@@ -193,3 +233,1602 @@ class ModelTestCase(TestCase):
         self.assertEqual(str(session), 'Download session for Test Playlist')
         self.assertEqual(session.status, 'pending')
         self.assertEqual(session.tracks_processed, 0)
+
+
+class MetricsTestCase(TestCase):
+    
+    def setUp(self):
+        REGISTRY.reset()
+        
+    def test_stage_timer_records_spans(self):
+        """Test that stage spans land in the registry and the summary"""
+        timer = StageTimer()
+        with timer.stage('encode') as span:
+            span.bytes = 1024
+        timer.start('yt_download')
+        timer.stop('yt_download', 2048)
+        
+        summary = timer.summary()
+        self.assertEqual(summary['encode']['bytes'], 1024)
+        self.assertEqual(summary['yt_download']['bytes'], 2048)
+        self.assertIn('encode;dur=', timer.server_timing())
+        self.assertEqual(REGISTRY.get('pipeline_stage_bytes_total', stage='encode'), 1024)
+        
+    def test_metrics_endpoint(self):
+        """Test the Prometheus scrape endpoint"""
+        timer = StageTimer()
+        with timer.stage('yt_search'):
+            pass
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE pipeline_stage_seconds histogram', body)
+        self.assertIn('pipeline_stage_seconds_count{stage="yt_search"} 1', body)
+        self.assertIn('pipeline_stage_seconds_bucket{stage="yt_search",le="+Inf"} 1', body)
+        
+    def test_session_stage_aggregates(self):
+        """Test that per-track timings are folded into the session"""
+        playlist = Playlist.objects.create(
+            spotify_url='https://open.spotify.com/playlist/test123',
+            spotify_id='test123',
+            title='Test Playlist',
+            owner='Test User'
+        )
+        DownloadSession.objects.create(playlist=playlist, session_id='timed-session')
+        
+        for _ in range(2):
+            DownloadSession.record_stage_timings('timed-session', {
+                'yt_download': {'seconds': 1.5, 'bytes': 1000},
+            })
+        
+        session = DownloadSession.objects.get(session_id='timed-session')
+        self.assertEqual(session.stage_timings['yt_download']['count'], 2)
+        self.assertEqual(session.stage_timings['yt_download']['bytes'], 2000)
+        self.assertAlmostEqual(session.stage_timings['yt_download']['seconds'], 3.0)
+
+
+class ProfilingTestCase(TestCase):
+    
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        
+    def profiling_settings(self, **overrides):
+        options = {
+            'PROFILING_ENABLED': True,
+            'PROFILING_TOKEN': 'secret',
+            'PROFILING_DIR': self.profile_dir.name,
+            'PROFILING_MAX_FILES': 2,
+        }
+        options.update(overrides)
+        return override_settings(**options)
+        
+    def test_header_triggers_profile_with_rotation(self):
+        """Test that the token header profiles a request and old profiles rotate out"""
+        with self.profiling_settings():
+            client = Client()
+            for _ in range(3):
+                response = client.get('/metrics', HTTP_X_PROFILE='secret')
+                self.assertIn('X-Profile-Id', response)
+            
+            untriggered = client.get('/metrics', HTTP_X_PROFILE='wrong')
+            self.assertNotIn('X-Profile-Id', untriggered)
+            
+            staff = User.objects.create_user('ops', password='pw', is_staff=True)
+            client.force_login(staff)
+            listing = client.get(reverse('list_profiles')).json()['profiles']
+            self.assertEqual(len(listing), 2)
+            
+            summary = client.get(reverse('get_profile', kwargs={'name': listing[0]['name']}), {'format': 'text'})
+            self.assertEqual(summary.status_code, 200)
+            self.assertIn(b'function calls', summary.content)
+            
+    def test_profiles_listing_requires_staff(self):
+        """Test that anonymous users can't see profiles"""
+        with self.profiling_settings():
+            response = Client().get(reverse('list_profiles'))
+            self.assertEqual(response.status_code, 302)
+            
+    def test_disabled_middleware_is_inert(self):
+        """Test that nothing is profiled when profiling is disabled"""
+        with self.profiling_settings(PROFILING_ENABLED=False):
+            response = Client().get('/metrics', HTTP_X_PROFILE='secret')
+            self.assertNotIn('X-Profile-Id', response)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'playlist_app.cache.TieredCache',
+        'OPTIONS': {'SHARED_ALIAS': 'shared', 'LOCAL_MAX_ENTRIES': 2},
+    },
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+})
+class CacheTestCase(TestCase):
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        REGISTRY.reset()
+        
+    def test_tiered_cache_falls_back_to_shared(self):
+        """Test that values evicted from the local LRU are still served by the shared tier"""
+        from django.core.cache import cache
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key.upper())
+        
+        self.assertEqual(len(cache.local), 2)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(REGISTRY.get('cache_tier_hits_total', tier='shared'), 1)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(REGISTRY.get('cache_tier_hits_total', tier='local'), 1)
+        
+    def test_get_or_compute_single_flight(self):
+        """Test that concurrent misses for one key compute once and count hits/misses"""
+        calls = []
+        
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'name': 'Viral Playlist'}
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                playlist_cache.get_playlist_metadata('viral', slow_fetch)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'name': 'Viral Playlist'}] * 5)
+        
+        playlist_cache.get_playlist_metadata('viral', slow_fetch)
+        self.assertEqual(REGISTRY.get('cache_requests_total', namespace='playlist', result='hit'), 1)
+        
+    def test_none_results_are_not_cached(self):
+        """Test that failed lookups are retried"""
+        self.assertIsNone(playlist_cache.resolve_youtube('missing song', lambda: None))
+        self.assertEqual(playlist_cache.resolve_youtube('missing song', lambda: 'url'), 'url')
+
+
+class CoalescingTestCase(TestCase):
+    
+    def setUp(self):
+        audio_cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, audio_cache, ignore_errors=True)
+        self.enterContext(override_settings(AUDIO_CACHE_DIR=audio_cache))
+        
+    def test_concurrent_audio_requests_share_one_download(self):
+        """Test that identical concurrent audio requests run yt-dlp once"""
+        calls = []
+        
+        def slow_download(search_query, quality='192', timer=None, **options):
+            calls.append(search_query)
+            time.sleep(0.2)
+            return b'mp3-bytes'
+        
+        statuses = []
+        
+        def request_audio():
+            response = Client().post(
+                reverse('api:audio_api'),
+                data=json.dumps({'query': 'Artist Song', 'quality': '192'}),
+                content_type='application/json'
+            )
+            statuses.append(response.status_code)
+        
+        with patch('playlist_app.api_views.download_audio', side_effect=slow_download):
+            threads = [threading.Thread(target=request_audio) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(statuses, [200] * 4)
+        self.assertEqual(len(calls), 1)
+        
+    @patch('playlist_app.views.spotipy.Spotify')
+    def test_concurrent_import_does_not_raise_integrity_error(self, mock_spotify):
+        """Test that losing the race to create a playlist returns the winner's row"""
+        mock_sp = MagicMock()
+        mock_spotify.return_value = mock_sp
+        
+        def playlist_created_elsewhere(playlist_id):
+            # Another worker finishes its import while we are talking to Spotify
+            Playlist.objects.create(
+                spotify_url='https://open.spotify.com/playlist/race123',
+                spotify_id='race123',
+                title='Raced Playlist',
+                owner='Someone Else'
+            )
+            return {'name': 'Raced Playlist', 'owner': {'display_name': 'Someone Else'},
+                    'tracks': {'total': 0}, 'public': True}
+        
+        mock_sp.playlist.side_effect = playlist_created_elsewhere
+        mock_sp.playlist_tracks.return_value = {'items': [], 'next': None}
+        
+        response = self.client.post(
+            reverse('get_playlist_tracks'),
+            data=json.dumps({'playlist_url': 'https://open.spotify.com/playlist/race123'}),
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Playlist.objects.filter(spotify_id='race123').count(), 1)
+        
+    @override_settings(COALESCE_ACROSS_PROCESSES=True, COALESCE_WAIT_TIMEOUT=1)
+    def test_lock_table_reclaims_stale_locks(self):
+        """Test that an expired lock row from a dead worker doesn't block the key"""
+        from django.utils import timezone
+        from datetime import timedelta
+        RequestLock.objects.create(
+            key='playlist:stale', owner='dead-worker',
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        
+        self.assertEqual(coalesce('playlist:stale', lambda: 'imported'), 'imported')
+        self.assertFalse(RequestLock.objects.filter(key='playlist:stale').exists())
+
+
+class ImporterTestCase(TestCase):
+    
+    def setUp(self):
+        self.playlist = Playlist.objects.create(
+            spotify_url='https://open.spotify.com/playlist/upsert123',
+            spotify_id='upsert123',
+            title='Upsert Playlist',
+            owner='Test User'
+        )
+        
+    def make_track(self, position, name):
+        return build_track({
+            'id': f'track{position}',
+            'name': name,
+            'artists': [{'name': 'Artist'}],
+            'album': {'name': 'Album'},
+            'duration_ms': 180000,
+        }, position)
+        
+    def test_upsert_updates_existing_positions(self):
+        """Test that re-importing updates rows in place instead of duplicating them"""
+        upsert_tracks(self.playlist, [self.make_track(0, 'Old'), self.make_track(1, 'Song')])
+        upsert_tracks(self.playlist, [self.make_track(0, 'New'), self.make_track(1, 'Song')])
+        
+        titles = list(self.playlist.tracks.values_list('title', flat=True))
+        self.assertEqual(titles, ['New', 'Song'])
+        self.assertEqual(self.playlist.tracks.first().youtube_search_query, 'Artist New')
+
+
+class ChunkedImportTestCase(TestCase):
+    
+    def page(self, start, count, has_next):
+        return {
+            'items': [
+                {'track': {
+                    'type': 'track',
+                    'id': f'track{i}',
+                    'name': f'Song {i}',
+                    'artists': [{'name': 'Artist'}],
+                    'album': {'name': 'Album'},
+                    'duration_ms': 180000,
+                    'preview_url': None
+                }}
+                for i in range(start, start + count)
+            ] + [{'track': None}],
+            'next': 'next-page' if has_next else None
+        }
+        
+    @override_settings(PLAYLIST_IMPORT_BATCH_SIZE=2, PLAYLIST_STREAM_THRESHOLD=3)
+    @patch('playlist_app.views.spotipy.Spotify')
+    def test_large_playlist_is_imported_in_batches_and_streamed(self, mock_spotify):
+        """Test batched upserts across pages and the streamed response"""
+        mock_sp = MagicMock()
+        mock_spotify.return_value = mock_sp
+        mock_sp.playlist.return_value = {
+            'name': 'Big Playlist',
+            'owner': {'display_name': 'Test User'},
+            'tracks': {'total': 5},
+            'public': True
+        }
+        mock_sp.playlist_tracks.return_value = self.page(0, 3, has_next=True)
+        mock_sp.next.return_value = self.page(3, 2, has_next=False)
+        
+        with patch('playlist_app.importer.upsert_tracks', wraps=upsert_tracks) as upsert:
+            response = self.client.post(
+                reverse('get_playlist_tracks'),
+                data=json.dumps({'playlist_url': 'https://open.spotify.com/playlist/big123'}),
+                content_type='application/json'
+            )
+        
+        self.assertEqual(upsert.call_count, 3)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['playlist']['total_tracks'], 5)
+        self.assertNotIn('tracks', data['playlist'])
+        self.assertEqual([t['title'] for t in data['tracks']], [f'Song {i}' for i in range(5)])
+        
+    @override_settings(PLAYLIST_IMPORT_BATCH_SIZE=2)
+    @patch('playlist_app.views.spotipy.Spotify')
+    def test_import_holds_no_transaction_across_spotify_pages(self, mock_spotify):
+        """Test that batches commit between page fetches and an interrupted import is redone"""
+        from django.db import connection
+        from django.utils import timezone
+        mock_sp = MagicMock()
+        mock_spotify.return_value = mock_sp
+        mock_sp.playlist.return_value = {
+            'name': 'Big Playlist',
+            'owner': {'display_name': 'Test User'},
+            'tracks': {'total': 5},
+            'public': True
+        }
+        mock_sp.playlist_tracks.return_value = self.page(0, 3, has_next=True)
+        # The test case's own atomic blocks are open throughout
+        outer = len(connection.savepoint_ids)
+        open_during_fetch = []
+        
+        def next_page(results):
+            open_during_fetch.append(len(connection.savepoint_ids) - outer)
+            return self.page(3, 2, has_next=False)
+        
+        mock_sp.next.side_effect = next_page
+        # An earlier import of a longer list died before its last batch
+        stale = Playlist.objects.create(
+            spotify_url='https://open.spotify.com/playlist/big123',
+            spotify_id='big123',
+            title='Big Playlist',
+            owner='Test User',
+            import_started_at=timezone.now()
+        )
+        Track.objects.create(playlist=stale, spotify_id='old', title='Old', artist='Artist',
+                             position=9 * POSITION_STEP)
+        
+        response = self.client.post(
+            reverse('get_playlist_tracks'),
+            data=json.dumps({'playlist_url': 'https://open.spotify.com/playlist/big123'}),
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(open_during_fetch, [0])
+        stale.refresh_from_db()
+        self.assertIsNone(stale.import_started_at)
+        self.assertEqual(stale.total_tracks, 5)
+        self.assertEqual(list(stale.tracks.values_list('title', flat=True)), [f'Song {i}' for i in range(5)])
+
+
+class PlaylistRefreshTestCase(TestCase):
+    
+    def setUp(self):
+        self.playlist = Playlist.objects.create(
+            spotify_url='https://open.spotify.com/playlist/refresh123',
+            spotify_id='refresh123',
+            title='Refresh Playlist',
+            owner='Test User'
+        )
+        
+    def track_info(self, track_id):
+        return {
+            'id': track_id,
+            'name': f'Song {track_id}',
+            'artists': [{'name': 'Artist'}],
+            'album': {'name': 'Album'},
+            'duration_ms': 180000,
+        }
+        
+    def stored_ids(self):
+        return list(self.playlist.tracks.values_list('spotify_id', flat=True))
+        
+    def test_refresh_applies_only_the_diff(self):
+        """Test that inserts, deletes and moves touch only the changed rows"""
+        import_tracks(self.playlist, [self.track_info(t) for t in 'abcdef'])
+        pks = dict(self.playlist.tracks.values_list('spotify_id', 'pk'))
+        
+        # drop "c", insert "x" after "a", move "f" to the front
+        changes = refresh_tracks(self.playlist, [self.track_info(t) for t in 'faxbde'])
+        
+        self.assertEqual(changes, {'inserted': 1, 'deleted': 1, 'moved': 1, 'unchanged': 4})
+        self.assertEqual(self.stored_ids(), list('faxbde'))
+        self.assertEqual(pks['f'], self.playlist.tracks.get(spotify_id='f').pk)
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.total_tracks, 6)
+        
+    def test_refresh_large_playlist_with_few_changes(self):
+        """Test that a handful of changes in a long playlist stays a handful of writes"""
+        ids = [f't{i}' for i in range(2000)]
+        import_tracks(self.playlist, [self.track_info(t) for t in ids])
+        
+        updated = ids[:]
+        for i in range(5):
+            updated.insert(100 * (i + 1), f'new{i}')
+        del updated[1500:1505]
+        
+        changes = refresh_tracks(self.playlist, [self.track_info(t) for t in updated])
+        self.assertEqual(changes['inserted'] + changes['deleted'] + changes['moved'], 10)
+        self.assertEqual(self.stored_ids(), updated)
+        
+    def test_refresh_renumbers_when_gaps_run_out(self):
+        """Test that densely numbered playlists (pre-stride imports) still refresh correctly"""
+        upsert_tracks(self.playlist, [build_track(self.track_info(t), i) for i, t in enumerate('abc')])
+        
+        refresh_tracks(self.playlist, [self.track_info(t) for t in 'axbc'])
+        self.assertEqual(self.stored_ids(), list('axbc'))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'records'},
+})
+class CompactTrackTestCase(TestCase):
+    
+    def spotify_track(self, i):
+        return {
+            'type': 'track',
+            'id': f'track{i}',
+            'name': f'Song {i}',
+            'artists': [{'name': 'Artist'}, {'name': 'Guest'}],
+            'album': {'name': 'Album'},
+            'duration_ms': 180000 + i,
+            'preview_url': None,
+            'popularity': 50,
+            'external_urls': {'spotify': f'https://open.spotify.com/track/track{i}'},
+        }
+        
+    def test_track_record_round_trips_through_cache(self):
+        """Test that records pickle as plain tuples and keep the legacy dict shape"""
+        import pickle
+        record = TrackRecord.from_spotify(self.spotify_track(1))
+        restored = pickle.loads(pickle.dumps(record))
+        
+        self.assertEqual(restored.as_dict(), record.as_dict())
+        self.assertEqual(record.as_dict()['artist'], 'Artist, Guest')
+        self.assertEqual(record.as_dict()['external_urls'], self.spotify_track(1)['external_urls'])
+        self.assertFalse(hasattr(record, '__dict__'))
+        
+    def test_columns_are_parallel_arrays(self):
+        """Test that the columnar shape has one equally long array per field"""
+        columns = to_columns([TrackRecord.from_spotify(self.spotify_track(i)) for i in range(3)])
+        self.assertEqual(columns['id'], ['track0', 'track1', 'track2'])
+        self.assertEqual(columns['duration_ms'], [180000, 180001, 180002])
+        self.assertEqual({len(values) for values in columns.values()}, {3})
+        
+    def test_isrcs_are_canonical(self):
+        """Test that both track record builders store ISRCs the way enrichment does"""
+        from api.download.playlist import TrackRecord as ServerlessTrackRecord
+        for raw, expected in (('usrc1-76-07839', 'USRC17607839'), ('not an isrc', None)):
+            track = dict(self.spotify_track(1), external_ids={'isrc': raw})
+            with self.subTest(raw=raw):
+                self.assertEqual(TrackRecord.from_spotify(track).isrc, expected)
+                self.assertEqual(ServerlessTrackRecord(track).isrc, expected)
+        
+    @patch('playlist_app.api_views.spotipy.Spotify')
+    def test_playlist_api_columnar_response(self, mock_spotify):
+        """Test that format=columnar returns the compact shape and rows stay the default"""
+        mock_spotify.return_value.playlist.return_value = {
+            'id': 'cols', 'name': 'Columns', 'description': '', 'owner': {'display_name': 'Owner'}, 'public': True,
+        }
+        mock_spotify.return_value.playlist_tracks.return_value = {
+            'items': [{'track': self.spotify_track(i)} for i in range(2)], 'next': None,
+        }
+        url = '/api/download/playlist/'
+        body = {'playlist_url': 'https://open.spotify.com/playlist/cols'}
+        
+        columnar = self.client.post(url, json.dumps(dict(body, format='columnar')), content_type='application/json').json()
+        rows = self.client.post(url, json.dumps(body), content_type='application/json').json()
+        
+        self.assertEqual(columnar['track_format'], 'columnar')
+        self.assertEqual(columnar['tracks']['name'], ['Song 0', 'Song 1'])
+        self.assertEqual(rows['tracks'][1]['artists'], ['Artist', 'Guest'])
+        self.assertNotIn('track_format', rows)
+
+
+class FastJSONTestCase(TestCase):
+    
+    def payload(self):
+        from decimal import Decimal
+        from django.utils import timezone
+        return {'name': 'Café \u2603', 'when': timezone.now(), 'price': Decimal('1.50'), 'tracks': [1, None, True]}
+        
+    def test_dumps_matches_stdlib_with_and_without_orjson(self):
+        """Test that both encoder backends produce the same document"""
+        from rest_framework.utils.encoders import JSONEncoder
+        data = self.payload()
+        expected = json.loads(json.dumps(data, cls=JSONEncoder))
+        
+        self.assertEqual(json.loads(renderers.dumps(data)), expected)
+        with patch.object(renderers, 'orjson', None):
+            self.assertEqual(json.loads(renderers.dumps(data)), expected)
+            
+    def test_renderer_keeps_indented_output(self):
+        """Test that an indent request still gets pretty-printed JSON"""
+        renderer = renderers.FastJSONRenderer()
+        self.assertEqual(renderer.render(None), b'')
+        self.assertIn(b'\n    ', renderer.render({'a': 1}, 'application/json; indent=4'))
+        self.assertEqual(json.loads(renderer.render({'a': [1, 2]})), {'a': [1, 2]})
+
+
+class FakeSocket:
+    """Just enough of a socket to run a BaseHTTPRequestHandler over bytes"""
+    
+    def __init__(self, raw_request):
+        import io
+        self.rfile = io.BytesIO(raw_request)
+        self.sent = b''
+        
+    def settimeout(self, timeout):
+        pass
+        
+    def makefile(self, mode, *args, **kwargs):
+        return self.rfile
+        
+    def sendall(self, data):
+        self.sent += data
+
+
+class ServerlessHandlerTestCase(TestCase):
+    
+    def request(self, body=b'', headers=None):
+        from api._shared.handler import JSONHandler
+        
+        class EchoHandler(JSONHandler):
+            def handle_json(self, data):
+                self.send_json_response({'success': True, 'echo': data})
+                
+            def log_message(self, *args):
+                pass
+                
+        head = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+        sock = FakeSocket(f'POST /api/download/playlist HTTP/1.1\r\n{head}\r\n'.encode() + body)
+        EchoHandler(sock, ('127.0.0.1', 0), None)
+        status_line, _, payload = sock.sent.partition(b'\r\n\r\n')
+        return int(status_line.split()[1]), json.loads(payload)
+        
+    def test_valid_body_is_parsed(self):
+        """Test that a JSON object body reaches handle_json"""
+        body = json.dumps({'playlist_url': 'abc'}).encode()
+        status, data = self.request(body, {'Content-Length': len(body)})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['echo'], {'playlist_url': 'abc'})
+        
+    def test_malformed_requests_are_rejected_early(self):
+        """Test that missing, bad, oversized and truncated bodies get 4xx responses"""
+        cases = [
+            ({}, b'', 411),
+            ({'Content-Length': 'abc'}, b'', 400),
+            ({'Content-Length': 10 ** 9}, b'', 413),
+            ({'Content-Length': 100}, b'{"short": 1}', 400),
+            ({'Content-Length': 3}, b'[1]', 400),
+            ({'Content-Length': 4}, b'nope', 400),
+            ({'Transfer-Encoding': 'chunked'}, b'', 411),
+        ]
+        for headers, body, expected in cases:
+            with self.subTest(headers=headers, body=body):
+                status, data = self.request(body, headers)
+                self.assertEqual(status, expected)
+                self.assertFalse(data['success'])
+                
+    def test_shared_formats_match_the_django_app(self):
+        """Test that the serverless quality and codec tables stay in step with playlist_app.formats"""
+        from api._shared.formats import QUALITIES, SOURCE_CODECS, audio_format
+        from playlist_app import formats
+        self.assertEqual(QUALITIES, formats.QUALITIES)
+        for codec, efficiency in SOURCE_CODECS:
+            self.assertEqual(formats.CODEC_EFFICIENCY[codec], efficiency)
+        self.assertTrue(audio_format('128').startswith('worstaudio[acodec^=opus][abr>=62]'))
+        
+    def test_forwarded_for_trusted_only_when_configured(self):
+        """Test that X-Forwarded-For is ignored unless trusted, and then only its last hop counts"""
+        from http.client import HTTPMessage
+        from api._shared.handler import JSONHandler
+        handler = JSONHandler.__new__(JSONHandler)
+        handler.client_address = ('10.0.0.1', 0)
+        handler.headers = HTTPMessage()
+        handler.headers['X-Forwarded-For'] = '6.6.6.6, 203.0.113.7'
+        
+        self.assertEqual(handler.client_ip(), '10.0.0.1')
+        handler.trust_x_forwarded_for = True
+        self.assertEqual(handler.client_ip(), '203.0.113.7')
+        
+        from django.test import RequestFactory
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7')
+        self.assertEqual(admission.client_ip(request), '10.0.0.1')
+        with override_settings(TRUST_X_FORWARDED_FOR=True):
+            self.assertEqual(admission.client_ip(request), '203.0.113.7')
+
+
+class AdmissionControlTestCase(TestCase):
+    
+    def setUp(self):
+        REGISTRY.reset()
+        admission._audio_limiter = None
+        admission._transcode_gate = None
+        audio_cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, audio_cache, ignore_errors=True)
+        self.enterContext(override_settings(AUDIO_CACHE_DIR=audio_cache))
+        
+    def tearDown(self):
+        admission._audio_limiter = None
+        admission._transcode_gate = None
+        
+    def test_rate_limiter_allows_burst_then_rejects(self):
+        """Test that a client gets its burst and is then told when to retry"""
+        limiter = admission.RateLimiter('test', rate=0.5, burst=2)
+        limiter.take('1.2.3.4')
+        limiter.take('1.2.3.4')
+        with self.assertRaises(admission.AdmissionRejected) as rejected:
+            limiter.take('1.2.3.4')
+        self.assertEqual(rejected.exception.retry_after, 2)
+        limiter.take('5.6.7.8')
+        
+    def test_gate_queues_then_rejects_when_full(self):
+        """Test that callers beyond slots + queue are rejected instead of waiting"""
+        gate = admission.AdmissionGate('test', slots=1, max_queue=1, queue_timeout=5)
+        release = threading.Event()
+        results = []
+        holder = threading.Thread(target=lambda: results.append(gate.run(lambda: release.wait(5) and 'held')))
+        holder.start()
+        while gate.active < 1:
+            time.sleep(0.01)
+        queued = threading.Thread(target=lambda: results.append(gate.run(lambda: 'queued')))
+        queued.start()
+        while gate.waiting < 1:
+            time.sleep(0.01)
+        
+        with self.assertRaises(admission.AdmissionRejected) as rejected:
+            gate.run(lambda: 'rejected')
+        self.assertEqual(rejected.exception.reason, 'queue_full')
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        
+        release.set()
+        holder.join()
+        queued.join()
+        self.assertEqual(sorted(results), ['held', 'queued'])
+        self.assertEqual(REGISTRY.get('admission_rejected_total', gate='test', reason='queue_full'), 1)
+        
+    def test_gate_times_out_queued_callers(self):
+        """Test that a queued caller gives up after queue_timeout"""
+        gate = admission.AdmissionGate('test', slots=1, max_queue=1, queue_timeout=0.05)
+        release = threading.Event()
+        holder = threading.Thread(target=lambda: gate.run(lambda: release.wait(5)))
+        holder.start()
+        while gate.active < 1:
+            time.sleep(0.01)
+        try:
+            with self.assertRaises(admission.AdmissionRejected) as rejected:
+                gate.run(lambda: None)
+            self.assertEqual(rejected.exception.reason, 'queue_timeout')
+            self.assertEqual(gate.waiting, 0)
+        finally:
+            release.set()
+            holder.join()
+        
+    @override_settings(AUDIO_RATE_BURST=1, AUDIO_RATE_PER_MINUTE=1)
+    def test_audio_api_returns_429_with_retry_after(self):
+        """Test that a client over its quota gets 429 and a Retry-After header"""
+        body = json.dumps({'query': 'artist song'})
+        with patch('playlist_app.api_views.download_audio', return_value=b'audio'):
+            first = self.client.post('/api/download/audio/', body, content_type='application/json')
+            second = self.client.post('/api/download/audio/', body, content_type='application/json')
+        
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second['Retry-After'], '60')
+        self.assertEqual(second.json()['reason'], 'rate_limited')
+
+    def test_api_throttles_count_in_the_shared_cache(self):
+        """Test that DRF throttle history skips the per-process tier, so every worker sees it"""
+        from django.core.cache import caches
+        from django.test import RequestFactory
+        from playlist_app.throttling import SharedAnonRateThrottle
+        throttle = SharedAnonRateThrottle()
+        request = RequestFactory().get('/api/', REMOTE_ADDR='198.51.100.9')
+        request.user = MagicMock(is_authenticated=False)
+        key = throttle.get_cache_key(request, None)
+        self.addCleanup(caches['shared'].delete, key)
+        
+        self.assertIs(throttle.cache, caches['shared'])
+        self.assertTrue(throttle.allow_request(request, None))
+        self.assertEqual(len(caches['shared'].get(key)), 1)
+        self.assertNotIn(caches['default'].make_and_validate_key(key), caches['default'].local._data)
+        
+    @override_settings(TRANSCODE_WORKERS=1, TRANSCODE_QUEUE_TIMEOUT=0.05)
+    def test_only_the_encode_takes_a_transcode_slot(self):
+        """Test that search and download run outside the gate and a full gate still answers 429"""
+        from playlist_app.api_views import download_audio
+        gate = admission.get_transcode_gate()
+        slots_taken = {}
+
+        def fake_download(ydl, video_url, source_dir, timer):
+            slots_taken['download'] = gate.active
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, 'audio.webm'), 'wb') as f:
+                f.write(b'opus')
+            formats = [{'format_id': '251', 'acodec': 'opus', 'vcodec': 'none', 'abr': 135}]
+            return dict(formats[0], formats=formats)
+
+        def fake_ffmpeg(source, output, quality, *args):
+            slots_taken['transcode'] = gate.active
+            with open(output, 'wb') as f:
+                f.write(b'mp3')
+            return 3
+
+        with patch('playlist_app.api_views.resolve_youtube', return_value='https://www.youtube.com/watch?v=abcdefghijk'), \
+             patch('playlist_app.api_views.download_source', side_effect=fake_download), \
+             patch('playlist_app.transcode.ffmpeg_to_mp3', side_effect=fake_ffmpeg):
+            self.assertEqual(download_audio('Band Song', '128'), b'mp3')
+            self.assertEqual(slots_taken, {'download': 0, 'transcode': 1})
+
+            gate.active = 1
+            try:
+                with self.assertRaises(admission.AdmissionRejected):
+                    download_audio('Band Song', '320')
+            finally:
+                gate.active = 0
+
+
+class TranscodeTestCase(TestCase):
+    
+    def setUp(self):
+        admission._transcode_gate = None
+        self.addCleanup(setattr, admission, '_transcode_gate', None)
+        
+    @override_settings(TRANSCODE_WORKERS=1)
+    def test_queue_wait_is_reported_separately(self):
+        """Test that an encode waiting for the only slot reports its wait apart from its run time"""
+        def slow_encode(*args):
+            time.sleep(0.3)
+            return 0
+        
+        timers = [StageTimer() for _ in range(2)]
+        with patch('playlist_app.transcode.ffmpeg_to_mp3', side_effect=slow_encode):
+            threads = [threading.Thread(target=transcode, args=('in.webm', 'out.mp3', '128'), kwargs={'timer': timer})
+                       for timer in timers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        waits = sorted(timer.summary()['transcode_queue']['seconds'] for timer in timers)
+        self.assertLess(waits[0], 0.1)
+        self.assertGreater(waits[1], 0.2)
+        self.assertTrue(all(0.25 < timer.summary()['transcode']['seconds'] < 1 for timer in timers))
+        
+    @skipUnless(shutil.which('ffmpeg'), 'ffmpeg not installed')
+    def test_transcode_records_queue_and_encode_stages(self):
+        """Test a real encode"""
+        import os
+        import subprocess
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, 'tone.wav')
+            subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration=1', source], check=True)
+            timer = StageTimer()
+            size = transcode(source, os.path.join(temp_dir, 'tone.mp3'), '128', timer=timer)
+        
+        self.assertGreater(size, 0)
+        self.assertEqual(set(timer.summary()), {'transcode_queue', 'transcode'})
+
+
+class AudioProcessingTestCase(TestCase):
+    
+    def test_tags_and_loudnorm_share_one_ffmpeg_command(self):
+        """Test that normalization and ID3 tags are options of the single encode"""
+        command = ffmpeg_command('ffmpeg', 'in.webm', 'out.mp3', '192',
+                                 metadata={'title': 'Song', 'artist': 'Artist', 'album': None},
+                                 loudnorm='loudnorm=I=-16')
+        
+        self.assertEqual(command.count('-i'), 1)
+        self.assertEqual(command[command.index('-af') + 1], 'loudnorm=I=-16')
+        self.assertIn('title=Song', command)
+        self.assertIn('artist=Artist', command)
+        self.assertNotIn('album=None', command)
+        self.assertEqual(command[-1], 'out.mp3')
+        
+    def test_plain_encode_has_no_filter_or_tags(self):
+        command = ffmpeg_command('ffmpeg', 'in.webm', 'out.mp3', '128')
+        self.assertNotIn('-af', command)
+        self.assertNotIn('-metadata', command)
+        
+    def test_audio_tags_prefer_stored_track(self):
+        """Test that a known track_id tags from the database, else from the request"""
+        from .api_views import audio_tags
+        playlist = Playlist.objects.create(spotify_url='u', spotify_id='p', title='P', owner='o')
+        Track.objects.create(playlist=playlist, title='Stored', artist='Stored Artist',
+                             album='Stored Album', spotify_id='t1')
+        
+        self.assertEqual(audio_tags({'track_id': 't1', 'title': 'Other'}),
+                         {'title': 'Stored', 'artist': 'Stored Artist', 'album': 'Stored Album'})
+        self.assertEqual(audio_tags({'track_id': 'missing', 'title': 'Sent'}), {'title': 'Sent'})
+        self.assertIsNone(audio_tags({'title': 'Sent', 'tags': False}))
+
+
+class AudioFileTestCase(TestCase):
+    
+    def setUp(self):
+        admission._audio_limiter = None
+        audio_cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, audio_cache, ignore_errors=True)
+        self.enterContext(override_settings(AUDIO_CACHE_DIR=audio_cache))
+        
+    def tearDown(self):
+        admission._audio_limiter = None
+        
+    def request_file(self):
+        with patch('playlist_app.api_views.download_audio', return_value=b'0123456789') as download:
+            response = self.client.post('/api/download/audio/', json.dumps({'query': 'Artist Song', 'delivery': 'file'}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), download
+        
+    def test_client_query_cannot_overwrite_an_isrc_entry(self):
+        """Test that only the server-built query of a stored track is cached under its ISRC"""
+        playlist = Playlist.objects.create(spotify_id='p', title='P', owner='o', total_tracks=1)
+        Track.objects.create(playlist=playlist, spotify_id='hit', title='Song', artist='Band', isrc='USABC1234567')
+        
+        def post(**data):
+            with patch('playlist_app.api_views.download_audio', return_value=b'mp3') as download:
+                response = self.client.post('/api/download/audio/', json.dumps(dict(data, delivery='file')),
+                                            content_type='application/json')
+            return response.json()['url'], download
+        
+        stored, download = post(track_id='hit', query='something else entirely')
+        self.assertEqual(download.call_args.args[0], 'Band Song')
+        self.assertEqual(download.call_args.kwargs['target']['isrc'], 'USABC1234567')
+        # Claiming the ISRC without the stored track gets a query-keyed file of its own
+        spoofed, download = post(query='something else entirely', title='Song', isrc='USABC1234567')
+        self.assertEqual(download.call_count, 1)
+        self.assertIsNone(download.call_args.kwargs['target']['isrc'])
+        self.assertNotEqual(spoofed, stored)
+        self.assertEqual(post(track_id='hit', query='Band Song')[0], stored)
+        
+    def test_quality_is_validated_and_normalized(self):
+        """Test that 192 and "192" share one file and unsupported bitrates get 400"""
+        def post(quality):
+            with patch('playlist_app.api_views.download_audio', return_value=b'mp3') as download:
+                response = self.client.post('/api/download/audio/',
+                                            json.dumps({'query': 'Band Song', 'quality': quality, 'delivery': 'file'}),
+                                            content_type='application/json')
+            return response, download
+        
+        as_string, download = post('192')
+        as_number, download = post(192)
+        self.assertEqual(download.call_count, 0)
+        self.assertEqual(as_number.json()['url'], as_string.json()['url'])
+        for quality in ('abc', 64, '192.0', None):
+            with self.subTest(quality=quality):
+                response, download = post(quality)
+                self.assertEqual(response.status_code, 400)
+                download.assert_not_called()
+        
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-3', 10), (0, 3))
+        self.assertEqual(parse_range('bytes=4-', 10), (4, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=8-99', 10), (8, 9))
+        self.assertIsNone(parse_range('bytes=0-1,4-5', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=10-', 10)
+            
+    def test_cached_file_is_reused(self):
+        """Test that a repeated request is served from the file cache without a download"""
+        first, download = self.request_file()
+        self.assertEqual(download.call_count, 1)
+        second, download = self.request_file()
+        self.assertEqual(download.call_count, 0)
+        self.assertEqual(second['url'], first['url'])
+        self.assertEqual(second['size'], 10)
+        
+    def test_range_requests_resume_the_file(self):
+        """Test that Range, If-Range and If-None-Match follow the file's ETag"""
+        data, _ = self.request_file()
+        
+        full = self.client.get(data['url'])
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(b''.join(full.streaming_content), b'0123456789')
+        self.assertEqual(full['Accept-Ranges'], 'bytes')
+        self.assertEqual(full['ETag'], data['etag'])
+        
+        partial = self.client.get(data['url'], HTTP_RANGE='bytes=4-', HTTP_IF_RANGE=data['etag'])
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), b'456789')
+        self.assertEqual(partial['Content-Range'], 'bytes 4-9/10')
+        
+        # A partial copy of a different file restarts from the beginning
+        stale = self.client.get(data['url'], HTTP_RANGE='bytes=4-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(stale.status_code, 200)
+        
+        beyond = self.client.get(data['url'], HTTP_RANGE='bytes=10-')
+        self.assertEqual(beyond.status_code, 416)
+        self.assertEqual(beyond['Content-Range'], 'bytes */10')
+        
+        current = self.client.get(data['url'], HTTP_IF_NONE_MATCH=data['etag'])
+        self.assertEqual(current.status_code, 304)
+        
+    def test_unknown_or_malformed_key_is_404(self):
+        self.assertEqual(self.client.get('/api/download/audio/' + 'a' * 40 + '/').status_code, 404)
+        self.assertEqual(self.client.get('/api/download/audio/..%2Fsecret/').status_code, 404)
+
+
+class SearchTestCase(TestCase):
+    
+    def setUp(self):
+        self.playlist = Playlist.objects.create(spotify_url='u', spotify_id='p1', title='Sixties Classics', owner='DJ')
+        import_tracks(self.playlist, [
+            {'id': 't1', 'name': 'Yesterday', 'artists': [{'name': 'The Beatles'}], 'album': {'name': 'Help!'}},
+            {'id': 't2', 'name': 'Help!', 'artists': [{'name': 'The Beatles'}], 'album': {'name': 'Help!'}},
+            {'id': 't3', 'name': 'Paint It Black', 'artists': [{'name': 'The Rolling Stones'}], 'album': {'name': 'Aftermath'}},
+        ])
+        
+    def titles(self, text):
+        return [track.title for track in search_objects(TRACK_INDEX, text)]
+        
+    def test_prefix_terms_are_ranked(self):
+        """Test that every word matches as a prefix and title matches rank first"""
+        self.assertEqual(self.titles('beat yest'), ['Yesterday'])
+        self.assertEqual(self.titles('help')[0], 'Help!')
+        self.assertEqual(sorted(self.titles('help')), ['Help!', 'Yesterday'])
+        self.assertEqual(self.titles('"NOT" OR'), [])
+        
+    def test_index_follows_upserts_and_deletes(self):
+        """Test that the index stays in sync with bulk upserts and deletes"""
+        import_tracks(self.playlist, [
+            {'id': 't1', 'name': 'Let It Be', 'artists': [{'name': 'The Beatles'}], 'album': {'name': 'Let It Be'}},
+        ])
+        self.assertEqual(self.titles('yesterday'), [])
+        self.assertEqual(self.titles('let'), ['Let It Be'])
+        
+        Track.objects.filter(title='Paint It Black').delete()
+        self.assertEqual(self.titles('stones'), [])
+        
+    def test_search_endpoint(self):
+        response = self.client.get(reverse('search'), {'q': 'sixties'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['title'] for p in response.json()['playlists']], ['Sixties Classics'])
+        
+        response = self.client.get(reverse('search'), {'q': 'stones', 'type': 'tracks'})
+        tracks = response.json()['tracks']
+        self.assertEqual(tracks[0]['title'], 'Paint It Black')
+        self.assertEqual(tracks[0]['playlist_title'], 'Sixties Classics')
+        self.assertNotIn('playlists', response.json())
+        
+    def test_admin_search_uses_index(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get('/admin/playlist_app/track/', {'q': 'rolling'})
+        self.assertContains(response, 'Paint It Black')
+        self.assertNotContains(response, 'Yesterday')
+        
+    def test_index_is_looked_up_once_per_migrate(self):
+        """Test that searches don't introspect the schema until the next migrate"""
+        from django.db import connection
+        from playlist_app.search import reset_index_backend
+        reset_index_backend()
+        with patch.object(connection.introspection, 'table_names',
+                          wraps=connection.introspection.table_names) as table_names:
+            self.titles('help')
+            self.titles('stones')
+            self.assertEqual(table_names.call_count, 1)
+            
+            reset_index_backend()
+            self.assertEqual(self.titles('yesterday'), ['Yesterday'])
+            self.assertEqual(table_names.call_count, 2)
+
+
+class LargeTableAdminTestCase(TestCase):
+    
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.playlists = [
+            Playlist.objects.create(spotify_url='u', spotify_id=f'p{i}', title=f'Playlist {i}', owner='o')
+            for i in range(3)
+        ]
+        
+    def add_tracks(self, playlist, count):
+        import_tracks(playlist, [
+            {'id': f'{playlist.spotify_id}t{i}', 'name': f'Song {playlist.pk}-{i}',
+             'artists': [{'name': 'Artist'}], 'album': {'name': 'Album'}}
+            for i in range(count)
+        ])
+        
+    def count_queries(self, url, params=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+        
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Test that playlists are joined, not fetched per row, and the filter lists none"""
+        self.add_tracks(self.playlists[0], 5)
+        few = self.count_queries('/admin/playlist_app/track/')
+        self.add_tracks(self.playlists[1], 50)
+        self.assertEqual(self.count_queries('/admin/playlist_app/track/'), few)
+        
+        response = self.client.get('/admin/playlist_app/track/')
+        self.assertNotContains(response, 'playlist__id__exact=')
+        self.assertContains(response, 'data-filter-param="playlist__id__exact"')
+        self.assertContains(response, 'js/admin_filters.js')
+        
+        # The filter box searches playlists through the admin's autocomplete view
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'playlist_app', 'model_name': 'track', 'field_name': 'playlist', 'term': 'playlist 1'
+        })
+        self.assertEqual([result['text'] for result in response.json()['results']], ['Playlist 1 by o'])
+        
+    def test_autocomplete_filter_narrows_results(self):
+        self.add_tracks(self.playlists[0], 2)
+        self.add_tracks(self.playlists[1], 2)
+        response = self.client.get('/admin/playlist_app/track/', {'playlist__id__exact': self.playlists[1].pk})
+        self.assertContains(response, f'Song {self.playlists[1].pk}-0')
+        self.assertNotContains(response, f'Song {self.playlists[0].pk}-0')
+        
+    def test_keyset_pagination(self):
+        """Test that pages follow an 'after' cursor and the count is capped"""
+        self.add_tracks(self.playlists[0], 120)
+        with patch('playlist_app.admin_helpers.COUNT_LIMIT', 100):
+            response = self.client.get('/admin/playlist_app/track/')
+        cl = response.context['cl']
+        self.assertEqual(len(cl.result_list), 100)
+        self.assertEqual(cl.result_count_display, '100+')
+        self.assertIn('after=', cl.next_page_url)
+        
+        response = self.client.get('/admin/playlist_app/track/' + cl.next_page_url)
+        cl = response.context['cl']
+        self.assertEqual(len(cl.result_list), 20)
+        self.assertIsNone(cl.next_page_url)
+        self.assertNotIn('after', cl.first_page_url)
+        
+        # Sorting by a column falls back to numbered pages
+        response = self.client.get('/admin/playlist_app/track/', {'o': '1'})
+        self.assertFalse(response.context['cl'].keyset)
+        self.assertEqual(response.context['cl'].paginator.num_pages, 2)
+
+
+class CandidateMatchingTestCase(TestCase):
+    
+    track = {'title': 'Blinding Lights', 'artist': 'The Weeknd', 'duration_ms': 200040}
+    candidates = [
+        {'title': 'The Weeknd - Blinding Lights (Live at the Grammys)', 'channel': 'Grammys', 'duration': 262, 'url': 'live'},
+        {'title': 'Blinding Lights (Cover)', 'channel': 'Some Singer', 'duration': 199, 'url': 'cover'},
+        {'title': 'Blinding Lights', 'channel': 'The Weeknd - Topic', 'duration': 200, 'url': 'topic'},
+    ]
+    
+    def test_scorer_prefers_matching_recording(self):
+        """Test that duration, channel and version words beat search rank"""
+        self.assertEqual(matching.pick_candidate(self.track, self.candidates)['url'], 'topic')
+        self.assertIsNone(matching.pick_candidate(self.track, []))
+        
+    def test_batch_scores(self):
+        batch = [(self.track, self.candidates), ({'title': 'Unknown'}, self.candidates[:1]), ({'title': 'None'}, [])]
+        self.assertEqual(matching.best_indexes(batch), [2, 0, None])
+        self.assertEqual([len(row) for row in matching.score_batch(batch)], [3, 1, 0])
+                
+    def test_search_youtube_scores_candidates_for_a_target(self):
+        from .api_views import match_target, search_youtube
+        ydl = MagicMock()
+        ydl.extract_info.return_value = {'entries': self.candidates}
+        
+        self.assertEqual(search_youtube(ydl, 'The Weeknd Blinding Lights', self.track), 'topic')
+        self.assertEqual(ydl.extract_info.call_args[0][0], f'ytsearch{matching.SEARCH_CANDIDATES}:The Weeknd Blinding Lights')
+        # Without a target the top result is taken, as before
+        self.assertEqual(search_youtube(ydl, 'The Weeknd Blinding Lights'), 'live')
+        self.assertEqual(ydl.extract_info.call_args[0][0], 'ytsearch1:The Weeknd Blinding Lights')
+        
+        self.assertEqual(match_target({'title': 'Song', 'artist': 'A', 'duration_ms': '1000', 'isrc': 'USABC1234567'}),
+                         {'title': 'Song', 'artist': 'A', 'duration_ms': 1000, 'isrc': None})
+        self.assertIsNone(match_target({'query': 'only a query'}))
+
+
+class EnrichmentTestCase(TestCase):
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        REGISTRY.reset()
+        self.playlist = Playlist.objects.create(spotify_url='u', spotify_id='enrich', title='E', owner='o')
+        
+    def spotify_client(self):
+        """Fake client whose tracks() answers like Spotify, minus unknown ids"""
+        sp = MagicMock()
+        sp.tracks.side_effect = lambda ids: {'tracks': [
+            None if spotify_id == 'gone' else {
+                'id': spotify_id,
+                'external_ids': {'isrc': f'usabc{spotify_id[-7:].zfill(7)}'},
+                'album': {'id': f'album-{spotify_id}', 'name': 'Album', 'release_date': '2020-01-31'},
+            } for spotify_id in ids
+        ]}
+        return sp
+        
+    def test_fetch_tracks_batches_ids(self):
+        """Test that 1,000 ids take 20 requests of at most 50, and duplicates are dropped"""
+        sp = self.spotify_client()
+        ids = [f'{i:07d}' for i in range(1000)]
+        found = fetch_tracks(sp, ids + ids[:10] + ['gone'], workers=4)
+        
+        self.assertEqual(len(found), 1000)
+        self.assertEqual(sp.tracks.call_count, 21)
+        self.assertTrue(all(len(call.args[0]) <= SPOTIFY_TRACKS_PER_REQUEST for call in sp.tracks.call_args_list))
+        self.assertEqual(REGISTRY.get('spotify_requests_total', endpoint='tracks'), 21)
+        
+    def test_enrich_fills_only_tracks_missing_an_isrc(self):
+        for position, spotify_id in enumerate(['0000001', '0000002', 'gone']):
+            Track.objects.create(playlist=self.playlist, title='T', artist='A', spotify_id=spotify_id, position=position)
+        Track.objects.filter(spotify_id='0000002').update(isrc='GBXYZ9900001')
+        
+        self.assertEqual(enrich_tracks(self.spotify_client(), self.playlist.tracks.all()), 1)
+        track = Track.objects.get(spotify_id='0000001')
+        self.assertEqual((track.isrc, track.album_id, track.release_date), ('USABC0000001', 'album-0000001', '2020-01-31'))
+        self.assertEqual(Track.objects.get(spotify_id='0000002').isrc, 'GBXYZ9900001')
+        self.assertIsNone(Track.objects.get(spotify_id='gone').isrc)
+        
+    def test_imported_tracks_keep_isrc(self):
+        track = build_track({
+            'id': 't', 'name': 'Song', 'artists': [{'name': 'A'}], 'duration_ms': 1,
+            'album': {'name': 'Album', 'id': 'al'}, 'external_ids': {'isrc': 'us-um7-17-03861'},
+        }, POSITION_STEP)
+        self.assertEqual((track.isrc, track.album, track.album_id), ('USUM71703861', 'Album', 'al'))
+        
+    def test_isrc_keys_youtube_resolution(self):
+        """Test that one recording resolves once whatever the query says"""
+        calls = []
+        resolve = lambda: calls.append(1) or 'url'
+        playlist_cache.resolve_youtube('Artist Song', resolve, scored=True, isrc='USUM71703861')
+        playlist_cache.resolve_youtube('artist - song (remastered)', resolve, scored=True, isrc='USUM71703861')
+        self.assertEqual(len(calls), 1)
+
+
+class SpotifySourcesTestCase(TestCase):
+    
+    def fake_album(self, album_id, total):
+        return {
+            'id': album_id, 'name': f'Album {album_id}', 'artists': [{'name': 'Band'}], 'release_date': '1999',
+            'tracks': {'items': [self.fake_track(album_id, i) for i in range(min(total, 50))], 'total': total},
+        }
+        
+    def fake_track(self, album_id, i):
+        return {'type': 'track', 'id': f'{album_id}t{i}', 'name': f'Song {i}', 'artists': [{'name': 'Band'}], 'duration_ms': 1000}
+        
+    def spotify_client(self, totals):
+        sp = MagicMock()
+        sp.albums.side_effect = lambda ids: {'albums': [self.fake_album(i, totals[i]) if i in totals else None for i in ids]}
+        sp.album_tracks.side_effect = lambda album_id, limit, offset: {
+            'items': [self.fake_track(album_id, i) for i in range(offset, min(offset + limit, totals[album_id]))]
+        }
+        return sp
+        
+    def test_parse_spotify_links(self):
+        cases = {
+            'https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M?si=abc': ('playlist', '37i9dQZF1DXcBWIGoYBM5M'),
+            'https://open.spotify.com/intl-de/album/4aawyAB9vmqN3uQ7FjRGTy': ('album', '4aawyAB9vmqN3uQ7FjRGTy'),
+            'spotify:track:11dFghVXANMlKmJXsNCbNl': ('track', '11dFghVXANMlKmJXsNCbNl'),
+            'spotify:user:someone:playlist:abc123': ('playlist', 'abc123'),
+            'https://open.spotify.com/artist/0OdUWJ0sBjDrqHygGUXeCF': ('artist', '0OdUWJ0sBjDrqHygGUXeCF'),
+            'test123': ('playlist', 'test123'),
+            'https://example.com/album/x y': None,
+        }
+        for url, expected in cases.items():
+            with self.subTest(url=url):
+                self.assertEqual(parse_spotify_url(url), expected)
+                
+    def test_albums_are_fetched_in_batches(self):
+        """Test that 45 albums take 3 several-albums calls plus one per extra track page"""
+        totals = {f'a{i}': 10 for i in range(45)}
+        totals['a7'] = 120
+        sp = self.spotify_client(totals)
+        albums = fetch_albums(sp, list(totals) + ['missing'], workers=4)
+        
+        self.assertEqual([album['id'] for album in albums], list(totals))
+        self.assertEqual(sp.albums.call_count, 3)
+        self.assertEqual(sp.album_tracks.call_count, 2)
+        long_album = albums[7]['tracks']['items']
+        self.assertEqual([track['id'] for track in long_album], [f'a7t{i}' for i in range(120)])
+        
+    @patch('playlist_app.views.spotipy.Spotify')
+    def test_album_link_imports_as_playlist(self, mock_spotify):
+        mock_spotify.return_value = self.spotify_client({'alb1': 3})
+        response = self.client.post(
+            reverse('get_playlist_tracks'),
+            data=json.dumps({'playlist_url': 'https://open.spotify.com/album/alb1'}),
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        playlist = Playlist.objects.get(spotify_id='album:alb1')
+        self.assertEqual((playlist.title, playlist.owner, playlist.total_tracks), ('Album alb1', 'Band', 3))
+        self.assertEqual(set(playlist.tracks.values_list('album', flat=True)), {'Album alb1'})
+        
+        response = self.client.post(reverse('get_playlist_tracks'), data=json.dumps({'playlist_url': 'https://x.com/?a b'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SPOTIFY_BATCH_WORKERS=1)
+class BulkImportTestCase(TestCase):
+    
+    def setUp(self):
+        patcher = patch('playlist_app.views.spotipy.Spotify')
+        sp = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        shared = self.spotify_track('shared')
+        contents = {'p1': [self.spotify_track('a'), shared], 'p2': [shared, self.spotify_track('b'), shared]}
+        sp.playlist.side_effect = lambda playlist_id: {
+            'name': f'List {playlist_id}', 'owner': {'display_name': 'o'}, 'tracks': {'total': 0}, 'public': True,
+        }
+        sp.playlist_tracks.side_effect = lambda playlist_id: {
+            'items': [{'track': track} for track in contents[playlist_id]], 'next': None,
+        }
+        
+    def spotify_track(self, name):
+        return {'type': 'track', 'id': name, 'name': f'Song {name}', 'artists': [{'name': 'Band'}],
+                'album': {'name': 'Album'}, 'duration_ms': 181000}
+        
+    def test_bulk_import_api(self):
+        """Test that several playlists import in one call and shared tracks are counted once"""
+        response = self.client.post(
+            reverse('bulk_import_playlists'),
+            data=json.dumps({'playlist_urls': ['https://open.spotify.com/playlist/p1', 'p2', 'not a link']}),
+            content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['imported'], data['failed']), (2, 1))
+        self.assertEqual((data['total_tracks'], data['unique_tracks']), (5, 3))
+        self.assertEqual(data['playlists'][1]['playlist']['title'], 'List p2')
+        self.assertIsNone(data['playlists'][2]['playlist'])
+        
+    def test_bulk_import_rejects_bad_bodies(self):
+        """Test that non-object bodies and oversized batches get 400 instead of an error or a long request"""
+        url = reverse('bulk_import_playlists')
+        for body in (['p1', 'p2'], 'p1', {'playlist_urls': 'p1'}):
+            with self.subTest(body=body):
+                response = self.client.post(url, data=json.dumps(body), content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        
+        with self.settings(BULK_IMPORT_MAX_PLAYLISTS=1):
+            response = self.client.post(url, data=json.dumps({'playlist_urls': ['p1', 'p2']}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('mirror_playlists', response.json()['error'])
+        self.assertFalse(Playlist.objects.exists())
+        
+    def test_mirror_downloads_each_song_once(self):
+        """Test the headless command: one download per distinct song, one .m3u8 per playlist"""
+        from django.core.management import call_command
+        from io import StringIO
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output, ignore_errors=True)
+        audio = os.path.join(output, 'source.mp3')
+        with open(audio, 'wb') as f:
+            f.write(b'mp3')
+        url_file = os.path.join(output, 'urls.txt')
+        with open(url_file, 'w') as f:
+            f.write('# nightly mirror\nhttps://open.spotify.com/playlist/p1\n\np2\n')
+        
+        with patch('playlist_app.batch.track_audio', return_value=audio) as track_audio:
+            call_command('mirror_playlists', '--file', url_file, '--output', output, '--download-workers', '1',
+                         stdout=StringIO())
+        
+        self.assertEqual(sorted(call.args[0].spotify_id for call in track_audio.call_args_list), ['a', 'b', 'shared'])
+        self.assertEqual(sorted(os.listdir(os.path.join(output, 'tracks'))),
+                         ['Band - Song a.mp3', 'Band - Song b.mp3', 'Band - Song shared.mp3'])
+        with open(os.path.join(output, 'List p2.m3u8'), encoding='utf-8') as f:
+            entries = [line for line in f.read().splitlines() if not line.startswith('#')]
+        self.assertEqual(entries, ['tracks/Band - Song shared.mp3', 'tracks/Band - Song b.mp3'])
+        
+    def test_mirror_playlist_folders_share_files(self):
+        """Test that --folders fans each pooled song out to every playlist folder without copying it"""
+        from django.core.management import call_command
+        from io import StringIO
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output, ignore_errors=True)
+        audio = os.path.join(output, 'source.mp3')
+        with open(audio, 'wb') as f:
+            f.write(b'mp3')
+        
+        out = StringIO()
+        with patch('playlist_app.batch.track_audio', return_value=audio):
+            call_command('mirror_playlists', 'p1', 'p2', '--output', output, '--folders', stdout=out)
+        
+        self.assertEqual(sorted(os.listdir(os.path.join(output, 'List p2'))),
+                         ['001 - Band - Song shared.mp3', '002 - Band - Song b.mp3'])
+        shared = os.stat(os.path.join(output, 'tracks', 'Band - Song shared.mp3'))
+        for folder in ('List p1', 'List p2'):
+            fanned = [name for name in os.listdir(os.path.join(output, folder)) if 'shared' in name]
+            self.assertEqual(os.stat(os.path.join(output, folder, fanned[0])).st_ino, shared.st_ino)
+        self.assertIn('duplicates skipped: 2', out.getvalue())
+        sessions = {session.playlist.spotify_id: session for session in DownloadSession.objects.all()}
+        self.assertEqual(sorted(sessions), ['p1', 'p2'])
+        self.assertEqual(sum(session.tracks_deduplicated for session in sessions.values()), 2)
+        self.assertEqual(sum(session.bytes_saved for session in sessions.values()), 2 * len(b'mp3'))
+        self.assertEqual({session.status for session in sessions.values()}, {'completed'})
+        
+    def test_write_outputs_reserves_tracks_and_skips_files_in_place(self):
+        """Test that a playlist called tracks gets its own folder and a rerun rewrites nothing"""
+        from playlist_app.batch import write_outputs
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output, ignore_errors=True)
+        audio = os.path.join(output, 'source.mp3')
+        with open(audio, 'wb') as f:
+            f.write(b'mp3')
+        playlist = Playlist.objects.create(spotify_id='tr1', title='Tracks', owner='Me')
+        song = Track(spotify_id='s', title='Song', artist='Band')
+        pool, members, paths = {'s': song}, {playlist: ['s']}, {'s': audio}
+        
+        first = write_outputs(output, pool, members, paths, folders=True)
+        # Same size, different song: a size check alone would keep the stale file
+        with open(audio, 'wb') as f:
+            f.write(b'new')
+        second = write_outputs(output, pool, members, paths, folders=True)
+        third = write_outputs(output, pool, members, paths, folders=True)
+        
+        self.assertEqual(sorted(os.listdir(os.path.join(output, 'tracks'))), ['Band - Song.mp3'])
+        self.assertEqual(os.listdir(os.path.join(output, 'Tracks [tr1]')), ['001 - Band - Song.mp3'])
+        self.assertEqual((first['written'], second['written'], third['written']), (1, 1, 0))
+        self.assertEqual(third['linked'] + third['cloned'] + third['copied'], 0)
+        with open(os.path.join(output, 'Tracks [tr1]', '001 - Band - Song.mp3'), 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+
+
+class DedupTestCase(TestCase):
+    
+    def track(self, spotify_id, artist, title, duration_ms=200000, isrc=None):
+        return Track(spotify_id=spotify_id, title=title, artist=artist, duration_ms=duration_ms, isrc=isrc)
+        
+    def test_normalized_name(self):
+        """Test that case, accents, punctuation and featuring credits don't split a song"""
+        from playlist_app.dedup import normalized_name
+        self.assertEqual(normalized_name('Beyoncé, JAY-Z', 'Crazy in Love (feat. JAY-Z)'),
+                         normalized_name('beyonce', 'Crazy In Love'))
+        self.assertNotEqual(normalized_name('Band', 'Song'), normalized_name('Band', 'Song 2'))
+        
+    def test_dedup_tracks(self):
+        """Test grouping by spotify id, then ISRC, then artist and title of matching length"""
+        from playlist_app.dedup import dedup_tracks
+        tracks = [
+            self.track('single', 'Band', 'Hit', isrc='USABC1234567'),
+            self.track('album', 'Band', 'Hit (Remastered)', isrc='USABC1234567'),
+            self.track('single', 'Band', 'Hit', isrc='USABC1234567'),
+            self.track('compilation', 'BAND', 'Hit', duration_ms=201500),
+            self.track('intro1', 'Band', 'Intro', duration_ms=60000),
+            self.track('intro2', 'Band', 'Intro', duration_ms=95000),
+        ]
+        
+        pool, assignments = dedup_tracks(tracks)
+        
+        self.assertEqual(list(pool), ['single', 'intro1', 'intro2'])
+        self.assertEqual(assignments['album'], 'single')
+        self.assertEqual(assignments['compilation'], 'single')
+        self.assertEqual(assignments['intro2'], 'intro2')
+        
+    def test_link_or_copy(self):
+        """Test that the fan-out shares data and falls back to copying across devices"""
+        from playlist_app.batch import link_or_copy
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        source = os.path.join(folder, 'a.mp3')
+        with open(source, 'wb') as f:
+            f.write(b'mp3 data')
+        
+        self.assertEqual(link_or_copy(source, os.path.join(folder, 'b.mp3')), 'linked')
+        with patch('playlist_app.batch.os.link', side_effect=OSError(18, 'Invalid cross-device link')):
+            result = link_or_copy(source, os.path.join(folder, 'c.mp3'))
+        self.assertIn(result, ('cloned', 'copied'))
+        with open(os.path.join(folder, 'c.mp3'), 'rb') as f:
+            self.assertEqual(f.read(), b'mp3 data')
+
+
+class RangedDownloadTestCase(TestCase):
+    
+    def setUp(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.payload = os.urandom(300 * 1024)
+        self.mode = 'ranges'
+        self.ranges = []
+        test = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def log_message(self, *args):
+                pass
+            
+            def do_GET(self):
+                first, last = (int(n) for n in self.headers['Range'][len('bytes='):].split('-'))
+                test.ranges.append((first, last))
+                body = test.payload[first:last + 1]
+                if test.mode == 'ignore':
+                    body = test.payload
+                    self.send_response(200)
+                elif test.mode == 'drop':
+                    # Promise the range, send half of it and hang up
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {first}-{last}/{len(test.payload)}')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body[:len(body) // 2])
+                    self.close_connection = True
+                    return
+                else:
+                    self.send_response(206)
+                    shift = 1 if test.mode == 'misaligned' else 0
+                    self.send_header('Content-Range', f'bytes {first + shift}-{last + shift}/{len(test.payload)}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        # Rejected downloads hang up mid-response; that's expected here
+        server.handle_error = lambda request, client_address: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f'http://127.0.0.1:{server.server_port}/audio.webm'
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        self.path = os.path.join(folder, 'audio.webm')
+        
+    @override_settings(DOWNLOAD_RANGE_MIN_BYTES=64 * 1024)
+    def test_ranges_reassemble_exactly(self):
+        """Test that a file fetched as parallel ranges is byte-for-byte the original"""
+        from playlist_app.ranged import download_ranges
+        
+        written = download_ranges(self.url, self.path, len(self.payload), connections=3)
+        
+        self.assertEqual(written, len(self.payload))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertEqual(len(self.ranges), 4)
+        self.assertEqual(sum(last - first + 1 for first, last in self.ranges), len(self.payload))
+        
+    @override_settings(DOWNLOAD_RANGE_MIN_BYTES=64 * 1024)
+    def test_bad_ranges_are_rejected(self):
+        """Test that a server ignoring Range or sending the wrong bytes fails the download cleanly"""
+        from playlist_app.ranged import IntegrityError, RangeNotSupported, download_ranges
+        
+        self.mode = 'ignore'
+        with self.assertRaises(RangeNotSupported):
+            download_ranges(self.url, self.path, len(self.payload), connections=2)
+        self.assertFalse(os.path.exists(self.path))
+        
+        self.mode = 'misaligned'
+        with self.assertRaises(IntegrityError):
+            download_ranges(self.url, self.path, len(self.payload), connections=2)
+        self.assertFalse(os.path.exists(self.path))
+        
+    @override_settings(DOWNLOAD_RANGE_MIN_BYTES=64 * 1024, DOWNLOAD_CONNECTIONS_PER_FILE=2)
+    def test_dropped_connections_fall_back_to_one_stream(self):
+        """Test that ranges which keep failing on the network hand the download to yt-dlp"""
+        from playlist_app.api_views import download_source
+        self.mode = 'drop'
+        ydl = MagicMock(params={})
+        ydl.extract_info.return_value = {'protocol': 'http', 'url': self.url, 'filesize': len(self.payload),
+                                         'ext': 'webm'}
+        source_dir = os.path.dirname(self.path)
+        
+        info = download_source(ydl, 'https://www.youtube.com/watch?v=abcdefghijk', source_dir, StageTimer())
+        
+        ydl.process_ie_result.assert_called_once_with(info, download=True)
+        self.assertFalse(os.path.exists(os.path.join(source_dir, 'audio.webm')))
+        self.assertGreater(len(self.ranges), 2)
+        
+    def test_connection_budget(self):
+        """Test that files share the global budget and always get at least one connection"""
+        from playlist_app.ranged import ConnectionBudget, plan_segments, ranged_format
+        budget = ConnectionBudget(6)
+        
+        self.assertEqual(budget.acquire(4), 4)
+        self.assertEqual(budget.acquire(4), 2)
+        budget.release(4)
+        self.assertEqual(budget.acquire(8), 4)
+        
+        self.assertEqual(plan_segments(100, 4, 1000), [(0, 99)])
+        self.assertEqual(plan_segments(10, 2, 3), [(0, 3), (4, 7), (8, 9)])
+        self.assertEqual(ranged_format({'protocol': 'https', 'url': 'u', 'filesize': 10}), ('u', {}, 10))
+        self.assertIsNone(ranged_format({'protocol': 'https', 'url': 'u', 'filesize_approx': 10}))
+        self.assertIsNone(ranged_format({'protocol': 'http_dash_segments', 'url': 'u', 'filesize': 10}))
+
+
+class FormatSelectionTestCase(TestCase):
+    
+    def setUp(self):
+        self.formats = [
+            {'format_id': '139', 'acodec': 'mp4a.40.5', 'vcodec': 'none', 'abr': 48.8, 'filesize': 1400000},
+            {'format_id': '250', 'acodec': 'opus', 'vcodec': 'none', 'abr': 70.4, 'filesize': 2100000},
+            {'format_id': '140', 'acodec': 'mp4a.40.2', 'vcodec': 'none', 'abr': 129.5, 'filesize': 3900000},
+            {'format_id': '251', 'acodec': 'opus', 'vcodec': 'none', 'abr': 134.8, 'filesize': 4000000},
+            {'format_id': '18', 'acodec': 'mp4a.40.2', 'vcodec': 'avc1.42001E', 'tbr': 546, 'filesize': 16000000},
+        ]
+        
+    def test_smallest_stream_covering_quality(self):
+        """Test that each MP3 bitrate gets the smallest audio-only stream good enough for it"""
+        from playlist_app.formats import select_audio_format
+        self.assertEqual(select_audio_format(self.formats, '128')['format_id'], '250')
+        self.assertEqual(select_audio_format(self.formats, '192')['format_id'], '251')
+        # Nothing covers 320 kbps: the best audio-only stream, not the muxed video
+        self.assertEqual(select_audio_format(self.formats, '320')['format_id'], '251')
+        
+    def test_never_video(self):
+        """Test that uploads without an audio-only stream (or only oversized ones) select nothing"""
+        from playlist_app.formats import audio_format_selector, select_audio_format
+        self.assertIsNone(select_audio_format(self.formats[-1:], '128'))
+        huge = dict(self.formats[3], filesize=None, filesize_approx=80000000)
+        self.assertIsNone(select_audio_format([huge, self.formats[-1]], '192'))
+        self.assertEqual([fmt['format_id'] for fmt in audio_format_selector('192')({'formats': self.formats})],
+                         ['251'])
+
+
+class SourceCacheTestCase(TestCase):
+    
+    def setUp(self):
+        audio_cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, audio_cache, ignore_errors=True)
+        self.enterContext(override_settings(AUDIO_CACHE_DIR=audio_cache))
+        
+    def test_new_bitrate_is_a_local_transcode(self):
+        """Test that a second bitrate of the same video transcodes the cached source without downloading"""
+        from playlist_app.api_views import download_audio
+        
+        def fake_download(ydl, video_url, source_dir, timer):
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, 'audio.webm'), 'wb') as f:
+                f.write(b'opus')
+            formats = [{'format_id': '251', 'acodec': 'opus', 'vcodec': 'none', 'abr': 135}]
+            return dict(formats[0], formats=formats)
+        
+        def fake_transcode(source, output, quality, **kwargs):
+            with open(output, 'wb') as f:
+                f.write(f'{quality}k of '.encode() + open(source, 'rb').read())
+        
+        with patch('playlist_app.api_views.resolve_youtube', return_value='https://www.youtube.com/watch?v=abcdefghijk'), \
+             patch('playlist_app.api_views.download_source', side_effect=fake_download) as download, \
+             patch('playlist_app.api_views.transcode', side_effect=fake_transcode) as transcode:
+            low = download_audio('Band Song', '128')
+            high = download_audio('Band Song', '320')
+        
+        self.assertEqual((low, high), (b'128k of opus', b'320k of opus'))
+        self.assertEqual(download.call_count, 1)
+        sources = {call.args[0] for call in transcode.call_args_list}
+        self.assertEqual(len(sources), 1)
+        self.assertTrue(sources.pop().endswith(os.path.join('sources', 'ab', 'abcdefghijk.webm')))
+        
+    def test_source_replaced_when_not_good_enough(self):
+        """Test that a stored source too poor for the requested bitrate is a miss, then replaced"""
+        from django.conf import settings
+        from playlist_app.audio_files import cached_source, store_source
+        from playlist_app.formats import covers
+        staging = tempfile.mkdtemp(dir=settings.AUDIO_CACHE_DIR)
+        
+        def downloaded(name):
+            path = os.path.join(staging, name)
+            with open(path, 'wb') as f:
+                f.write(b'audio')
+            return path
+        
+        store_source('abcdefghijk', downloaded('a.webm'), {'mp3_kbps': 140.8, 'best': False})
+        self.assertTrue(cached_source('abcdefghijk', lambda meta: covers(meta['mp3_kbps'], 128)))
+        self.assertIsNone(cached_source('abcdefghijk', lambda meta: covers(meta['mp3_kbps'], 192)))
+        
+        path = store_source('abcdefghijk', downloaded('b.m4a'), {'mp3_kbps': 168.4, 'best': True})
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))), ['abcdefghijk.json', 'abcdefghijk.m4a'])
+        self.assertEqual(cached_source('abcdefghijk', lambda meta: meta['best']), path)
+        
+    def test_variants_evicted_least_recently_used(self):
+        """Test that the variant budget evicts the least recently used MP3 and hits keep their ETag"""
+        from playlist_app.audio_files import audio_path, cached_audio, store_audio
+        keys = [hashlib.sha1(name.encode()).hexdigest() for name in 'abcd']
+        with override_settings(AUDIO_CACHE_MAX_BYTES=3000):
+            for number, key in enumerate(keys[:3]):
+                store_audio(key, b'x' * 1000)
+                os.utime(audio_path(key), ns=(number * 10 ** 9, number * 10 ** 9))
+            mtime = os.stat(audio_path(keys[0])).st_mtime_ns
+            self.assertTrue(cached_audio(keys[0]))
+            self.assertEqual(os.stat(audio_path(keys[0])).st_mtime_ns, mtime)
+            
+            store_audio(keys[3], b'x' * 1000)
+        
+        self.assertEqual([bool(cached_audio(key)) for key in keys], [True, False, True, True])
@@ -0,0 +1,25 @@
+"""
+DRF throttles backed by the shared cache only
+The default cache is tiered (see cache.TieredCache): each worker process
+would serve its own local copy of a client's request history, so every
+worker counted separately and the effective limit grew with the worker
+count. These throttles read and write the shared tier directly.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+
+class SharedCacheMixin:
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'shared')]
+
+
+class SharedAnonRateThrottle(SharedCacheMixin, AnonRateThrottle):
+    """Per-IP rate for anonymous API clients"""
+
+
+class SharedUserRateThrottle(SharedCacheMixin, UserRateThrottle):
+    """Per-user rate for signed-in API clients"""
@@ -0,0 +1,80 @@
+"""
+Transcoding service
+Each encode runs one single-threaded FFmpeg process directly under the
+transcode admission gate (see admission.get_transcode_gate), which lets
+TRANSCODE_WORKERS encodes run at once, so N of them never oversubscribe N
+cores however many requests arrive, and turns callers beyond its queue away.
+Time spent waiting at the gate and time spent encoding are reported as
+separate pipeline stages.
+"""
+import os
+import shutil
+import subprocess
+import time
+from django.conf import settings
+from .admission import get_transcode_gate
+from .metrics import Span
+
+
+# Single-pass EBU R128 normalization to -16 LUFS integrated, -1.5 dBTP peak
+DEFAULT_LOUDNORM_FILTER = 'loudnorm=I=-16:TP=-1.5:LRA=11'
+
+
+def ffmpeg_path():
+    """FFMPEG_PATH, else the ffmpeg found on PATH, else None"""
+    return getattr(settings, 'FFMPEG_PATH', None) or shutil.which('ffmpeg')
+
+
+def ffmpeg_command(ffmpeg, input_path, output_path, bitrate, metadata=None, loudnorm=None):
+    """FFmpeg arguments for one MP3 encode
+
+    ``loudnorm`` is a loudnorm filter spec applied in the same pass (it resamples
+    internally, so the output rate is pinned back to 44.1 kHz); ``metadata`` is
+    written as ID3v2.3 tags.
+    """
+    command = [
+        ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', input_path, '-vn', '-threads', '1',
+    ]
+    if loudnorm:
+        command += ['-af', loudnorm, '-ar', '44100']
+    if metadata:
+        command += ['-map_metadata', '-1', '-id3v2_version', '3']
+        for key, value in metadata.items():
+            if value:
+                command += ['-metadata', f'{key}={value}']
+    command += ['-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', output_path]
+    return command
+
+
+def ffmpeg_to_mp3(input_path, output_path, bitrate, metadata=None, loudnorm=None):
+    """Encode input_path to an MP3 at ``bitrate`` kbps; returns the output size"""
+    ffmpeg = ffmpeg_path()
+    if not ffmpeg:
+        raise RuntimeError("FFmpeg not found; install it or set FFMPEG_PATH")
+    command = ffmpeg_command(ffmpeg, input_path, output_path, bitrate, metadata, loudnorm)
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if completed.returncode:
+        error = completed.stderr.decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"FFmpeg failed: {error[-500:]}")
+    return os.path.getsize(output_path)
+
+
+def transcode(input_path, output_path, bitrate, metadata=None, loudnorm=None, timer=None):
+    """Encode to MP3 once the gate admits it, recording transcode_queue and transcode spans
+
+    Tagging and loudness normalization happen in the same FFmpeg pass.
+    Raises AdmissionRejected when the gate's queue is full or the wait runs out.
+    """
+    queued_at = time.monotonic()
+
+    def encode():
+        started = time.monotonic()
+        size = ffmpeg_to_mp3(input_path, output_path, bitrate, metadata, loudnorm)
+        return size, started - queued_at, time.monotonic() - started
+
+    size, queued, seconds = get_transcode_gate().run(encode)
+    if timer:
+        timer.add(Span('transcode_queue', queued))
+        timer.add(Span('transcode', seconds, size))
+    return size
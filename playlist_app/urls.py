@@ -5,9 +5,18 @@ urlpatterns = [
     # Main page
     path('', views.index, name='index'),
     
+    # Prometheus scrape endpoint
+    path('metrics', views.metrics, name='metrics'),
+    
     # API endpoints
     path('api/playlist/tracks/', views.get_playlist_tracks, name='get_playlist_tracks'),
+    path('api/playlists/import/', views.bulk_import_playlists, name='bulk_import_playlists'),
+    path('api/search/', views.search, name='search'),
     path('api/download/session/', views.create_download_session, name='create_download_session'),
     path('api/download/session/<str:session_id>/', views.get_download_session, name='get_download_session'),
     path('api/download/session/<str:session_id>/update/', views.update_download_progress, name='update_download_progress'),
+    
+    # Captured request profiles (staff only)
+    path('api/profiles/', views.list_profiles, name='list_profiles'),
+    path('api/profiles/<str:name>/', views.get_profile, name='get_profile'),
 ]
@@ -1,17 +1,31 @@
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 import json
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-from .models import Playlist, Track, DownloadSession
-from .serializers import PlaylistSerializer, TrackSerializer
+from .models import Playlist, DownloadSession, Track
+from .serializers import (DownloadProgressSerializer, PlaylistSerializer, PlaylistSummarySerializer,
+                          TrackSearchSerializer, TrackSerializer)
+from .cache import SpotifyTokenCache
+from .coalesce import coalesce
+from .enrichment import enrich_tracks, get_batch_workers
+from .importer import POSITION_STEP, get_import_batch_size, import_tracks, refresh_tracks
+from .metrics import REGISTRY, StageTimer
+from .renderers import dumps
+from .search import PLAYLIST_INDEX, TRACK_INDEX, search_objects
+from .sources import fetch_source, parse_spotify_url, source_key
+from . import profiling
 
 
 def index(request):
@@ -19,25 +33,186 @@ def index(request):
     return render(request, 'index.html')
 
 
+def metrics(request):
+    """Prometheus scrape endpoint for this worker's pipeline metrics"""
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def list_profiles(request):
+    """Admin-only listing of captured request profiles"""
+    return JsonResponse({'profiles': profiling.list_profiles()})
+
+
+@staff_member_required
+def get_profile(request, name):
+    """Download a captured profile (.pstats), or ?format=text for a summary"""
+    path = profiling.get_profile_path(name)
+    if not path:
+        raise Http404('Profile not found')
+    
+    if request.GET.get('format') == 'text':
+        return HttpResponse(profiling.render_profile_text(path), content_type='text/plain')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
+
+
 def create_spotify_client():
     """Create Spotify client with client credentials flow"""
     auth_manager = SpotifyClientCredentials(
         client_id=settings.SPOTIFY_CLIENT_ID,
-        client_secret=settings.SPOTIFY_CLIENT_SECRET
+        client_secret=settings.SPOTIFY_CLIENT_SECRET,
+        cache_handler=SpotifyTokenCache(settings.SPOTIFY_CLIENT_ID)
     )
     return spotipy.Spotify(auth_manager=auth_manager)
 
 
-def extract_playlist_id(playlist_url):
-    """Extract playlist ID from Spotify URL"""
-    if "playlist/" in playlist_url:
-        return playlist_url.split("playlist/")[1].split("?")[0]
-    return playlist_url  # Assume it's already an ID
+def load_playlist(playlist_url, source, refresh=False):
+    """Return the stored playlist, importing it from Spotify on first request
+    
+    ``source`` is a (kind, spotify_id) pair from sources.parse_spotify_url;
+    albums, tracks and artists are stored as playlists too. With
+    refresh=True an existing playlist is brought up to date by applying only
+    the differences from Spotify's current track list. A playlist whose
+    import was interrupted is imported again.
+    """
+    key = source_key(*source)
+    
+    # Check if playlist already exists in database
+    existing_playlist = Playlist.objects.filter(spotify_id=key, import_started_at__isnull=True).first()
+    if existing_playlist:
+        if refresh:
+            sp = create_spotify_client()
+            _, track_infos = fetch_source(sp, *source, timer=StageTimer())
+            changes = refresh_tracks(existing_playlist, track_infos)
+            print(f"Refreshed playlist {key}: {changes}")
+            enrich_playlist(sp, existing_playlist)
+        return existing_playlist
+    
+    sp = create_spotify_client()
+    
+    # Get playlist info from Spotify
+    timer = StageTimer()
+    info, track_infos = fetch_source(sp, *source, timer=timer)
+    
+    # The playlist row goes in first and every batch of tracks commits on its
+    # own, so no transaction (on SQLite, the database write lock) is held
+    # while Spotify pages are fetched; import_started_at marks the playlist
+    # incomplete until the last batch is in
+    playlist, created = Playlist.objects.get_or_create(spotify_id=key, defaults={
+        'spotify_url': playlist_url,
+        'title': info['name'],
+        'owner': info['owner'],
+        'total_tracks': info['total_tracks'],
+        'is_public': info['public'],
+        'import_started_at': timezone.now(),
+    })
+    if not created:
+        if playlist.import_started_at is None:
+            # Another worker finished importing it meanwhile
+            return playlist
+        playlist.import_started_at = timezone.now()
+        playlist.save(update_fields=['import_started_at'])
+    
+    # Stream pages from Spotify into batched upserts
+    imported = import_tracks(playlist, track_infos)
+    
+    with transaction.atomic():
+        # Rows past the end are left from an interrupted import of a longer list
+        playlist.tracks.filter(position__gt=imported * POSITION_STEP).delete()
+        playlist.total_tracks = imported
+        playlist.import_started_at = None
+        playlist.save(update_fields=['total_tracks', 'import_started_at', 'updated_at'])
+    
+    enrich_playlist(sp, playlist, timer)
+    return playlist
+
+
+def import_source(playlist_url, refresh=False, discography=False):
+    """Import (or refresh) whatever a Spotify link points at; returns the Playlist
+    
+    Raises ValueError for links that aren't Spotify playlists, albums,
+    tracks or artists. Concurrent imports of the same source share one run.
+    """
+    source = parse_spotify_url(playlist_url)
+    if not source:
+        raise ValueError('Not a Spotify playlist, album, track or artist link')
+    if source[0] == 'artist' and discography:
+        source = ('discography', source[1])
+    key = source_key(*source)
+    return coalesce(
+        f'playlist:{key}:refresh' if refresh else f'playlist:{key}',
+        lambda: load_playlist(playlist_url, source, refresh=refresh)
+    )
+
+
+def import_playlists(playlist_urls, refresh=False, discography=False, workers=None):
+    """Import several sources concurrently
+    
+    Returns (url, playlist, error) for each url in order; a failed import
+    has playlist None and the error message instead of stopping the rest.
+    """
+    def run(playlist_url):
+        try:
+            return playlist_url, import_source(playlist_url, refresh, discography), None
+        except Exception as e:
+            print(f"Import error for {playlist_url}: {str(e)}")
+            return playlist_url, None, str(e)
+    
+    def run_in_thread(playlist_url):
+        try:
+            return run(playlist_url)
+        finally:
+            # Worker threads don't get Django's end-of-request cleanup
+            connection.close()
+    
+    workers = workers or get_batch_workers()
+    if workers <= 1 or len(playlist_urls) <= 1:
+        return [run(playlist_url) for playlist_url in playlist_urls]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_in_thread, playlist_urls))
+
+
+def enrich_playlist(sp, playlist, timer=None):
+    """Batch-fill ISRCs Spotify's playlist pages left out; never fails the import"""
+    try:
+        enrich_tracks(sp, playlist.tracks.all(), timer)
+    except Exception as e:
+        print(f"Track enrichment error: {str(e)}")
+
+
+def stream_playlist_response(playlist):
+    """Stream {"playlist": ..., "tracks": [...]} without materializing every track"""
+    batch_size = get_import_batch_size()
+    
+    def generate():
+        yield b'{"playlist":' + dumps(PlaylistSummarySerializer(playlist).data) + b',"tracks":['
+        
+        # One serializer for every row: a ListSerializer per batch would form a
+        # parent/child reference cycle that keeps the batch alive until the GC runs
+        serializer = TrackSerializer()
+        batch = []
+        separator = b''
+        for track in playlist.tracks.all().iterator(chunk_size=batch_size):
+            batch.append(serializer.to_representation(track))
+            if len(batch) >= batch_size:
+                yield separator + dumps(batch)[1:-1]
+                separator = b','
+                batch = []
+        if batch:
+            yield separator + dumps(batch)[1:-1]
+        yield b']}'
+    
+    return StreamingHttpResponse(generate(), content_type='application/json')
 
 
 @api_view(['POST'])
 def get_playlist_tracks(request):
-    """API endpoint to get playlist tracks from Spotify"""
+    """API endpoint to get playlist tracks from Spotify
+    
+    playlist_url may also be an album, track or artist link (an artist's top
+    tracks, or with "discography": true all their albums and singles). Send
+    "refresh": true to resync a playlist that was imported before.
+    """
     try:
         data = request.data
         playlist_url = data.get('playlist_url', '').strip()
@@ -48,72 +223,27 @@ def get_playlist_tracks(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        playlist_id = extract_playlist_id(playlist_url)
-        sp = create_spotify_client()
-        
-        # Check if playlist already exists in database
-        existing_playlist = Playlist.objects.filter(spotify_id=playlist_id).first()
-        if existing_playlist:
-            serializer = PlaylistSerializer(existing_playlist)
-            return Response({
-                'playlist': serializer.data,
-                'tracks': TrackSerializer(existing_playlist.tracks.all(), many=True).data
-            })
-        
-        # Get playlist info from Spotify
+        # Concurrent requests for the same playlist share one import
         try:
-            playlist_info = sp.playlist(playlist_id)
+            playlist = import_source(
+                playlist_url, refresh=bool(data.get('refresh', False)),
+                discography=bool(data.get('discography', False))
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except spotipy.exceptions.SpotifyException as e:
             return Response(
                 {'error': f'Playlist not found or not accessible: {str(e)}'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Create playlist record
-        playlist = Playlist.objects.create(
-            spotify_url=playlist_url,
-            spotify_id=playlist_id,
-            title=playlist_info['name'],
-            owner=playlist_info['owner']['display_name'],
-            total_tracks=playlist_info['tracks']['total'],
-            is_public=playlist_info.get('public', True)
-        )
-        
-        # Get all tracks
-        tracks_data = []
-        results = sp.playlist_tracks(playlist_id)
-        track_objects = []
-        
-        while results:
-            for item in results['items']:
-                track_info = item.get('track')
-                if track_info and track_info['type'] == 'track':
-                    # Create track object
-                    track = Track(
-                        playlist=playlist,
-                        title=track_info['name'],
-                        artist=', '.join([artist['name'] for artist in track_info['artists']]),
-                        album=track_info['album']['name'],
-                        duration_ms=track_info.get('duration_ms'),
-                        spotify_id=track_info['id'],
-                        preview_url=track_info.get('preview_url'),
-                        youtube_search_query=f"{', '.join([artist['name'] for artist in track_info['artists']])} {track_info['name']}"
-                    )
-                    track_objects.append(track)
-            
-            # Get next page
-            results = sp.next(results) if results['next'] else None
-        
-        # Bulk create tracks
-        Track.objects.bulk_create(track_objects)
-        
-        # Update playlist track count
-        playlist.total_tracks = len(track_objects)
-        playlist.save()
+        # Large playlists are streamed from the database batch by batch
+        if playlist.total_tracks > getattr(settings, 'PLAYLIST_STREAM_THRESHOLD', 500):
+            return stream_playlist_response(playlist)
         
         # Return playlist and tracks data
         playlist_serializer = PlaylistSerializer(playlist)
-        track_serializer = TrackSerializer(track_objects, many=True)
+        track_serializer = TrackSerializer(playlist.tracks.all(), many=True)
         
         return Response({
             'playlist': playlist_serializer.data,
@@ -127,6 +257,79 @@ def get_playlist_tracks(request):
         )
 
 
+@api_view(['POST'])
+def bulk_import_playlists(request):
+    """Import many playlists (or album, track, artist links) in one call
+    
+    Body: {"playlist_urls": [...], "refresh": false, "discography": false}.
+    Imports run concurrently; the response lists each playlist (or its
+    error) and how many distinct tracks they hold together, which is how
+    many songs a mirror of all of them needs to download. The whole batch
+    runs inside the request, so it is capped; bigger jobs belong to the
+    mirror_playlists command.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Body must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+    playlist_urls = request.data.get('playlist_urls')
+    if not isinstance(playlist_urls, list) or not playlist_urls:
+        return Response({'error': 'playlist_urls must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = getattr(settings, 'BULK_IMPORT_MAX_PLAYLISTS', 20)
+    if len(playlist_urls) > limit:
+        return Response({
+            'error': f'At most {limit} playlists per request; '
+                     'use "python manage.py mirror_playlists --file ..." for larger batches'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    results = import_playlists(
+        [str(playlist_url).strip() for playlist_url in playlist_urls],
+        refresh=bool(request.data.get('refresh', False)),
+        discography=bool(request.data.get('discography', False))
+    )
+    playlists = [playlist for _, playlist, _ in results if playlist]
+    tracks = Track.objects.filter(playlist__in=playlists)
+    return Response({
+        'playlists': [
+            {
+                'url': playlist_url,
+                'playlist': PlaylistSummarySerializer(playlist).data if playlist else None,
+                'error': error,
+            }
+            for playlist_url, playlist, error in results
+        ],
+        'imported': len(playlists),
+        'failed': len(results) - len(playlists),
+        'total_tracks': tracks.count(),
+        'unique_tracks': tracks.values('spotify_id').distinct().count(),
+    })
+
+
+@api_view(['GET'])
+def search(request):
+    """Search imported tracks and playlists
+    
+    ?q= is matched word by word as prefixes, best match first; ?type= limits
+    the results to tracks or playlists and ?limit= caps each list (max 100).
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    kind = request.GET.get('type', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+    
+    results = {'query': query}
+    if kind in ('', 'tracks'):
+        tracks = search_objects(TRACK_INDEX, query, limit, Track.objects.select_related('playlist'))
+        results['tracks'] = TrackSearchSerializer(tracks, many=True).data
+    if kind in ('', 'playlists'):
+        playlists = search_objects(PLAYLIST_INDEX, query, limit)
+        results['playlists'] = PlaylistSummarySerializer(playlists, many=True).data
+    return Response(results)
+
+
 @api_view(['POST'])
 def create_download_session(request):
     """Create a new download session"""
@@ -181,7 +384,10 @@ def get_download_session(request, session_id):
             'tracks_processed': session.tracks_processed,
             'tracks_successful': session.tracks_successful,
             'tracks_failed': session.tracks_failed,
+            'tracks_deduplicated': session.tracks_deduplicated,
+            'bytes_saved': session.bytes_saved,
             'status': session.status,
+            'stage_timings': session.stage_timings,
             'created_at': session.created_at,
             'completed_at': session.completed_at
         })
@@ -194,21 +400,26 @@ def get_download_session(request, session_id):
 
 @api_view(['POST'])
 def update_download_progress(request, session_id):
-    """Update download progress from client-side"""
+    """Update download progress from client-side
+    
+    tracks_deduplicated and bytes_saved stay 0 unless the client sends them;
+    the bundled web page reports its savings on the page only.
+    """
     try:
-        session = DownloadSession.objects.get(session_id=session_id)
-        data = request.data
-        
-        session.tracks_processed = data.get('tracks_processed', session.tracks_processed)
-        session.tracks_successful = data.get('tracks_successful', session.tracks_successful)
-        session.tracks_failed = data.get('tracks_failed', session.tracks_failed)
-        session.status = data.get('status', session.status)
+        serializer = DownloadProgressSerializer(data=request.data, partial=True)
+        if not serializer.is_valid():
+            return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
         
-        if session.status == 'completed':
-            from django.utils import timezone
-            session.completed_at = timezone.now()
+        # Single UPDATE of only the fields sent, so concurrent workers don't
+        # overwrite each other's columns with stale values
+        fields = dict(serializer.validated_data)
+        if fields.get('status') == 'completed':
+            fields['completed_at'] = timezone.now()
         
-        session.save()
+        sessions = DownloadSession.objects.filter(session_id=session_id)
+        updated = sessions.update(**fields) if fields else sessions.count()
+        if not updated:
+            raise DownloadSession.DoesNotExist
         
         return Response({'success': True})
         
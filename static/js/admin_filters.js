@@ -0,0 +1,16 @@
+'use strict';
+// Applies an autocomplete list filter (playlist_app/admin_helpers.py) as soon
+// as a value is picked or cleared, like clicking a link in a normal filter
+window.addEventListener('load', function() {
+    django.jQuery('select[data-filter-param]').on('change', function() {
+        const url = new URL(window.location.href);
+        url.searchParams.delete('p');
+        url.searchParams.delete('after');
+        if (this.value) {
+            url.searchParams.set(this.dataset.filterParam, this.value);
+        } else {
+            url.searchParams.delete(this.dataset.filterParam);
+        }
+        window.location.href = url.toString();
+    });
+});
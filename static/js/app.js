@@ -9,6 +9,8 @@ class PlaylistDownloader {
             folderName: '',
             audioQuality: '192',
             namingPattern: 'artist-title',
+            normalizeLoudness: false,
+            writeTags: true,
             downloadPath: null
         };
         
@@ -68,6 +70,21 @@ class PlaylistDownloader {
                 this.downloadSettings.namingPattern = e.target.value;
             });
         }
+
+        const normalizeCheckbox = document.getElementById('normalizeLoudness');
+        const writeTagsCheckbox = document.getElementById('writeTags');
+
+        if (normalizeCheckbox) {
+            normalizeCheckbox.addEventListener('change', (e) => {
+                this.downloadSettings.normalizeLoudness = e.target.checked;
+            });
+        }
+
+        if (writeTagsCheckbox) {
+            writeTagsCheckbox.addEventListener('change', (e) => {
+                this.downloadSettings.writeTags = e.target.checked;
+            });
+        }
     }
 
     async loadPlaylist() {
@@ -90,7 +107,8 @@ class PlaylistDownloader {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
-                    playlist_url: playlistUrl
+                    playlist_url: playlistUrl,
+                    format: 'columnar'
                 })
             });
 
@@ -109,7 +127,9 @@ class PlaylistDownloader {
                 public: data.public
             };
             
-            this.currentTracks = data.tracks;
+            this.currentTracks = data.track_format === 'columnar'
+                ? this.tracksFromColumns(data.tracks)
+                : data.tracks;
             this.selectedTracks.clear();
 
             this.displayPlaylist();
@@ -123,6 +143,21 @@ class PlaylistDownloader {
         }
     }
 
+    tracksFromColumns(columns) {
+        // Columnar responses send one array per field: {id: [...], name: [...], ...}
+        const fields = Object.keys(columns);
+        const count = fields.length ? columns[fields[0]].length : 0;
+        const tracks = new Array(count);
+        for (let i = 0; i < count; i++) {
+            const track = {};
+            for (const field of fields) {
+                track[field] = columns[field][i];
+            }
+            tracks[i] = track;
+        }
+        return tracks;
+    }
+
     displayPlaylist() {
         const playlistInfo = document.getElementById('playlistInfo');
         if (!playlistInfo || !this.currentPlaylist) return;
@@ -257,10 +292,43 @@ class PlaylistDownloader {
         await this.performDownload(selectedTracksData);
     }
 
+    normalizedName(track) {
+        // Primary artist + title without case, accents, punctuation or
+        // featuring credits, matching playlist_app/dedup.py
+        const fold = text => (text || '').normalize('NFKD').replace(/[\u0300-\u036f]/g, '')
+            .toLowerCase().replace(/[\W_]+/g, ' ').trim();
+        const title = (track.name || '')
+            .replace(/[(\[]\s*(feat|ft|featuring|with)\b[^)\]]*[)\]]|\s-\s(feat|ft)\b.*$/gi, ' ');
+        return `${fold((track.artist || '').split(',')[0])}|${fold(title)}`;
+    }
+
+    dedupTracks(tracks) {
+        // The same song selected twice (same id, ISRC, or artist and title
+        // within 3 seconds) is downloaded once; duplicates map to the first
+        const unique = [];
+        const duplicateOf = new Map();
+        const seen = new Map();
+        for (const track of tracks) {
+            const keys = [`id:${track.id}`, track.isrc ? `isrc:${track.isrc}` : null, `name:${this.normalizedName(track)}`];
+            const original = keys.map(key => key && seen.get(key)).find(match =>
+                match && (!match.duration_ms || !track.duration_ms ||
+                          Math.abs(match.duration_ms - track.duration_ms) <= 3000));
+            if (original) {
+                duplicateOf.set(track, original);
+                continue;
+            }
+            unique.push(track);
+            keys.forEach(key => key && !seen.has(key) && seen.set(key, track));
+        }
+        return { unique, duplicateOf };
+    }
+
     async performDownload(tracks) {
         this.isDownloading = true;
         let successful = 0;
         let failed = 0;
+        const { unique, duplicateOf } = this.dedupTracks(tracks);
+        const sizes = new Map();
 
         try {
             // Create download folder if using File System Access API
@@ -269,18 +337,22 @@ class PlaylistDownloader {
                 downloadFolder = await this.createDownloadFolder();
             }
 
-            for (let i = 0; i < tracks.length; i++) {
-                const track = tracks[i];
+            if (duplicateOf.size) {
+                console.log(`Skipping ${duplicateOf.size} duplicate track(s)`);
+            }
+
+            for (let i = 0; i < unique.length; i++) {
+                const track = unique[i];
                 
                 try {
                     this.updateProgress(
-                        ((i) / tracks.length) * 100,
+                        ((i) / unique.length) * 100,
                         successful,
                         failed,
                         `Downloading: ${track.artist} - ${track.name}`
                     );
 
-                    await this.downloadTrackFromYouTube(track, downloadFolder);
+                    sizes.set(track, await this.downloadTrackFromYouTube(track, downloadFolder));
                     successful++;
                     
                 } catch (error) {
@@ -289,8 +361,13 @@ class PlaylistDownloader {
                 }
             }
 
-            this.updateProgress(100, successful, failed, 'Download complete!');
-            this.showNotification(`Download complete! ${successful} successful, ${failed} failed`, 'success');
+            let bytesSaved = 0;
+            duplicateOf.forEach(original => { bytesSaved += sizes.get(original) || 0; });
+            const savings = duplicateOf.size
+                ? `, ${duplicateOf.size} duplicates skipped (${(bytesSaved / 1e6).toFixed(1)} MB saved)`
+                : '';
+            this.updateProgress(100, successful, failed, `Download complete!${savings}`);
+            this.showNotification(`Download complete! ${successful} successful, ${failed} failed${savings}`, 'success');
 
         } catch (error) {
             console.error('Download error:', error);
@@ -300,6 +377,61 @@ class PlaylistDownloader {
         }
     }
 
+    async fetchWithRetry(url, options, maxRetries = 5) {
+        // The server answers 429 + Retry-After when its transcode slots are full
+        for (let attempt = 0; ; attempt++) {
+            const response = await fetch(url, options);
+            if (response.status !== 429 || attempt >= maxRetries) {
+                return response;
+            }
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 2 ** attempt;
+            console.log(`Server busy, retrying in ${retryAfter}s`);
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        }
+    }
+
+    async fetchResumable(url, etag, size, maxRetries = 5) {
+        // Keeps what has arrived when the connection drops and asks for the
+        // rest with Range; If-Range makes the server send the whole file
+        // instead if it changed in between
+        const chunks = [];
+        let received = 0;
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const headers = received ? { 'Range': `bytes=${received}-`, 'If-Range': etag } : {};
+                const response = await fetch(url, { headers });
+                if (response.status === 200) {
+                    chunks.length = 0;
+                    received = 0;
+                    etag = response.headers.get('ETag') || etag;
+                    size = parseInt(response.headers.get('Content-Length'), 10) || size;
+                } else if (response.status !== 206) {
+                    const error = new Error(`Audio file request failed (${response.status})`);
+                    error.fatal = true;
+                    throw error;
+                }
+                
+                const reader = response.body.getReader();
+                for (;;) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    chunks.push(value);
+                    received += value.length;
+                }
+                if (!size || received >= size) {
+                    return new Blob(chunks, { type: 'audio/mpeg' });
+                }
+                throw new Error(`Connection closed after ${received} of ${size} bytes`);
+            } catch (error) {
+                if (error.fatal || attempt >= maxRetries) {
+                    throw error;
+                }
+                console.log(`Download interrupted at ${received} bytes, resuming`);
+                await new Promise(resolve => setTimeout(resolve, Math.min(2 ** attempt, 10) * 1000));
+            }
+        }
+    }
+
     async downloadTrackFromYouTube(track, downloadFolder = null) {
         const searchQuery = `${track.artist} ${track.name}`;
         const fileName = this.generateFileName(track);
@@ -308,14 +440,25 @@ class PlaylistDownloader {
             console.log(`Downloading audio for: ${searchQuery}`);
             
             // Call Django API for local dev, Vercel for production
-            const response = await fetch('/api/download/audio/', {
+            const response = await this.fetchWithRetry('/api/download/audio/', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
                     query: searchQuery,
-                    quality: this.downloadSettings.audioQuality
+                    quality: this.downloadSettings.audioQuality,
+                    // Tags and normalization are applied in the server's single encode pass
+                    normalize: this.downloadSettings.normalizeLoudness,
+                    tags: this.downloadSettings.writeTags,
+                    track_id: track.id,
+                    title: track.name,
+                    artist: track.artist,
+                    album: track.album,
+                    // Lets the server pick the search result closest in length
+                    duration_ms: track.duration_ms,
+                    // Ask for a file URL; servers without one still send base64
+                    delivery: 'file'
                 })
             });
             
@@ -325,19 +468,24 @@ class PlaylistDownloader {
                 throw new Error(data.error || 'Download failed');
             }
             
-            // Convert base64 audio data to blob
-            const audioBytes = atob(data.audio_data);
-            const audioArray = new Uint8Array(audioBytes.length);
-            for (let i = 0; i < audioBytes.length; i++) {
-                audioArray[i] = audioBytes.charCodeAt(i);
+            let audioBlob;
+            if (data.url) {
+                audioBlob = await this.fetchResumable(data.url, data.etag, data.size);
+            } else {
+                // Convert base64 audio data to blob
+                const audioBytes = atob(data.audio_data);
+                const audioArray = new Uint8Array(audioBytes.length);
+                for (let i = 0; i < audioBytes.length; i++) {
+                    audioArray[i] = audioBytes.charCodeAt(i);
+                }
+                audioBlob = new Blob([audioArray], { type: 'audio/mpeg' });
             }
-            const audioBlob = new Blob([audioArray], { type: 'audio/mpeg' });
             
             // Trigger download with real audio data
             await this.triggerDownloadWithFolder(fileName, downloadFolder, audioBlob);
             
             console.log(`Successfully downloaded: ${fileName}`);
-            return true;
+            return audioBlob.size;
             
         } catch (error) {
             console.error(`Failed to download ${fileName}:`, error);